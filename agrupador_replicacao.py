@@ -0,0 +1,99 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+class AgrupadorReplicacao:
+    """
+    Junta as escritas a replicar em lotes (group commit). A primeira escrita de um lote
+    abre uma janela de `janela` segundos; o lote é enviado quando a janela fecha ou quando
+    chega a `max_entradas`. Uma única thread envia os lotes, na ordem das seqs.
+
+    `enviar_lote(entradas, com_ack)` envia o lote aos pares e retorna um Future por par
+    (ou uma lista vazia, sem ACK). Cada escrita recebe os Futures do lote em que entrou.
+    """
+
+    def __init__(self, enviar_lote, qtd_pares, janela=0.002, max_entradas=256):
+        self.enviar_lote = enviar_lote
+        self.qtd_pares = qtd_pares
+        self.janela = janela
+        self.max_entradas = max(1, max_entradas)
+        self.cond = threading.Condition()
+        self._lotes = []
+        self.ativo = True
+
+        self.lotes_enviados = 0
+        self.entradas_enviadas = 0
+
+        self._thread = threading.Thread(target=self._loop_envio, daemon=True)
+        self._thread.start()
+
+    def adicionar(self, entrada, com_ack=False, sozinha=False):
+        """
+        Coloca a entrada no lote em formação e retorna os Futures dos ACKs desse lote. Com
+        `sozinha` (entradas grandes, como as de carga em massa), ela vai em um lote só seu,
+        enviado sem esperar a janela e na mesma ordem das demais.
+        """
+        with self.cond:
+            if sozinha or not self._lotes or self._lotes[-1]['fechado']:
+                self._lotes.append({'prazo': time.monotonic() + self.janela, 'entradas': [], 'com_ack': False,
+                                    'fechado': False, 'futuros': [Future() for _ in range(self.qtd_pares)]})
+                self.cond.notify()
+            lote = self._lotes[-1]
+            lote['entradas'].append(entrada)
+            lote['com_ack'] = lote['com_ack'] or com_ack
+            if sozinha or len(lote['entradas']) >= self.max_entradas:
+                lote['fechado'] = True
+                self.cond.notify()
+            return lote['futuros']
+
+    def _proximo_lote(self):
+        with self.cond:
+            while True:
+                if self._lotes:
+                    lote = self._lotes[0]
+                    restante = lote['prazo'] - time.monotonic()
+                    if restante <= 0 or lote['fechado'] or not self.ativo:
+                        return self._lotes.pop(0)
+                    self.cond.wait(restante)
+                elif not self.ativo:
+                    return None
+                else:
+                    self.cond.wait(0.5)
+
+    def _loop_envio(self):
+        while True:
+            lote = self._proximo_lote()
+            if lote is None:
+                return
+            try:
+                futuros = self.enviar_lote(lote['entradas'], lote['com_ack'])
+            except Exception as e:
+                for futuro in lote['futuros']:
+                    futuro.set_exception(e)
+                continue
+            self.lotes_enviados += 1
+            self.entradas_enviadas += len(lote['entradas'])
+            for real, futuro in zip(futuros, lote['futuros']):
+                real.add_done_callback(lambda f, futuro=futuro: _copiar_resultado(f, futuro))
+
+    def estatisticas(self):
+        return {
+            'lotes': self.lotes_enviados,
+            'entradas': self.entradas_enviadas,
+            'media_por_lote': round(self.entradas_enviadas / self.lotes_enviados, 2) if self.lotes_enviados else 0.0,
+        }
+
+    def fechar(self, timeout=2.0):
+        """Envia o que ainda está pendente e encerra a thread de envio."""
+        with self.cond:
+            self.ativo = False
+            self.cond.notify()
+        self._thread.join(timeout)
+
+
+def _copiar_resultado(origem, destino):
+    if origem.exception() is not None:
+        destino.set_exception(origem.exception())
+    else:
+        destino.set_result(origem.result())
@@ -0,0 +1,614 @@
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+# Um único regex reconhece todos os tokens; espaços e comentários são descartados
+_RE_TOKEN = re.compile(r"""
+    \s*(?:
+    (?P<comentario>--(?=\s|$)[^\n]*|\#[^\n]*|/\*.*?\*/)
+  | (?P<texto>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<ident>`(?:[^`]|``)*`)
+  | (?P<numero>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<param>%s|%\(\w+\)s|\?)
+  | (?P<palavra>[A-Za-z_$@][\w$@]*)
+  | (?P<simbolo><=>|<=|>=|<>|!=|:=|\|\||&&|\S)
+    )""", re.VERBOSE | re.DOTALL | re.MULTILINE)
+
+Token = namedtuple('Token', 'tipo valor')
+
+# Literais (texto e número), identificadores `...` e comentários, com as mesmas regras do
+# _RE_TOKEN; separa o que muda entre execuções de um mesmo comando (os literais) do resto
+_RE_LITERAL = re.compile(r"""(?=[-\#/'"`0-9.])(
+    --(?=\s|$)[^\n]*|\#[^\n]*|/\*.*?\*/
+  | '(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"
+  | `(?:[^`]|``)*`
+  | (?<![\w$@.])(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?(?![\w$@.])
+    )""", re.VERBOSE | re.DOTALL)
+# Na forma de um comando, cada literal vira um texto fixo: '' para textos e '0' para números
+_MARCA_TEXTO, _MARCA_NUMERO = "''", "'0'"
+
+# tipo: primeiro verbo do comando; escrita: se precisa ser replicado; tabelas: tabelas lidas
+# (SELECT) ou alteradas (escritas), None se não foi possível identificá-las; deterministica:
+# se o resultado depende só dos dados; normalizado: o comando com os espaços normalizados
+Classificacao = namedtuple('Classificacao', 'tipo escrita tabelas deterministica normalizado')
+
+LEITURAS = frozenset(('SELECT', 'SHOW', 'DESCRIBE', 'DESC', 'EXPLAIN', 'HELP'))
+# Comandos que não leem nem alteram dados; os demais (CALL, GRANT...) são tratados como escrita
+SEM_EFEITO = frozenset(('SET', 'USE', 'BEGIN', 'START', 'COMMIT', 'ROLLBACK', 'DO'))
+_NAO_DETERMINISTICAS = frozenset(('NOW', 'RAND', 'UUID', 'UUID_SHORT', 'SYSDATE', 'CURDATE', 'CURTIME', 'CURRENT_DATE',
+                                  'CURRENT_TIME', 'CURRENT_TIMESTAMP', 'CURRENT_USER', 'UNIX_TIMESTAMP', 'UTC_DATE',
+                                  'UTC_TIME', 'UTC_TIMESTAMP', 'LOCALTIME', 'LOCALTIMESTAMP', 'LAST_INSERT_ID',
+                                  'CONNECTION_ID', 'FOUND_ROWS', 'ROW_COUNT', 'SLEEP', 'DATABASE', 'USER'))
+_FIM_DE_ORIGEM = frozenset(('WHERE', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'CROSS', 'NATURAL', 'STRAIGHT_JOIN', 'ON', 'USING',
+                            'GROUP', 'ORDER', 'LIMIT', 'HAVING', 'UNION', 'FOR', 'LOCK', 'SET', 'WINDOW', 'INTO',
+                            'PARTITION', 'USE', 'IGNORE', 'FORCE', 'VALUES', 'SELECT', 'OUTER'))
+_MODIFICADORES = frozenset(('LOW_PRIORITY', 'DELAYED', 'HIGH_PRIORITY', 'IGNORE', 'QUICK', 'INTO'))
+
+
+def tokenizar(sql):
+    """Separa o SQL em tokens (palavra, ident, texto, numero, param, simbolo)."""
+    tokens = [Token(m.lastgroup, m.group(m.lastgroup)) for m in _RE_TOKEN.finditer(sql) if m.lastgroup != 'comentario']
+    while tokens and tokens[-1].valor == ';':
+        tokens.pop()
+    return tokens
+
+
+def _palavra(token):
+    return token.valor.upper() if token.tipo == 'palavra' else None
+
+
+def _nome(token):
+    """Nome de tabela/coluna de um token palavra ou `ident`, em minúsculas; None para outros tokens."""
+    if token.tipo == 'ident':
+        return token.valor[1:-1].replace('``', '`').lower()
+    if token.tipo == 'palavra':
+        return token.valor.lower()
+    return None
+
+
+def _referencia_tabela(tokens, i):
+    """Lê `[banco.]tabela [[AS] apelido]` a partir de `i`; retorna (tabela, próximo índice) ou (None, i)."""
+    if i >= len(tokens) or _nome(tokens[i]) is None or _palavra(tokens[i]) in _FIM_DE_ORIGEM:
+        return None, i
+    tabela, i = _nome(tokens[i]), i + 1
+    if i + 1 < len(tokens) and tokens[i].valor == '.' and _nome(tokens[i + 1]) is not None:
+        tabela, i = _nome(tokens[i + 1]), i + 2
+    if i < len(tokens) and _palavra(tokens[i]) == 'AS':
+        i += 1
+    if i < len(tokens) and _nome(tokens[i]) is not None and _palavra(tokens[i]) not in _FIM_DE_ORIGEM:
+        i += 1
+    return tabela, i
+
+
+def _lista_de_tabelas(tokens, i, tabelas):
+    """Lê uma lista de referências separadas por vírgula; retorna o índice seguinte ou None se não reconheceu."""
+    while True:
+        if i < len(tokens) and tokens[i].valor == '(':
+            return i  # subconsulta ou junção entre parênteses: as tabelas aparecem nos FROM/JOIN internos
+        tabela, i = _referencia_tabela(tokens, i)
+        if tabela is None:
+            return None
+        tabelas.add(tabela)
+        if i < len(tokens) and tokens[i].valor == ',':
+            i += 1
+            continue
+        return i
+
+
+def _tabelas_de_origem(tokens, inicio=0):
+    """Tabelas citadas em FROM/JOIN/USING a partir de `inicio`; None se alguma não foi reconhecida."""
+    tabelas = set()
+    for i in range(inicio, len(tokens)):
+        palavra = _palavra(tokens[i])
+        if palavra in ('FROM', 'JOIN', 'STRAIGHT_JOIN') or (
+                palavra == 'USING' and i + 1 < len(tokens) and tokens[i + 1].valor != '('):
+            if _lista_de_tabelas(tokens, i + 1, tabelas) is None:
+                return None
+    return tabelas
+
+
+def _verbo_principal(tokens):
+    """Primeiro verbo do comando, pulando parênteses iniciais e a lista de CTEs de um WITH."""
+    profundidade, com_cte = 0, False
+    for token in tokens:
+        if token.valor == '(':
+            profundidade += 1
+        elif token.valor == ')':
+            profundidade -= 1
+        elif token.tipo == 'palavra':
+            palavra = token.valor.upper()
+            if palavra == 'WITH' and not com_cte:
+                com_cte = True
+            elif not com_cte or (profundidade == 0 and palavra in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')):
+                return palavra
+    return ''
+
+
+def _tabelas_alteradas(tipo, tokens):
+    palavras = [_palavra(t) for t in tokens]
+    if tipo in ('INSERT', 'REPLACE'):
+        i = palavras.index(tipo) + 1
+        while i < len(tokens) and palavras[i] in _MODIFICADORES:
+            i += 1
+        tabela, _ = _referencia_tabela(tokens, i)
+        return {tabela} if tabela else None
+    if tipo == 'UPDATE':
+        i = palavras.index('UPDATE') + 1
+        while i < len(tokens) and palavras[i] in _MODIFICADORES:
+            i += 1
+        fim = palavras.index('SET') if 'SET' in palavras else len(tokens)
+        tabelas = set()
+        if _lista_de_tabelas(tokens[:fim], i, tabelas) is None:
+            return None
+        # Junções antes do SET: todas as tabelas da junção podem ser alteradas
+        extras = _tabelas_de_origem(tokens[:fim], i)
+        return (tabelas | extras) if extras is not None and tabelas else None
+    if tipo == 'DELETE':
+        i = palavras.index('DELETE') + 1
+        while i < len(tokens) and palavras[i] in _MODIFICADORES:
+            i += 1
+        tabelas = set()
+        # DELETE t1, t2 FROM ...: as tabelas antes do FROM são as alteradas
+        if i < len(tokens) and palavras[i] != 'FROM':
+            while i < len(tokens) and palavras[i] != 'FROM':
+                if _nome(tokens[i]) is not None and tokens[i].tipo in ('palavra', 'ident'):
+                    if i + 1 >= len(tokens) or tokens[i + 1].valor != '.':
+                        tabelas.add(_nome(tokens[i]))
+                i += 1
+        origem = _tabelas_de_origem(tokens, i)
+        if origem is None:
+            return None
+        return (tabelas | origem) or None
+    if tipo == 'TRUNCATE':
+        i = 2 if len(tokens) > 1 and palavras[1] == 'TABLE' else 1
+        tabela, _ = _referencia_tabela(tokens, i)
+        return {tabela} if tabela else None
+    if tipo in ('CREATE', 'DROP', 'ALTER'):
+        if 'TABLE' not in palavras:
+            if tipo in ('CREATE', 'DROP') and 'INDEX' in palavras and 'ON' in palavras:
+                tabela, _ = _referencia_tabela(tokens, palavras.index('ON') + 1)
+                return {tabela} if tabela else None
+            return None
+        i = palavras.index('TABLE') + 1
+        while i < len(tokens) and palavras[i] in ('IF', 'NOT', 'EXISTS'):
+            i += 1
+        tabelas = set()
+        while i < len(tokens):
+            tabela, i = _referencia_tabela(tokens, i)
+            if tabela is None:
+                break
+            tabelas.add(tabela)
+            # DROP TABLE a, b
+            if i < len(tokens) and tokens[i].valor == ',' and tipo == 'DROP':
+                i += 1
+                continue
+            break
+        return tabelas or None
+    return None
+
+
+def _forma(sql):
+    """
+    Retorna (forma, literais): o comando sem comentários e com cada literal trocado por uma
+    marca, e o texto dos literais na ordem em que aparecem. Comandos que só diferem nos
+    literais têm a mesma forma.
+    """
+    partes = _RE_LITERAL.split(sql)
+    if len(partes) == 1:
+        return sql, []
+    literais = []
+    for i in range(1, len(partes), 2):
+        parte = partes[i]
+        inicio = parte[0]
+        if inicio == "'" or inicio == '"':
+            literais.append(parte)
+            partes[i] = _MARCA_TEXTO
+        elif inicio == '`':
+            continue
+        elif inicio in '-#/':
+            partes[i] = ' '
+        else:
+            literais.append(parte)
+            partes[i] = _MARCA_NUMERO
+    return ''.join(partes), literais
+
+
+def _remontar(modelo, literais):
+    """Tokens do comando com a forma de `modelo` e estes `literais`."""
+    tokens = list(modelo.tokens)
+    for i, literal in zip(modelo.posicoes, literais):
+        tokens[i] = Token('numero' if tokens[i].valor == _MARCA_NUMERO else 'texto', literal)
+    return tokens
+
+
+def _classificar(sql):
+    return _classificar_tokens(tokenizar(sql))
+
+
+def _classificar_tokens(tokens):
+    normalizado = ' '.join(t.valor for t in tokens)
+    comandos = [[]]
+    for token in tokens:
+        if token.valor == ';':
+            comandos.append([])
+        else:
+            comandos[-1].append(token)
+    comandos = [c for c in comandos if c]
+    if len(comandos) <= 1:
+        return _classificar_comando(tokens, normalizado)
+    # Vários comandos num só texto: o conector executa todos, então basta um deles escrever para
+    # o texto inteiro ser uma escrita replicada. As tabelas ficam desconhecidas (invalida todo o
+    # cache e serializa a aplicação), e o resultado nunca entra no cache de leituras.
+    classificacoes = [_classificar_comando(c, normalizado) for c in comandos]
+    escritas = [c for c in classificacoes if c.escrita]
+    principal = escritas[0] if escritas else classificacoes[0]
+    return Classificacao(principal.tipo, bool(escritas), None, False, normalizado)
+
+
+def _classificar_comando(tokens, normalizado):
+    tipo = _verbo_principal(tokens)
+    if tipo in LEITURAS or tipo in SEM_EFEITO:
+        tabelas = _tabelas_de_origem(tokens) if tipo == 'SELECT' else None
+        deterministica = tipo == 'SELECT' and not any(
+            t.tipo == 'palavra' and (t.valor.upper() in _NAO_DETERMINISTICAS or t.valor[0] == '@') for t in tokens)
+        palavras = [_palavra(t) for t in tokens]
+        if ('FOR' in palavras and 'UPDATE' in palavras) or 'LOCK' in palavras or 'INTO' in palavras:
+            deterministica = False  # SELECT ... FOR UPDATE / LOCK IN SHARE MODE / INTO @var
+        return Classificacao(tipo, False, frozenset(tabelas) if tabelas else None, deterministica, normalizado)
+    tabelas = _tabelas_alteradas(tipo, tokens)
+    return Classificacao(tipo, True, frozenset(tabelas) if tabelas else None, False, normalizado)
+
+
+# Classificação e tokens da forma de um comando; `posicoes` são os índices das marcas dos
+# literais em `tokens` e `molde` é o comando normalizado com %s no lugar de cada literal
+_Modelo = namedtuple('_Modelo', 'classificacao tokens posicoes molde')
+
+
+def _modelar(sql, forma, literais):
+    """
+    Modelo da forma de `sql`, ou None se a forma não reproduz os tokens do próprio comando (as
+    marcas se juntaram a um token vizinho, por exemplo): aí o comando é guardado sozinho.
+    """
+    tokens = tokenizar(sql)
+    tokens_forma = tokenizar(forma)
+    posicoes = tuple(i for i, t in enumerate(tokens_forma) if t.tipo == 'texto')
+    marcas = set(posicoes)
+    molde = ' '.join('%s' if i in marcas else t.valor.replace('%', '%%') for i, t in enumerate(tokens_forma))
+    modelo = _Modelo(_classificar_tokens(tokens)._replace(normalizado=None), tuple(tokens_forma), posicoes, molde)
+    if len(posicoes) != len(literais) or _remontar(modelo, literais) != tokens:
+        return None
+    return modelo
+
+
+class AnalisadorSql:
+    """
+    Classifica comandos SQL guardando o resultado das últimas `max_entradas` formas distintas
+    (LRU). A forma é o comando com os literais trocados por marcas (ver `_forma`), então todas
+    as execuções de um mesmo comando com valores diferentes usam a mesma entrada; os tokens de
+    cada comando são remontados a partir dos da forma, sem passar de novo pelo tokenizador.
+    """
+
+    def __init__(self, max_entradas=4096):
+        self.max_entradas = max_entradas
+        self.lock = threading.Lock()
+        self._memo = OrderedDict()
+        self.acertos = 0
+        self.falhas = 0
+
+    def _modelo(self, sql):
+        forma, literais = _forma(sql)
+        with self.lock:
+            chave = forma
+            modelo = self._memo.get(chave)
+            if modelo is None and literais:
+                chave = (sql,)
+                modelo = self._memo.get(chave)
+            if modelo is not None:
+                self.acertos += 1
+                self._memo.move_to_end(chave)
+        if modelo is None:
+            modelo = _modelar(sql, forma, literais)
+            chave = forma
+            if modelo is None:
+                # Guardado pelo próprio comando, sem literais para trocar
+                tokens = tokenizar(sql)
+                classificacao = _classificar_tokens(tokens)
+                modelo = _Modelo(classificacao._replace(normalizado=None), tuple(tokens), (),
+                                 classificacao.normalizado.replace('%', '%%'))
+                chave = (sql,)
+            with self.lock:
+                self.falhas += 1
+                self._memo[chave] = modelo
+                if len(self._memo) > self.max_entradas:
+                    self._memo.popitem(last=False)
+        return modelo, literais if modelo.posicoes else []
+
+    def classificar(self, sql):
+        modelo, literais = self._modelo(sql)
+        tipo, escrita, tabelas, deterministica, _ = modelo.classificacao
+        return Classificacao(tipo, escrita, tabelas, deterministica, modelo.molde % tuple(literais))
+
+    def analisar(self, sql):
+        """(classificação, tokens) de `sql`; os tokens são os de `tokenizar`."""
+        modelo, literais = self._modelo(sql)
+        normalizado = modelo.molde % tuple(literais)
+        return modelo.classificacao._replace(normalizado=normalizado), _remontar(modelo, literais)
+
+    def estatisticas(self):
+        with self.lock:
+            return {'entradas': len(self._memo), 'acertos': self.acertos, 'falhas': self.falhas}
+
+
+_analisador = AnalisadorSql()
+
+
+def classificar(sql):
+    """Classificação memoizada de `sql` (ver `Classificacao`)."""
+    return _analisador.classificar(sql)
+
+
+def estatisticas():
+    return _analisador.estatisticas()
+
+
+def _com_parametros(tokens, params):
+    """Troca os marcadores (%s, ?, %(nome)s) pelos valores de `params`, como tokens 'valor'."""
+    resultado, posicao = [], 0
+    for token in tokens:
+        if token.tipo == 'param':
+            try:
+                if isinstance(params, dict):
+                    valor = params[token.valor[2:-2]]
+                else:
+                    valor, posicao = params[posicao], posicao + 1
+            except (KeyError, IndexError, TypeError):
+                valor = None
+            token = Token('valor', None if valor is None else str(valor))
+        resultado.append(token)
+    return resultado
+
+
+def _literal(token):
+    if token.tipo == 'valor':
+        return token.valor
+    if token.tipo == 'texto':
+        return token.valor[1:-1].replace(token.valor[0] * 2, token.valor[0]).replace('\\' + token.valor[0], token.valor[0])
+    if token.tipo == 'numero':
+        return token.valor
+    return None
+
+
+def _igualdade_na_chave(tokens, pk):
+    """Valor de `pk` se os tokens são exatamente `[tabela.]pk = literal` (opcionalmente com LIMIT); senão None."""
+    if len(tokens) >= 2 and _palavra(tokens[-2]) == 'LIMIT' and tokens[-1].tipo == 'numero':
+        tokens = tokens[:-2]
+    if len(tokens) == 5 and tokens[1].valor == '.':
+        tokens = tokens[2:]
+    if len(tokens) == 3 and _nome(tokens[0]) == pk and tokens[1].valor == '=':
+        return _literal(tokens[2])
+    return None
+
+
+def chave_de_escrita(sql, chaves_primarias=None, params=None):
+    """
+    Retorna a linha afetada por uma escrita, para ordenar a aplicação replicada:
+    (tabela, valor da chave primária) se a escrita toca uma única linha conhecida,
+    (tabela, None) se pode tocar qualquer linha de uma tabela, ou None se a escrita pode
+    tocar várias tabelas ou não foi reconhecida (DDL, por exemplo).
+    `chaves_primarias` mapeia tabela -> coluna (padrão 'id'); `params` são os valores dos
+    marcadores de um comando parametrizado.
+    """
+    classificacao, tokens = _analisador.analisar(sql)
+    if not classificacao.escrita or not classificacao.tabelas or len(classificacao.tabelas) != 1 \
+            or classificacao.tipo not in ('INSERT', 'REPLACE', 'UPDATE', 'DELETE', 'TRUNCATE'):
+        return None
+    tabela, = classificacao.tabelas
+    pk = (chaves_primarias or {}).get(tabela, 'id').lower()
+    if params is not None:
+        tokens = _com_parametros(tokens, params)
+    palavras = [_palavra(t) for t in tokens]
+
+    if classificacao.tipo in ('INSERT', 'REPLACE'):
+        # INSERT INTO t (colunas) VALUES (valores), com uma única linha e sem ON DUPLICATE KEY
+        simbolos = [t.valor if t.tipo == 'simbolo' else None for t in tokens]
+        if '(' not in simbolos or ')' not in simbolos[simbolos.index('('):]:
+            return (tabela, None)
+        abre = simbolos.index('(')
+        fecha = simbolos.index(')', abre)
+        colunas = [_nome(t) for t in tokens[abre + 1:fecha] if t.valor != ',']
+        resto = tokens[fecha + 1:]
+        if len(resto) < 3 or _palavra(resto[0]) not in ('VALUES', 'VALUE') or resto[1].valor != '(' \
+                or resto[-1].valor != ')' or pk not in colunas:
+            return (tabela, None)
+        valores, atual, profundidade = [], [], 0
+        for token in resto[2:-1]:
+            if token.valor == '(':
+                profundidade += 1
+            elif token.valor == ')':
+                profundidade -= 1
+                if profundidade < 0:
+                    return (tabela, None)  # várias linhas
+            if token.valor == ',' and profundidade == 0:
+                valores.append(atual)
+                atual = []
+            else:
+                atual.append(token)
+        valores.append(atual)
+        if len(valores) != len(colunas):
+            return (tabela, None)
+        valor = valores[colunas.index(pk)]
+        literal = _literal(valor[0]) if len(valor) == 1 else None
+        return (tabela, literal) if literal is not None else (tabela, None)
+
+    if classificacao.tipo in ('UPDATE', 'DELETE'):
+        if 'WHERE' not in palavras:
+            return (tabela, None)
+        onde = palavras.index('WHERE')
+        if classificacao.tipo == 'UPDATE':
+            # Um SET que altera a própria chave move a linha: vale para a tabela inteira
+            atribuicoes = tokens[palavras.index('SET') + 1:onde] if 'SET' in palavras else []
+            for i, token in enumerate(atribuicoes):
+                if _nome(token) == pk and i + 1 < len(atribuicoes) and atribuicoes[i + 1].valor == '=':
+                    return (tabela, None)
+        valor = _igualdade_na_chave(tokens[onde + 1:], pk)
+        return (tabela, valor) if valor is not None else (tabela, None)
+
+    return (tabela, None)
+
+
+def chave_de_leitura(sql, chaves_primarias=None, params=None):
+    """
+    Retorna (tabela, valor da chave primária) se `sql` é um SELECT de uma única tabela que
+    só lê a linha `WHERE pk = literal` (com ORDER BY ou LIMIT opcionais); senão None.
+    """
+    classificacao, tokens = _analisador.analisar(sql)
+    if classificacao.tipo != 'SELECT' or not classificacao.tabelas or len(classificacao.tabelas) != 1:
+        return None
+    tabela, = classificacao.tabelas
+    pk = (chaves_primarias or {}).get(tabela, 'id').lower()
+    if params is not None:
+        tokens = _com_parametros(tokens, params)
+    palavras = [_palavra(t) for t in tokens]
+    # Subconsultas, junções e uniões podem ler outras linhas
+    if palavras.count('SELECT') != 1 or 'WHERE' not in palavras or any(
+            p in palavras for p in ('JOIN', 'STRAIGHT_JOIN', 'UNION', 'GROUP', 'HAVING', 'INTO')):
+        return None
+    onde = palavras.index('WHERE')
+    fim = next((i for i in range(onde + 1, len(tokens)) if palavras[i] in ('ORDER', 'FOR', 'LOCK')), len(tokens))
+    if ',' in (t.valor for t in tokens[palavras.index('FROM'):onde]):
+        return None
+    valor = _igualdade_na_chave(tokens[onde + 1:fim], pk)
+    return (tabela, valor) if valor is not None else None
+
+
+_AGREGADOS = frozenset(('COUNT', 'SUM', 'MIN', 'MAX', 'AVG'))
+# Funções de agregação que não dá para combinar a partir dos resultados parciais de cada nó
+_OUTROS_AGREGADOS = frozenset(('GROUP_CONCAT', 'STD', 'STDDEV', 'STDDEV_POP', 'STDDEV_SAMP', 'VARIANCE', 'VAR_POP',
+                               'VAR_SAMP', 'BIT_AND', 'BIT_OR', 'BIT_XOR', 'JSON_ARRAYAGG', 'JSON_OBJECTAGG'))
+_CLAUSULAS = frozenset(('FROM', 'WHERE', 'ORDER', 'LIMIT', 'GROUP', 'HAVING', 'UNION', 'FOR', 'LOCK', 'INTO', 'WINDOW',
+                        'JOIN', 'STRAIGHT_JOIN', 'PROCEDURE'))
+
+# Partes de um SELECT de uma tabela, para executá-lo em todos os nós e juntar os resultados:
+# lista, origem e onde são trechos do SQL; ordem é [(coluna, decrescente)]; agregados é
+# [(função, argumento, nome da coluna)] se a lista só tem COUNT/SUM/MIN/MAX/AVG, senão None
+PlanoDistribuido = namedtuple('PlanoDistribuido', 'tabela lista origem onde ordem ordem_sql limite deslocamento agregados')
+
+
+def _separar_por_virgula(tokens):
+    partes, atual, profundidade = [], [], 0
+    for token in tokens:
+        if token.valor == '(':
+            profundidade += 1
+        elif token.valor == ')':
+            profundidade -= 1
+        if token.valor == ',' and profundidade == 0:
+            partes.append(atual)
+            atual = []
+        else:
+            atual.append(token)
+    partes.append(atual)
+    return partes
+
+
+def _texto(tokens):
+    return ' '.join(t.valor for t in tokens)
+
+
+def _agregado(item):
+    """(função, argumento, nome da coluna) se `item` é `FUNÇÃO(argumento) [[AS] apelido]`; senão None."""
+    if len(item) < 3 or _palavra(item[0]) not in _AGREGADOS or item[1].valor != '(':
+        return None
+    profundidade = 0
+    for fim, token in enumerate(item):
+        profundidade += {'(': 1, ')': -1}.get(token.valor, 0)
+        if profundidade == 0 and fim > 0:
+            break
+    argumento, resto = item[2:fim], item[fim + 1:]
+    if not argumento or any(_palavra(t) == 'DISTINCT' for t in argumento):
+        return None
+    if resto and _palavra(resto[0]) == 'AS':
+        resto = resto[1:]
+    if len(resto) > 1 or (resto and _nome(resto[0]) is None and resto[0].tipo != 'texto'):
+        return None
+    # Sem apelido, o MySQL dá à coluna o texto da própria expressão
+    nome = (_nome(resto[0]) if resto[0].tipo != 'texto' else _literal(resto[0])) if resto else ''.join(t.valor for t in item)
+    return (_palavra(item[0]), _texto(argumento), nome)
+
+
+def plano_distribuido(sql):
+    """
+    Separa um `SELECT lista FROM tabela [WHERE ...] [ORDER BY colunas] [LIMIT ...]` de uma
+    única tabela nas partes de um PlanoDistribuido. Retorna None para o que não dá para juntar
+    a partir dos resultados de cada nó: junções, subconsultas, DISTINCT, GROUP BY, ordenação
+    por expressões ou por colunas fora da lista, e listas que misturam agregados e colunas.
+    """
+    classificacao, tokens = _analisador.analisar(sql)
+    if classificacao.tipo != 'SELECT' or not classificacao.tabelas or len(classificacao.tabelas) != 1:
+        return None
+    tabela, = classificacao.tabelas
+    palavras = [_palavra(t) for t in tokens]
+    if palavras[0] != 'SELECT' or palavras.count('SELECT') != 1 or palavras[1] in ('DISTINCT', 'DISTINCTROW', 'ALL'):
+        return None
+    clausulas, profundidade = {}, 0
+    for i, token in enumerate(tokens):
+        profundidade += {'(': 1, ')': -1}.get(token.valor, 0)
+        if profundidade == 0 and palavras[i] in _CLAUSULAS:
+            if palavras[i] in clausulas:
+                return None
+            clausulas[palavras[i]] = i
+    if set(clausulas) - {'FROM', 'WHERE', 'ORDER', 'LIMIT'} or 'FROM' not in clausulas \
+            or list(clausulas.values()) != sorted(clausulas.values()):
+        return None
+    posicoes = sorted(clausulas.values()) + [len(tokens)]
+    trecho = {palavra: tokens[i + 1:posicoes[posicoes.index(i) + 1]] for palavra, i in clausulas.items()}
+    if any(t.valor == ',' for t in trecho['FROM']):
+        return None
+
+    itens = _separar_por_virgula(tokens[1:clausulas['FROM']])
+    agregados = [_agregado(item) for item in itens]
+    if not all(agregados):
+        lista = tokens[1:clausulas['FROM']]
+        if any(_palavra(t) in _AGREGADOS | _OUTROS_AGREGADOS and i + 1 < len(lista) and lista[i + 1].valor == '('
+               for i, t in enumerate(lista)):
+            return None  # agregados misturados com colunas ou dentro de expressões
+        agregados = None
+    elif any(t.tipo == 'param' for item in itens for t in item):
+        return None  # a lista de agregados é reescrita e os marcadores mudariam de posição
+
+    ordem = []
+    if 'ORDER' in trecho:
+        if not trecho['ORDER'] or _palavra(trecho['ORDER'][0]) != 'BY':
+            return None
+        # Colunas que aparecem nas linhas do resultado: o nome ou o apelido de cada item
+        nomes, todas = set(), False
+        for item in itens:
+            if item[-1].valor == '*':
+                todas = True
+            elif _nome(item[-1]) is not None and (len(item) == 1 or (len(item) == 3 and item[1].valor == '.')
+                                                  or _palavra(item[-2]) == 'AS'):
+                nomes.add(_nome(item[-1]))
+        for item in _separar_por_virgula(trecho['ORDER'][1:]):
+            decrescente = bool(item) and _palavra(item[-1]) == 'DESC'
+            if item and _palavra(item[-1]) in ('ASC', 'DESC'):
+                item = item[:-1]
+            if len(item) == 3 and item[1].valor == '.':
+                item = item[2:]
+            if len(item) != 1 or _nome(item[0]) is None or not (todas or _nome(item[0]) in nomes):
+                return None
+            ordem.append((_nome(item[0]), decrescente))
+
+    limite, deslocamento = None, 0
+    if 'LIMIT' in trecho:
+        valores = trecho['LIMIT']
+        if [t.tipo for t in valores] == ['numero']:
+            limite = int(valores[0].valor)
+        elif [t.tipo for t in valores] == ['numero', 'simbolo', 'numero'] and valores[1].valor == ',':
+            deslocamento, limite = int(valores[0].valor), int(valores[2].valor)
+        elif len(valores) == 3 and valores[0].tipo == valores[2].tipo == 'numero' and _palavra(valores[1]) == 'OFFSET':
+            limite, deslocamento = int(valores[0].valor), int(valores[2].valor)
+        else:
+            return None
+
+    return PlanoDistribuido(tabela, _texto(tokens[1:clausulas['FROM']]), _texto(trecho['FROM']),
+                            _texto(trecho['WHERE']) if 'WHERE' in trecho else None, ordem,
+                            _texto(trecho['ORDER'][1:]) if ordem else None, limite, deslocamento, agregados)
@@ -0,0 +1,73 @@
+import bisect
+import hashlib
+
+
+def _posicao(texto):
+    """Posição no anel (inteiro de 32 bits) derivada do MD5 de `texto`."""
+    return int.from_bytes(hashlib.md5(texto.encode()).digest()[:4], 'big')
+
+
+def posicao_sql(tabela, coluna):
+    """Expressão MySQL que calcula, para cada linha de `tabela`, a mesma posição que `_posicao` dá à chave."""
+    tabela = tabela.replace("'", "''")
+    coluna = coluna.replace('`', '``')
+    return f"CAST(CONV(LEFT(MD5(CONCAT('{tabela}:', `{coluna}`)), 8), 16, 10) AS UNSIGNED)"
+
+
+class AnelHash:
+    """
+    Anel de hash consistente que distribui as linhas das tabelas particionadas entre os nós.
+
+    Cada nó ocupa `vnodes` posições no anel (nós virtuais), o que espalha por igual as faixas
+    de chaves entre os nós. A linha (tabela, chave primária) pertence aos `fator_replicacao`
+    nós distintos encontrados a partir da posição da chave, no sentido horário; o primeiro é
+    o dono principal. Incluir ou retirar um nó só muda o dono das faixas vizinhas às suas
+    posições, cerca de 1/N das chaves.
+    """
+
+    def __init__(self, ids_nos, vnodes=64, fator_replicacao=2):
+        self.vnodes = max(1, vnodes)
+        self.ids = sorted(set(ids_nos))
+        self.fator_replicacao = max(1, min(fator_replicacao, len(self.ids)))
+        pontos = sorted((_posicao(f"{id_no}#{i}"), id_no) for id_no in self.ids for i in range(self.vnodes))
+        self._posicoes = [posicao for posicao, _ in pontos]
+        self._nos = [id_no for _, id_no in pontos]
+
+    def donos(self, tabela, valor):
+        """IDs dos nós que guardam a linha de `tabela` com chave primária `valor`, o principal primeiro."""
+        if not self._posicoes:
+            return []
+        return self._donos_a_partir(bisect.bisect(self._posicoes, _posicao(f"{tabela}:{valor}")))
+
+    def _donos_a_partir(self, i):
+        donos = []
+        for j in range(len(self._nos)):
+            id_no = self._nos[(i + j) % len(self._nos)]
+            if id_no not in donos:
+                donos.append(id_no)
+                if len(donos) == self.fator_replicacao:
+                    break
+        return donos
+
+    def faixas(self, vivos):
+        """
+        Divide o anel entre os nós `vivos`: cada faixa fica com o primeiro dono vivo das suas
+        chaves, para que uma consulta a todos os nós leia cada linha uma única vez. Retorna
+        (limites, responsaveis): a faixa r vai de limites[r - 1] (inclusive) a limites[r], com
+        as pontas abertas; responsaveis[r] é None se nenhum dono da faixa está vivo.
+        """
+        if not self._posicoes:
+            return [], [None]
+        vivos = set(vivos)
+        limites, responsaveis = [], []
+        for r in range(len(self._posicoes) + 1):
+            responsavel = next((d for d in self._donos_a_partir(r % len(self._posicoes)) if d in vivos), None)
+            if responsaveis and responsaveis[-1] == responsavel:
+                continue
+            if responsaveis:
+                limites.append(self._posicoes[r - 1])
+            responsaveis.append(responsavel)
+        return limites, responsaveis
+
+    def estatisticas(self):
+        return {'nos': self.ids, 'vnodes': self.vnodes, 'fator_replicacao': self.fator_replicacao}
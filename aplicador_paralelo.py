@@ -0,0 +1,160 @@
+import queue
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import Future
+
+
+class AplicadorParalelo:
+    """
+    Aplica escritas replicadas em `workers` threads mantendo a ordem por linha.
+
+    Cada escrita chega com uma chave (ver `analisador_sql.chave_de_escrita`):
+      - (tabela, pk): vai sempre para o mesmo worker, então escritas na mesma linha
+        ficam em ordem e linhas diferentes são aplicadas em paralelo;
+      - (tabela, None): vale para a tabela inteira e só é despachada quando nenhuma
+        outra escrita da tabela está pendente em outro worker (e segura as seguintes);
+      - None: barreira global, aplicada quando nada mais está pendente.
+
+    `aplicar_lote(itens)` grava no banco um lote de itens do mesmo worker e retorna, para
+    cada um, se foi aplicado. `posicoes` guarda, por origem, a maior seq contígua concluída.
+    """
+
+    def __init__(self, id_local, aplicar_lote, workers=4, max_lote=64, limite_pendentes=10000, posicoes=None,
+                 concluidas=None):
+        self.id_local = id_local
+        self.aplicar_lote = aplicar_lote
+        self.workers = max(1, workers)
+        self.max_lote = max(1, max_lote)
+        self.limite_pendentes = max(1, limite_pendentes)
+        self.cond = threading.Condition()
+        self.filas = [queue.Queue() for _ in range(self.workers)]
+        self.ativo = True
+
+        self.posicoes = dict(posicoes or {})
+        self._recebidas = dict(self.posicoes)
+        self._concluidas = defaultdict(set)
+        for origem, seqs in (concluidas or {}).items():
+            self._concluidas[origem].update(seqs)
+            self._recebidas[origem] = max([self._recebidas.get(origem, 0)] + list(seqs))
+            self._avancar(origem)
+
+        self._pendentes = 0
+        self._globais = 0
+        self._por_tabela = defaultdict(Counter)
+        self._tabela_inteira = defaultdict(Counter)
+        self.aplicadas = 0
+        self.lotes = 0
+
+        for indice in range(self.workers):
+            threading.Thread(target=self._loop_worker, args=(indice,), daemon=True).start()
+
+    def recebida(self, origem):
+        """Maior seq de `origem` já despachada (aplicada ou em andamento)."""
+        with self.cond:
+            return self._recebidas.get(origem, 0)
+
+    def despachar(self, origem, entrada, chave):
+        """Enfileira uma entrada no worker da sua chave; retorna um Future com True/False ao concluir."""
+        futuro = Future()
+        with self.cond:
+            if entrada['seq'] <= self._recebidas.get(origem, 0):
+                futuro.set_result(True)
+                return futuro
+            if chave is None:
+                worker = 0
+                self.cond.wait_for(lambda: self._pendentes == 0 or not self.ativo)
+            else:
+                tabela, pk = chave
+                worker = hash(chave if pk is not None else tabela) % self.workers
+                # Escritas da tabela inteira esperam as de outros workers na mesma tabela, e vice-versa
+                conflitos = self._por_tabela[tabela] if pk is None else self._tabela_inteira[tabela]
+                self.cond.wait_for(lambda: not self.ativo or (
+                    self._globais == 0 and self._pendentes < self.limite_pendentes
+                    and all(w == worker for w, qtd in conflitos.items() if qtd)))
+            if not self.ativo:
+                futuro.set_result(False)
+                return futuro
+            self._registrar(chave, worker, +1)
+            self._recebidas[origem] = entrada['seq']
+        self.filas[worker].put({'origem': origem, 'entrada': entrada, 'chave': chave, 'worker': worker, 'futuro': futuro})
+        return futuro
+
+    def _registrar(self, chave, worker, delta):
+        self._pendentes += delta
+        if chave is None:
+            self._globais += delta
+            return
+        tabela, pk = chave
+        self._por_tabela[tabela][worker] += delta
+        if pk is None:
+            self._tabela_inteira[tabela][worker] += delta
+
+    def _avancar(self, origem):
+        concluidas = self._concluidas[origem]
+        posicao = self.posicoes.get(origem, 0)
+        while posicao + 1 in concluidas:
+            posicao += 1
+            concluidas.discard(posicao)
+        self.posicoes[origem] = posicao
+
+    def _loop_worker(self, indice):
+        fila = self.filas[indice]
+        while self.ativo:
+            try:
+                itens = [fila.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(itens) < self.max_lote:
+                try:
+                    itens.append(fila.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                resultados = self.aplicar_lote(itens)
+            except Exception as e:
+                print(f"[Nó {self.id_local}] Erro inesperado ao aplicar lote: {e}")
+                resultados = [False] * len(itens)
+            with self.cond:
+                for item in itens:
+                    self._registrar(item['chave'], item['worker'], -1)
+                    self._concluidas[item['origem']].add(item['entrada']['seq'])
+                    self._avancar(item['origem'])
+                self.aplicadas += len(itens)
+                self.lotes += 1
+                self.cond.notify_all()
+            for item, ok in zip(itens, resultados):
+                item['futuro'].set_result(ok)
+
+    def aguardar_ociosidade(self, timeout=None):
+        """Espera todas as entradas despachadas serem concluídas."""
+        with self.cond:
+            return self.cond.wait_for(lambda: self._pendentes == 0, timeout)
+
+    def aguardar_posicao(self, origem, seq, timeout=None):
+        """Espera a posição de `origem` chegar a `seq`; retorna False se o `timeout` acabar antes."""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.posicoes.get(origem, 0) >= seq or not self.ativo, timeout) \
+                and self.posicoes.get(origem, 0) >= seq
+
+    def redefinir(self, posicoes):
+        """Adota novas posições (após um snapshot); só deve ser chamado com o aplicador ocioso."""
+        with self.cond:
+            self.posicoes.clear()
+            self.posicoes.update(posicoes)
+            self._recebidas = dict(posicoes)
+            self._concluidas.clear()
+            self.cond.notify_all()
+
+    def estatisticas(self):
+        with self.cond:
+            return {
+                'workers': self.workers,
+                'pendentes': self._pendentes,
+                'aplicadas': self.aplicadas,
+                'media_por_lote': round(self.aplicadas / self.lotes, 2) if self.lotes else 0.0,
+            }
+
+    def fechar(self):
+        with self.cond:
+            self.ativo = False
+            self.cond.notify_all()
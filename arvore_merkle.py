@@ -0,0 +1,86 @@
+import hashlib
+
+from anel_hash import _posicao, posicao_sql
+
+
+def folha_sql(tabela, chave_primaria, profundidade):
+    """Expressão MySQL com a folha da árvore de cada linha: os `profundidade` bits mais altos da posição da chave."""
+    return f"({posicao_sql(tabela, chave_primaria)} >> {32 - profundidade})"
+
+
+def folha_da_chave(tabela, valor, profundidade):
+    """A folha da linha de `tabela` com chave primária `valor`, a mesma que `folha_sql` calcula no banco."""
+    return _posicao(f"{tabela}:{valor}") >> (32 - profundidade)
+
+
+def hash_linha_sql(colunas):
+    """
+    Expressão MySQL com um hash de 64 bits do conteúdo da linha. QUOTE distingue NULL de 'NULL'
+    e separa os valores, então colunas trocadas ou vazias não geram o mesmo texto.
+    """
+    valores = ', '.join(f"QUOTE(`{c.replace('`', '``')}`)" for c in colunas)
+    return f"CAST(CONV(LEFT(MD5(CONCAT_WS(',', {valores})), 16), 16, 10) AS UNSIGNED)"
+
+
+class ArvoreMerkle:
+    """
+    Árvore de hashes sobre as linhas de uma tabela, usada na anti-entropia entre réplicas.
+
+    O espaço de posições das chaves primárias (o mesmo do anel de hash) é dividido em
+    2^`profundidade` faixas iguais, as folhas. Cada folha resume as suas linhas pela quantidade
+    e pelo XOR dos hashes de cada linha, que não depende da ordem de leitura; cada nó interno é
+    o MD5 dos dois filhos. Duas réplicas com a mesma raiz têm as mesmas linhas; se as raízes
+    diferem, descer só pelos ramos diferentes encontra as faixas a sincronizar trocando poucos hashes.
+    """
+
+    def __init__(self, profundidade):
+        self.profundidade = profundidade
+        self._folhas = [[0, 0] for _ in range(1 << profundidade)]
+        self._niveis = None
+
+    def adicionar(self, folha, hash_linha):
+        contagem = self._folhas[folha]
+        contagem[0] += 1
+        contagem[1] ^= hash_linha
+        self._niveis = None
+
+    def _calcular(self):
+        nivel = [hashlib.md5(f"{quantidade}:{xor:016x}".encode()).hexdigest() for quantidade, xor in self._folhas]
+        niveis = [nivel]
+        while len(nivel) > 1:
+            nivel = [hashlib.md5((nivel[i] + nivel[i + 1]).encode()).hexdigest() for i in range(0, len(nivel), 2)]
+            niveis.append(nivel)
+        # niveis[0] é a raiz
+        self._niveis = niveis[::-1]
+
+    @property
+    def raiz(self):
+        return self.hashes(0, [0])[0]
+
+    @property
+    def linhas(self):
+        return sum(quantidade for quantidade, _ in self._folhas)
+
+    def hashes(self, nivel, indices):
+        """Hashes dos nós `indices` do `nivel` (0 é a raiz, `profundidade` são as folhas)."""
+        if self._niveis is None:
+            self._calcular()
+        return [self._niveis[nivel][i] for i in indices]
+
+    def folhas_diferentes(self, consultar, max_folhas=None):
+        """
+        Compara esta árvore com a de outra réplica, a partir da raiz. `consultar(nivel, indices)`
+        retorna os hashes remotos desses nós; só os filhos de nós diferentes são consultados no
+        nível seguinte. Retorna as folhas diferentes (até `max_folhas`, em ordem).
+        """
+        indices = [0]
+        for nivel in range(self.profundidade + 1):
+            remotos = consultar(nivel, indices)
+            diferentes = [i for i, local, remoto in zip(indices, self.hashes(nivel, indices), remotos) if local != remoto]
+            if nivel == self.profundidade or not diferentes:
+                return diferentes[:max_folhas]
+            # Com o limite, não adianta descer por mais ramos do que as folhas que serão corrigidas
+            if max_folhas is not None:
+                diferentes = diferentes[:max_folhas]
+            indices = [filho for i in diferentes for filho in (2 * i, 2 * i + 1)]
+        return []
@@ -0,0 +1,735 @@
+#!/usr/bin/env python3
+"""
+Benchmarks do Middleware de Banco de Dados Distribuído
+
+Os nós são iniciados localmente com um banco de dados simulado (latência
+configurável), para que os números reflitam o custo do middleware e possam ser
+reproduzidos sem Docker.
+
+Uso:
+  python benchmark.py servidor [--clientes 200] [--duracao 5] [--latencia-ms 1]
+  python benchmark.py cache [--clientes 50] [--duracao 5] [--latencia-ms 5]
+  python benchmark.py aplicacao [--escritas 5000] [--workers 4]
+  python benchmark.py snapshot [--linhas 200000]
+  python benchmark.py lote [--clientes 32] [--duracao 5] [--nos 3] [--janela-ms 2]
+  python benchmark.py analisador [--comandos 200000]
+  python benchmark.py carga [--linhas 5000] [--tamanho-lote 500]
+  python benchmark.py importacao [--linhas 200000] [--lote 2000] [--conexoes 4]
+  python benchmark.py cliente [--clientes 32] [--duracao 5] [--conexoes 4]
+  python benchmark.py roteamento [--clientes 16] [--duracao 5] [--latencias-ms 1,1,20]
+  python benchmark.py consistencia [--clientes 16] [--duracao 3] [--nos 3]
+  python benchmark.py lider [--clientes 16] [--duracao 3] [--nos 3] [--espera nenhum]
+  python benchmark.py deteccao [--rodadas 20] [--duracao 600] [--jitter-ms 50] [--pausas 0.05] [--pausa-max-ms 800]
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import tempfile
+import threading
+import time
+
+import analisador_sql
+from cliente_bd import ClienteBD
+from detector_falhas import DetectorFalhas
+from importador import Importador, ler_partes
+from node import No
+from protocolo import LeitorFrames, enviar_frame, receber_resposta
+
+
+class CursorSimulado:
+    def __init__(self, conexao, dicionario=False):
+        self.conexao = conexao
+        self.banco = conexao.banco
+        self.dicionario = dicionario
+        self._linhas = []
+        self.rowcount = 0
+        self.lastrowid = None
+
+    @property
+    def column_names(self):
+        return tuple(self.banco.linhas[0]) if self.banco.linhas else ()
+
+    def execute(self, sql, params=None):
+        time.sleep(self.banco.latencia)
+        eh_select = sql.lstrip().upper().startswith('SELECT')
+        if not eh_select and self.conexao.autocommit and not self.conexao.em_transacao:
+            self.conexao._gravar()
+        consulta = eh_select and 'replicacao_' not in sql
+        self._linhas = list(self.banco.linhas) if consulta else []
+        if not self.dicionario:
+            self._linhas = [tuple(linha.values()) for linha in self._linhas]
+        self.rowcount = len(self._linhas) or 1
+
+    def executemany(self, sql, lista_params):
+        time.sleep(self.banco.latencia)
+        if self.conexao.autocommit and not self.conexao.em_transacao:
+            self.conexao._gravar()
+        self.rowcount = len(lista_params)
+
+    def fetchmany(self, tamanho=1):
+        parte, self._linhas = self._linhas[:tamanho], self._linhas[tamanho:]
+        return parte
+
+    def fetchall(self):
+        return self.fetchmany(len(self._linhas))
+
+    def close(self):
+        pass
+
+
+class ConexaoSimulada:
+    """
+    Conexão falsa: cada execute custa `latencia` e cada commit custa `latencia_commit` segundos.
+    Em autocommit, cada escrita fora de transação é um commit; `commit()` sem transação é grátis.
+    """
+
+    def __init__(self, banco):
+        self.banco = banco
+        self.autocommit = True
+        self.em_transacao = False
+
+    def cursor(self, *args, dictionary=False, **kwargs):
+        return CursorSimulado(self, dictionary)
+
+    def _gravar(self):
+        time.sleep(self.banco.latencia_commit)
+        with self.banco.lock:
+            self.banco.commits += 1
+
+    def commit(self):
+        if self.em_transacao:
+            self._gravar()
+        self.em_transacao = False
+
+    def rollback(self):
+        self.em_transacao = False
+
+    def start_transaction(self, *args, **kwargs):
+        self.em_transacao = True
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class BancoSimulado:
+    def __init__(self, latencia=0.001, latencia_commit=0.002, linhas=None):
+        self.latencia = latencia
+        self.latencia_commit = latencia_commit
+        self.linhas = linhas if linhas is not None else [{'id': i, 'name': f'usuario{i}'} for i in range(10)]
+        self.commits = 0
+        self.lock = threading.Lock()
+
+    def conectar(self):
+        return ConexaoSimulada(self)
+
+
+def iniciar_cluster_simulado(qtd_nos, porta_base, banco=None, extra_config=None, **kwargs_no):
+    """Inicia `qtd_nos` nós em 127.0.0.1 usando bancos simulados. Retorna (nós, caminho do config)."""
+    config = {'nodes': [{'id': i, 'ip': '127.0.0.1', 'port': porta_base + i, 'db_port': 0} for i in range(qtd_nos)]}
+    config.update(extra_config or {})
+    fd, caminho = tempfile.mkstemp(prefix='bench_config_', suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(config, f)
+
+    nos = []
+    for i in range(qtd_nos):
+        banco_no = banco or BancoSimulado()
+
+        class NoSimulado(No):
+            def criar_conexao(self, _banco=banco_no):
+                return _banco.conectar()
+
+        nos.append(NoSimulado(i, caminho_config=caminho, **kwargs_no))
+    return nos, caminho
+
+
+def parar_cluster(nos, caminho):
+    for no in nos:
+        no.parar()
+    if os.path.exists(caminho):
+        os.remove(caminho)
+
+
+@contextlib.contextmanager
+def silenciar_logs():
+    """Descarta os prints dos nós durante a medição (o log por query distorceria os números)."""
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+        yield
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100.0 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+def gerar_carga(info_no, criar_msg, clientes, duracao):
+    """
+    Dispara `clientes` conexões persistentes contra o nó, cada uma enviando requisições
+    em sequência por `duracao` segundos. Retorna vazão e latências.
+    """
+    latencias = []
+    erros = [0]
+    lock = threading.Lock()
+    inicio = time.perf_counter()
+    fim = inicio + duracao
+
+    def cliente(indice):
+        locais, erros_locais, n = [], 0, 0
+        try:
+            with socket.create_connection((info_no['ip'], info_no['port']), timeout=30) as s:
+                leitor = LeitorFrames(s)
+                while time.perf_counter() < fim:
+                    t0 = time.perf_counter()
+                    enviar_frame(s, criar_msg(indice, n))
+                    resposta = receber_resposta(leitor)
+                    locais.append(time.perf_counter() - t0)
+                    if resposta.get('status') != 'success':
+                        erros_locais += 1
+                    n += 1
+        except OSError:
+            erros_locais += 1
+        with lock:
+            latencias.extend(locais)
+            erros[0] += erros_locais
+
+    threads = [threading.Thread(target=cliente, args=(i,), daemon=True) for i in range(clientes)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    decorrido = time.perf_counter() - inicio
+    return {
+        'requisicoes': len(latencias),
+        'erros': erros[0],
+        'vazao': len(latencias) / decorrido,
+        'p50_ms': 1000 * percentil(latencias, 50),
+        'p99_ms': 1000 * percentil(latencias, 99),
+    }
+
+
+def _processo_no(porta_base, latencia, modo, extra_config, qtd_nos, pronto, parar):
+    with silenciar_logs():
+        nos, caminho = iniciar_cluster_simulado(qtd_nos, porta_base, banco=BancoSimulado(latencia=latencia),
+                                                modo_servidor=modo, extra_config=extra_config)
+        pronto.set()
+        parar.wait()
+        parar_cluster(nos, caminho)
+
+
+@contextlib.contextmanager
+def no_em_processo(porta_base, latencia=0.001, modo='thread', extra_config=None, qtd_nos=1):
+    """
+    Roda um nó simulado (ou um cluster de `qtd_nos`) em outro processo, para que o gerador
+    de carga não dispute o GIL com ele. Retorna o endereço do nó 0.
+    """
+    pronto, parar = multiprocessing.Event(), multiprocessing.Event()
+    processo = multiprocessing.Process(target=_processo_no,
+                                       args=(porta_base, latencia, modo, extra_config, qtd_nos, pronto, parar), daemon=True)
+    processo.start()
+    try:
+        if not pronto.wait(30):
+            raise RuntimeError("Nó simulado não iniciou")
+        yield {'id': 0, 'ip': '127.0.0.1', 'port': porta_base}
+    finally:
+        parar.set()
+        processo.join(10)
+
+
+def medir_servidor(modo, clientes, duracao, latencia, porta_base):
+    """Mede vazão e p99 de SELECTs contra um nó no modo de servidor indicado."""
+    with no_em_processo(porta_base, latencia, modo, {'pool': {'clientes': {'tamanho_max': 16}}}) as info_no:
+        msg = {'type': 'CLIENT_QUERY', 'sql': 'SELECT * FROM users'}
+        return gerar_carga(info_no, lambda i, n: msg, clientes, duracao)
+
+
+def imprimir_linha(rotulo, r):
+    print(f"  {rotulo:<14} {r['requisicoes']:>8} req  {r['vazao']:>9.1f} req/s  "
+          f"p50 {r['p50_ms']:>7.2f} ms  p99 {r['p99_ms']:>8.2f} ms  erros {r['erros']}")
+
+
+def bench_servidor(args):
+    print(f"Servidor thread x async: {args.clientes} clientes, {args.duracao}s, banco com {args.latencia_ms} ms")
+    for i, modo in enumerate(('thread', 'async')):
+        imprimir_linha(modo, medir_servidor(modo, args.clientes, args.duracao, args.latencia_ms / 1000, args.porta + 10 * i))
+
+
+def bench_cache(args):
+    print(f"Cache de leituras: {args.clientes} clientes, {args.duracao}s, banco com {args.latencia_ms} ms")
+    msg = {'type': 'CLIENT_QUERY', 'sql': 'SELECT * FROM users'}
+    for i, max_entradas in enumerate((0, 1000)):
+        extra = {'pool': {'clientes': {'tamanho_max': 16}}, 'cache': {'max_entradas': max_entradas}}
+        with no_em_processo(args.porta + 10 * i, args.latencia_ms / 1000, extra_config=extra) as info_no:
+            imprimir_linha("com cache" if max_entradas else "sem cache",
+                           gerar_carga(info_no, lambda c, n: msg, args.clientes, args.duracao))
+
+
+def medir_lote(janela_ms, clientes, duracao, qtd_nos, porta_base):
+    """Mede escritas/s com `espera='todos'` num cluster simulado, com a janela de group commit indicada."""
+    extra = {'pool': {'clientes': {'tamanho_max': 16}, 'replicacao': {'tamanho_max': 4}},
+             'replicacao': {'lote': {'janela_ms': janela_ms}, 'diretorio_log': tempfile.mkdtemp(prefix='bench_log_')}}
+    with no_em_processo(porta_base, extra_config=extra, qtd_nos=qtd_nos) as info_no:
+        time.sleep(1)
+        return gerar_carga(info_no, lambda i, n: {'type': 'CLIENT_QUERY', 'espera': 'todos',
+                                                  'sql': f"INSERT INTO users (name) VALUES ('c{i}_{n}')"},
+                           clientes, duracao)
+
+
+def bench_lote(args):
+    print(f"Group commit: {args.clientes} clientes, {args.nos} nós, {args.duracao}s, escritas com espera 'todos'")
+    for i, janela in enumerate((0, args.janela_ms)):
+        rotulo = f"janela {janela:g}ms" if janela else "sem lote"
+        imprimir_linha(rotulo, medir_lote(janela, args.clientes, args.duracao, args.nos, args.porta + 10 * i))
+
+
+def medir_aplicacao(workers, escritas, porta_base):
+    """Mede escritas/s aplicadas por um seguidor que recebe um lote grande de UPDATEs em linhas distintas."""
+    extra = {'replicacao': {'aplicacao': {'workers': workers}, 'diretorio_log': tempfile.mkdtemp(prefix='bench_log_')},
+             'pool': {'replicacao': {'tamanho_max': workers + 2}}}
+    with silenciar_logs():
+        nos, caminho = iniciar_cluster_simulado(2, porta_base, extra_config=extra)
+        try:
+            seguidor = nos[1]
+            entradas = []
+            for seq in range(1, escritas + 1):
+                sql = f"UPDATE users SET name = 'n{seq}' WHERE id = {seq % 1000}"
+                entradas.append({'sql': sql, 'checksum': seguidor.calcular_checksum(sql), 'seq': seq})
+            inicio = time.perf_counter()
+            seguidor.executar_query_replicada({'type': 'REPLICATE_BATCH', 'origin': 0, 'entradas': entradas})
+            seguidor.aplicador.aguardar_ociosidade()
+            decorrido = time.perf_counter() - inicio
+        finally:
+            parar_cluster(nos, caminho)
+    return escritas / decorrido
+
+
+def bench_aplicacao(args):
+    print(f"Aplicação no seguidor: {args.escritas} UPDATEs em 1000 linhas distintas")
+    for i, workers in enumerate(sorted({1, args.workers})):
+        vazao = medir_aplicacao(workers, args.escritas, args.porta + 10 * i)
+        print(f"  {workers:>2} worker(s)   {vazao:>9.1f} escritas/s")
+
+
+def bench_snapshot(args):
+    """Mede a vazão (linhas/s) da transferência de snapshot entre dois nós simulados."""
+    linhas = [{'id': i, 'name': f'usuario{i}', 'email': f'usuario{i}@exemplo.com'} for i in range(args.linhas)]
+    banco = BancoSimulado(latencia=0, latencia_commit=0, linhas=linhas)
+    print(f"Snapshot: {args.linhas} linhas, lotes de {args.lote}")
+    with silenciar_logs():
+        nos, caminho = iniciar_cluster_simulado(2, args.porta, banco=banco,
+                                                extra_config={'replicacao': {'lote_snapshot': args.lote}})
+        try:
+            ok = nos[1].transferir_snapshot(nos[0].eu)
+        finally:
+            parar_cluster(nos, caminho)
+    r = nos[1].ultimo_snapshot
+    if not ok or r is None:
+        print("  Falha na transferência")
+        return
+    print(f"  {r['linhas']} linhas em {r['segundos']:.2f}s ({r['linhas_por_segundo']:.0f} linhas/s)")
+
+
+def medir_carga(linhas, tamanho_lote, porta_base):
+    """Insere `linhas` linhas por uma conexão ao nó 0 de dois nós simulados, com espera 'todos'. Retorna linhas/s."""
+    extra = {'replicacao': {'diretorio_log': tempfile.mkdtemp(prefix='bench_log_')}}
+    sql = "INSERT INTO users (name, email) VALUES (%s, %s)"
+    with silenciar_logs():
+        nos, caminho = iniciar_cluster_simulado(2, porta_base, extra_config=extra)
+        time.sleep(1)
+        try:
+            with socket.create_connection((nos[0].eu['ip'], nos[0].eu['port'])) as s:
+                leitor = LeitorFrames(s)
+                inicio = time.perf_counter()
+                for i in range(0, linhas, tamanho_lote):
+                    parte = [[f'usuario{n}', f'usuario{n}@exemplo.com'] for n in range(i, min(i + tamanho_lote, linhas))]
+                    if tamanho_lote == 1:
+                        msg = {'type': 'CLIENT_QUERY', 'sql': sql, 'params': parte[0], 'espera': 'todos'}
+                    else:
+                        msg = {'type': 'CLIENT_BATCH', 'sql': sql, 'lista_params': parte, 'espera': 'todos'}
+                    enviar_frame(s, msg)
+                    resposta = receber_resposta(leitor)
+                    if resposta.get("status") != "success":
+                        raise RuntimeError(f"escrita recusada pelo nó: {resposta}")
+                decorrido = time.perf_counter() - inicio
+        finally:
+            parar_cluster(nos, caminho)
+    return linhas / decorrido
+
+
+def bench_carga(args):
+    print(f"Carga de {args.linhas} linhas em 2 nós, espera 'todos': um INSERT por mensagem x CLIENT_BATCH")
+    for i, tamanho in enumerate((1, args.tamanho_lote)):
+        rotulo = "uma por vez" if tamanho == 1 else f"lotes de {tamanho}"
+        print(f"  {rotulo:<14} {medir_carga(args.linhas, tamanho, args.porta + 10 * i):>9.1f} linhas/s")
+
+
+def bench_importacao(args):
+    """Importa um CSV gerado na hora para dois nós simulados e mede linhas/s e o pico de memória do processo."""
+    fd, arquivo = tempfile.mkstemp(prefix='bench_importacao_', suffix='.csv')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write('name,email\n')
+        for i in range(args.linhas):
+            f.write(f'usuario{i},usuario{i}@exemplo.com\n')
+    extra = {'replicacao': {'diretorio_log': tempfile.mkdtemp(prefix='bench_log_')}}
+    print(f"Importação: {args.linhas} linhas em partes de {args.lote}, {args.conexoes} conexões, 2 nós")
+    try:
+        with silenciar_logs():
+            nos, caminho = iniciar_cluster_simulado(2, args.porta, extra_config=extra)
+            try:
+                time.sleep(3)  # eleição do coordenador
+                importador = Importador([no.eu for no in nos], 'users', args.conexoes, intervalo_progresso=float('inf'))
+                resumo = importador.importar(ler_partes(arquivo, args.lote))
+            finally:
+                parar_cluster(nos, caminho)
+    finally:
+        os.remove(arquivo)
+    if resumo['erro']:
+        print(f"  Falha: {resumo['erro']}")
+        return
+    pico_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"  {resumo['linhas']} linhas em {resumo['segundos']:.2f}s ({resumo['linhas_por_segundo']:.0f} linhas/s), "
+          f"pico de memória {pico_mb:.0f} MB")
+
+
+def medir_requisicoes(requisitar, clientes, duracao):
+    """`clientes` threads chamando `requisitar()` em sequência por `duracao` segundos. Retorna vazão e latências."""
+    latencias, erros = [], [0]
+    lock = threading.Lock()
+    inicio = time.perf_counter()
+    fim = inicio + duracao
+
+    def executar():
+        locais, erros_locais = [], 0
+        while time.perf_counter() < fim:
+            t0 = time.perf_counter()
+            try:
+                if requisitar().get('status') != 'success':
+                    erros_locais += 1
+            except Exception:
+                erros_locais += 1
+            locais.append(time.perf_counter() - t0)
+        with lock:
+            latencias.extend(locais)
+            erros[0] += erros_locais
+
+    threads = [threading.Thread(target=executar, daemon=True) for _ in range(clientes)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    decorrido = time.perf_counter() - inicio
+    return {'requisicoes': len(latencias), 'erros': erros[0], 'vazao': len(latencias) / decorrido,
+            'p50_ms': 1000 * percentil(latencias, 50), 'p99_ms': 1000 * percentil(latencias, 99)}
+
+
+def medir_cliente(info_no, clientes, duracao, conexoes=None):
+    """
+    SELECTs de `clientes` threads: com `conexoes` None, cada requisição abre e fecha um
+    socket (como os antigos clientes); senão, todas dividem um ClienteBD com até `conexoes`
+    conexões persistentes.
+    """
+    msg = {'type': 'CLIENT_QUERY', 'sql': 'SELECT * FROM users'}
+    if conexoes:
+        with ClienteBD(max_conexoes=conexoes) as cliente:
+            return medir_requisicoes(lambda: cliente.requisitar(info_no, msg), clientes, duracao)
+
+    def requisitar():
+        with socket.create_connection((info_no['ip'], info_no['port']), timeout=30) as s:
+            enviar_frame(s, msg)
+            return receber_resposta(LeitorFrames(s))
+    return medir_requisicoes(requisitar, clientes, duracao)
+
+
+def bench_cliente(args):
+    print(f"Cliente: {args.clientes} threads, {args.duracao}s, socket por requisição x ClienteBD com {args.conexoes} conexões")
+    extra = {'pool': {'clientes': {'tamanho_max': 16}}, 'cache': {'max_entradas': 0}}
+    with no_em_processo(args.porta, 0.0005, extra_config=extra) as info_no:
+        imprimir_linha("socket/req", medir_cliente(info_no, args.clientes, args.duracao))
+        imprimir_linha("ClienteBD", medir_cliente(info_no, args.clientes, args.duracao, args.conexoes))
+
+
+def bench_roteamento(args):
+    """Nós independentes com bancos de latências diferentes: escolha aleatória x roteador do ClienteBD."""
+    latencias = [float(l) / 1000 for l in args.latencias_ms.split(',')]
+    print(f"Roteamento de leituras: {args.clientes} threads, {args.duracao}s, bancos com {args.latencias_ms} ms")
+    extra = {'pool': {'clientes': {'tamanho_max': 16}}, 'cache': {'max_entradas': 0}}
+    with contextlib.ExitStack() as pilha:
+        nos = [dict(pilha.enter_context(no_em_processo(args.porta + 10 * i, latencia, extra_config=extra)), id=i)
+               for i, latencia in enumerate(latencias)]
+        for rotulo, roteado in (('aleatório', False), ('roteador', True)):
+            with ClienteBD(nos) as cliente:
+                if roteado:
+                    requisitar = lambda: cliente.executar('SELECT * FROM users')
+                else:
+                    requisitar = lambda: cliente.query(random.choice(nos), 'SELECT * FROM users')
+                imprimir_linha(rotulo, medir_requisicoes(requisitar, args.clientes, args.duracao))
+
+
+def bench_consistencia(args):
+    """Latência de leituras e escritas em cada nível de consistência, medida no cliente e no nó."""
+    print(f"Consistência: {args.nos} nós, {args.clientes} threads, {args.duracao}s por nível e tipo de query")
+    extra = {'pool': {'clientes': {'tamanho_max': 16}}, 'cache': {'max_entradas': 0},
+             'replicacao': {'diretorio_log': tempfile.mkdtemp(prefix='bench_log_')}}
+    with no_em_processo(args.porta, 0.0005, extra_config=extra, qtd_nos=args.nos) as info_no, \
+            ClienteBD([info_no]) as cliente:
+        time.sleep(3)  # eleição e enlaces entre os nós
+        for nivel in ('um', 'maioria', 'todos'):
+            imprimir_linha(f"leitura {nivel}", medir_requisicoes(
+                lambda: cliente.query(info_no, "SELECT * FROM users WHERE id = 1", consistencia=nivel),
+                args.clientes, args.duracao))
+            imprimir_linha(f"escrita {nivel}", medir_requisicoes(
+                lambda: cliente.query(info_no, "UPDATE users SET name = 'x' WHERE id = 1", consistencia=nivel),
+                args.clientes, args.duracao))
+        print("  no nó (GET_STATS, seção consistencia):")
+        for chave, r in sorted(cliente.estatisticas_no(info_no)['stats']['consistencia'].items()):
+            print(f"    {chave:<16} {r['requisicoes']:>8} req  média {r['media_ms']:>7.2f} ms  p99 {r['p99_ms']:>8.2f} ms")
+
+
+def bench_lider(args):
+    """Vazão de escritas: qualquer nó aceita (multimestre) x só o coordenador, com os demais repassando a ele."""
+    print(f"Escritas multimestre x líder: {args.nos} nós, {args.clientes} threads, {args.duracao}s, espera {args.espera}")
+    for i, modo in enumerate(('multimestre', 'lider')):
+        extra = {'pool': {'clientes': {'tamanho_max': 16}},
+                 'replicacao': {'escritas': modo, 'diretorio_log': tempfile.mkdtemp(prefix='bench_log_')}}
+        porta = args.porta + 10 * i
+        with no_em_processo(porta, 0.0005, extra_config=extra, qtd_nos=args.nos), ClienteBD() as cliente:
+            nos = [{'id': n, 'ip': '127.0.0.1', 'port': porta + n} for n in range(args.nos)]
+            time.sleep(3)  # eleição e enlaces entre os nós
+            coordenador = nos[-1]  # Bully: o maior ID vence
+
+            def escrever(no):
+                return cliente.query(no, f"UPDATE users SET name = 'x' WHERE id = {random.randrange(1000)}",
+                                     espera=args.espera)
+            cenarios = [("todos os nós", lambda: escrever(random.choice(nos)))]
+            if modo == 'lider':
+                cenarios = [("coordenador", lambda: escrever(coordenador)),
+                            ("repassadas", lambda: escrever(nos[0]))] + cenarios
+            for rotulo, requisitar in cenarios:
+                imprimir_linha(f"{modo[:5]} {rotulo}", medir_requisicoes(requisitar, args.clientes, args.duracao))
+
+
+# Mistura de comandos com as armadilhas da antiga detecção por substring (palavras em literais e comentários)
+CARGA_ANALISADOR = [
+    ("SELECT * FROM users WHERE id = {i}", False),
+    ("SELECT id, name FROM users WHERE name = 'usuario{i}' ORDER BY id LIMIT 10", False),
+    ("SELECT * FROM users WHERE name = 'UPDATEd {i}'", False),
+    ("SELECT u.id FROM users u JOIN pedidos p ON p.u = u.id WHERE p.status = 'DELETED' AND u.id = {i}", False),
+    ("/* relatório: INSERT manual */ SELECT COUNT(*) FROM pedidos WHERE id > {i}", False),
+    ("SELECT created_at FROM users WHERE id = {i}", False),
+    ("SHOW TABLES", False),
+    ("INSERT INTO users (id, name) VALUES ({i}, 'usuario{i}')", True),
+    ("UPDATE users SET email = 'u{i}@exemplo.com' WHERE id = {i}", True),
+    ("DELETE FROM users WHERE id = {i}", True),
+]
+
+
+def bench_analisador(args):
+    """
+    Compara a detecção de escrita por substring com o analisador de SQL, sem e com memoização.
+    Cada comando tem literais próprios, como numa carga real: a memoização só ajuda se
+    reconhecer a forma do comando, não o texto exato.
+    """
+    comandos = [CARGA_ANALISADOR[n % len(CARGA_ANALISADOR)] for n in range(args.comandos)]
+    comandos = [(sql.format(i=n), escrita) for n, (sql, escrita) in enumerate(comandos)]
+    palavras = ["INSERT", "UPDATE", "DELETE", "CREATE", "DROP", "ALTER"]
+    analisador = analisador_sql.AnalisadorSql(max_entradas=args.memo)
+    metodos = [
+        ('substring', lambda sql: any(p in sql.upper() for p in palavras)),
+        ('tokens', lambda sql: analisador_sql._classificar(sql).escrita),
+        ('memoizado', lambda sql: analisador.classificar(sql).escrita),
+    ]
+    print(f"Detecção de escrita: {len(comandos)} comandos com literais distintos, memo de {args.memo} formas")
+    for rotulo, eh_escrita in metodos:
+        inicio = time.perf_counter()
+        erros = sum(1 for sql, escrita in comandos if eh_escrita(sql) != escrita)
+        decorrido = time.perf_counter() - inicio
+        print(f"  {rotulo:<14} {len(comandos) / decorrido:>11.0f} comandos/s  {erros:>7} classificados errado")
+    print(f"  memo: {analisador.estatisticas()}")
+
+
+class PrazoFixo:
+    """O critério anterior do monitorar_nos: um par fica offline após `prazo` segundos sem heartbeat."""
+
+    def __init__(self, prazo):
+        self.prazo = prazo
+        self._ultimo = {}
+
+    def registrar(self, par, agora):
+        self._ultimo[par] = agora
+
+    def suspeito(self, par, agora):
+        return par in self._ultimo and agora - self._ultimo[par] > self.prazo
+
+
+# rótulo, intervalo dos heartbeats, intervalo de verificação, fábrica do detector
+DETECTORES = [
+    ("prazo fixo 10s (antigo)", 2.0, 5.0, lambda: PrazoFixo(10.0)),
+    ("prazo fixo 0.5s", 0.1, 0.05, lambda: PrazoFixo(0.5)),
+    ("phi (padrão)", 0.1, 0.05, lambda: DetectorFalhas(0.1)),
+    ("phi (tolerante)", 0.5, 0.1, lambda: DetectorFalhas(0.5, desvio_minimo=0.1, pausa_aceitavel=1.0)),
+]
+
+# rótulo, jitter (ms), fração de heartbeats com pausa, pausa máxima (ms)
+CENARIOS_DETECCAO = [
+    ("rede estável", 5.0, 0.01, 200.0),
+    ("rede instável", 50.0, 0.05, 800.0),
+]
+
+
+def simular_deteccao(criar, intervalo, verificacao, duracao, jitter, prob_pausa, pausa_max, rng):
+    """
+    Simula (em tempo virtual) um par que manda heartbeats a cada `intervalo` por `duracao` segundos
+    e então cai. Cada heartbeat chega com um atraso de rede |N(0, jitter)| e, com probabilidade
+    `prob_pausa`, uma pausa de até `pausa_max` (coleta de lixo, fila cheia). O detector é consultado
+    a cada `verificacao`, como no monitorar_nos. Retorna (falsos positivos, segundos da queda à detecção).
+    """
+    detector = criar()
+    chegadas, chegada = [], 0.0
+    for k in range(1, int(duracao / intervalo) + 1):
+        atraso = abs(rng.gauss(0.0, jitter)) + (rng.uniform(0.0, pausa_max) if rng.random() < prob_pausa else 0.0)
+        chegada = max(chegada, k * intervalo + atraso)
+        chegadas.append(chegada)
+    queda = (int(duracao / intervalo) + 1) * intervalo
+    falsos, proxima, agora, offline = 0, 0, 0.0, False
+    while True:
+        agora += verificacao
+        while proxima < len(chegadas) and chegadas[proxima] <= agora:
+            detector.registrar(0, chegadas[proxima])
+            proxima += 1
+            offline = False
+        if not offline and detector.suspeito(0, agora):
+            if agora >= queda:
+                return falsos, agora - queda
+            # Par vivo declarado offline: volta a contar como vivo no próximo heartbeat, como no nó
+            falsos += 1
+            offline = True
+
+
+def bench_deteccao(args):
+    """
+    Tempo de detecção de uma queda e falsos positivos do prazo fixo x phi accrual, com jitter simulado.
+    Sem `--jitter-ms`, `--pausas` ou `--pausa-max-ms`, roda os CENARIOS_DETECCAO: numa rede estável o
+    prazo fixo curto já acerta, e numa instável o phi aprende o desvio e derruba bem menos pares vivos.
+    """
+    cenarios = CENARIOS_DETECCAO
+    if (args.jitter_ms, args.pausas, args.pausa_max_ms) != (None, None, None):
+        _, jitter_ms, pausas, pausa_max_ms = CENARIOS_DETECCAO[0]
+        cenarios = [("personalizado", jitter_ms if args.jitter_ms is None else args.jitter_ms,
+                     pausas if args.pausas is None else args.pausas,
+                     pausa_max_ms if args.pausa_max_ms is None else args.pausa_max_ms)]
+    for cenario, jitter_ms, pausas, pausa_max_ms in cenarios:
+        print(f"Detecção de falhas, {cenario}: {args.rodadas} rodadas de {args.duracao:.0f}s simulados, jitter {jitter_ms} ms, "
+              f"pausas de até {pausa_max_ms} ms em {100 * pausas:.1f}% dos heartbeats")
+        for rotulo, intervalo, verificacao, criar in DETECTORES:
+            rng = random.Random(42)
+            falsos, deteccoes = 0, []
+            for _ in range(args.rodadas):
+                f, deteccao = simular_deteccao(criar, intervalo, verificacao, args.duracao, jitter_ms / 1000.0,
+                                               pausas, pausa_max_ms / 1000.0, rng)
+                falsos += f
+                deteccoes.append(deteccao)
+            por_hora = falsos * 3600.0 / (args.rodadas * args.duracao)
+            print(f"  {rotulo:<24} heartbeat {1000 * intervalo:>5.0f} ms  detecção média {sum(deteccoes) / len(deteccoes):>6.2f} s  "
+                  f"p99 {percentil(deteccoes, 99):>6.2f} s  falsos positivos {falsos:>5} ({por_hora:.1f}/h)")
+
+
+def principal():
+    parser = argparse.ArgumentParser(description="Benchmarks do middleware")
+    parser.add_argument('--porta', type=int, default=6500, help="porta base dos nós simulados")
+    sub = parser.add_subparsers(dest='cenario', required=True)
+
+    p = sub.add_parser('servidor', help="compara os modos de servidor thread e async")
+    p.add_argument('--clientes', type=int, default=200)
+    p.add_argument('--duracao', type=float, default=5.0)
+    p.add_argument('--latencia-ms', type=float, default=1.0)
+    p.set_defaults(funcao=bench_servidor)
+
+    p = sub.add_parser('lote', help="escritas/s com e sem group commit da replicação")
+    p.add_argument('--clientes', type=int, default=32)
+    p.add_argument('--duracao', type=float, default=5.0)
+    p.add_argument('--nos', type=int, default=3)
+    p.add_argument('--janela-ms', type=float, default=2.0)
+    p.set_defaults(funcao=bench_lote)
+
+    p = sub.add_parser('cache', help="leituras repetidas com e sem cache de resultados")
+    p.add_argument('--clientes', type=int, default=50)
+    p.add_argument('--duracao', type=float, default=5.0)
+    p.add_argument('--latencia-ms', type=float, default=5.0)
+    p.set_defaults(funcao=bench_cache)
+
+    p = sub.add_parser('aplicacao', help="vazão da aplicação de replicações com 1 e N workers")
+    p.add_argument('--escritas', type=int, default=5000)
+    p.add_argument('--workers', type=int, default=4)
+    p.set_defaults(funcao=bench_aplicacao)
+
+    p = sub.add_parser('snapshot', help="vazão da transferência de snapshot entre nós")
+    p.add_argument('--linhas', type=int, default=200000)
+    p.add_argument('--lote', type=int, default=5000)
+    p.set_defaults(funcao=bench_snapshot)
+
+    p = sub.add_parser('carga', help="linhas/s inseridas uma a uma x em CLIENT_BATCH")
+    p.add_argument('--linhas', type=int, default=5000)
+    p.add_argument('--tamanho-lote', type=int, default=500)
+    p.set_defaults(funcao=bench_carga)
+
+    p = sub.add_parser('importacao', help="carga em massa de um CSV pelo importador")
+    p.add_argument('--linhas', type=int, default=200000)
+    p.add_argument('--lote', type=int, default=2000)
+    p.add_argument('--conexoes', type=int, default=4)
+    p.set_defaults(funcao=bench_importacao)
+
+    p = sub.add_parser('analisador', help="detecção de escrita por substring x analisador de SQL")
+    p.add_argument('--comandos', type=int, default=200000)
+    p.add_argument('--memo', type=int, default=4096)
+    p.set_defaults(funcao=bench_analisador)
+
+    p = sub.add_parser('cliente', help="requisições/s abrindo um socket por requisição x ClienteBD")
+    p.add_argument('--clientes', type=int, default=32)
+    p.add_argument('--duracao', type=float, default=5.0)
+    p.add_argument('--conexoes', type=int, default=4)
+    p.set_defaults(funcao=bench_cliente)
+
+    p = sub.add_parser('roteamento', help="leituras com escolha aleatória do nó x roteador por latência")
+    p.add_argument('--clientes', type=int, default=16)
+    p.add_argument('--duracao', type=float, default=5.0)
+    p.add_argument('--latencias-ms', default='1,1,20', help="latência do banco de cada nó")
+    p.set_defaults(funcao=bench_roteamento)
+
+    p = sub.add_parser('consistencia', help="latência de leituras e escritas por nível de consistência")
+    p.add_argument('--clientes', type=int, default=16)
+    p.add_argument('--duracao', type=float, default=3.0)
+    p.add_argument('--nos', type=int, default=3)
+    p.set_defaults(funcao=bench_consistencia)
+
+    p = sub.add_parser('lider', help="vazão de escritas multimestre x pelo coordenador (modo 'lider')")
+    p.add_argument('--clientes', type=int, default=16)
+    p.add_argument('--duracao', type=float, default=3.0)
+    p.add_argument('--nos', type=int, default=3)
+    p.add_argument('--espera', default='nenhum', choices=('nenhum', 'um', 'maioria', 'todos'))
+    p.set_defaults(funcao=bench_lider)
+
+    p = sub.add_parser('deteccao', help="detecção de falhas: prazo fixo x phi accrual sob jitter simulado")
+    p.add_argument('--rodadas', type=int, default=20)
+    p.add_argument('--duracao', type=float, default=600.0, help="segundos simulados de heartbeats antes da queda")
+    p.add_argument('--jitter-ms', type=float, help="desvio do atraso de rede de cada heartbeat")
+    p.add_argument('--pausas', type=float, help="fração dos heartbeats atrasados por uma pausa")
+    p.add_argument('--pausa-max-ms', type=float)
+    p.set_defaults(funcao=bench_deteccao)
+
+    args = parser.parse_args()
+    args.funcao(args)
+
+
+if __name__ == "__main__":
+    principal()
@@ -0,0 +1,111 @@
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from analisador_sql import classificar
+
+
+class CacheLeituras:
+    """
+    Cache de resultados de SELECT, indexado pelo SQL normalizado, com limite de entradas
+    (LRU), tempo de vida (`ttl`) e invalidação por tabela.
+
+    Cada tabela tem uma versão que muda a cada invalidação. Uma leitura anota as versões
+    das suas tabelas antes de ir ao banco e só é guardada se nenhuma delas mudou no meio,
+    para que uma escrita concorrente nunca deixe um resultado antigo no cache.
+    """
+
+    def __init__(self, max_entradas=1000, ttl=5.0, max_linhas=10000):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.max_linhas = max_linhas
+        self.lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._por_tabela = defaultdict(set)
+        self._versoes = defaultdict(int)
+        self._versao_global = 0
+
+        self.acertos = 0
+        self.falhas = 0
+        self.invalidacoes = 0
+        self.expiradas = 0
+
+    def obter(self, sql, params=None):
+        """
+        Retorna (linhas, ticket). `linhas` é o resultado em cache ou None; em caso de falha,
+        o `ticket` (None se a consulta não pode ser cacheada) é passado depois para `guardar`.
+        Consultas parametrizadas são indexadas pelo comando junto com os `params`.
+        """
+        classificacao = classificar(sql)
+        # Só leituras determinísticas com todas as tabelas conhecidas podem ser invalidadas com segurança
+        if classificacao.escrita or not classificacao.deterministica or not classificacao.tabelas:
+            return None, None
+        chave, tabelas = classificacao.normalizado, classificacao.tabelas
+        if params is not None:
+            chave += ' -- ' + json.dumps(params, sort_keys=True, default=str)
+        with self.lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None:
+                if entrada['expira'] > time.monotonic():
+                    self._entradas.move_to_end(chave)
+                    self.acertos += 1
+                    return entrada['linhas'], None
+                self._remover(chave)
+                self.expiradas += 1
+            self.falhas += 1
+            return None, {'chave': chave, 'tabelas': tabelas, 'versoes': self._marca(tabelas)}
+
+    def guardar(self, ticket, linhas):
+        if ticket is None or len(linhas) > self.max_linhas:
+            return
+        with self.lock:
+            if self._marca(ticket['tabelas']) != ticket['versoes']:
+                return  # uma escrita nas tabelas chegou durante a leitura
+            self._remover(ticket['chave'])
+            self._entradas[ticket['chave']] = {'linhas': linhas, 'tabelas': ticket['tabelas'],
+                                               'expira': time.monotonic() + self.ttl}
+            for tabela in ticket['tabelas']:
+                self._por_tabela[tabela].add(ticket['chave'])
+            while len(self._entradas) > self.max_entradas:
+                self._remover(next(iter(self._entradas)))
+
+    def invalidar(self, tabelas=None):
+        """Descarta os resultados que leem alguma das `tabelas` (ou todos, com None)."""
+        with self.lock:
+            self.invalidacoes += 1
+            if tabelas is None:
+                self._versao_global += 1
+                self._entradas.clear()
+                self._por_tabela.clear()
+                return
+            for tabela in tabelas:
+                self._versoes[tabela] += 1
+                for chave in list(self._por_tabela.pop(tabela, ())):
+                    self._remover(chave)
+
+    def _marca(self, tabelas):
+        return (self._versao_global,) + tuple(self._versoes[t] for t in sorted(tabelas))
+
+    def _remover(self, chave):
+        entrada = self._entradas.pop(chave, None)
+        if entrada is None:
+            return
+        for tabela in entrada['tabelas']:
+            chaves = self._por_tabela.get(tabela)
+            if chaves is not None:
+                chaves.discard(chave)
+                if not chaves:
+                    del self._por_tabela[tabela]
+
+    def estatisticas(self):
+        with self.lock:
+            consultas = self.acertos + self.falhas
+            return {
+                'entradas': len(self._entradas),
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acerto': round(self.acertos / consultas, 3) if consultas else 0.0,
+                'invalidacoes': self.invalidacoes,
+                'expiradas': self.expiradas,
+            }
@@ -1,48 +1,28 @@
-import socket
 import json
 import sys
-import random
+from cliente_bd import ClienteBD
 
-def _enviar_requisicao(ip, porta, mensagem, timeout=5.0):
+# Conexões persistentes com os nós, reaproveitadas entre as chamadas abaixo
+cliente = ClienteBD()
+
+def enviar_query(info_no, sql, espera=None, timeout_espera=None, params=None):
     """
-    Função auxiliar para enviar uma mensagem JSON para um nó e receber uma resposta JSON.
-    Retorna None se a conexão falhar.
+    Envia uma query; `espera` ('nenhum', 'um', 'maioria', 'todos') define quantos ACKs de replicação aguardar.
+    `params` (lista para %s ou dicionário para %(nome)s) são enviados à parte e o nó usa prepared statements.
     """
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(timeout)
-            s.connect((ip, porta))
-            s.sendall(json.dumps(mensagem).encode())
-            
-            # Usando recv para garantir que recebemos alguns dados, 
-            # embora para JSON curto, 16KB geralmente seja suficiente.
-            dados = s.recv(16384)
-            if dados:
-                return json.loads(dados.decode())
-    except Exception as e:
-        # Para depuração, poderia imprimir 'e', mas para fluxo de cliente retornamos None/dict de erro
-        pass
-    return None
+    return cliente.query(info_no, sql, params, espera, timeout_espera)
 
-def enviar_query(info_no, sql):
-    msg = {'type': 'CLIENT_QUERY', 'sql': sql}
-    resposta = _enviar_requisicao(info_no['ip'], info_no['port'], msg)
-    if resposta:
-        return resposta
-    return {"status": "error", "message": "Falha na conexão com o nó."}
+def enviar_lote(info_no, comandos=None, sql=None, lista_params=None, espera=None, timeout_espera=None):
+    """
+    Envia várias escritas para serem executadas em uma única transação e replicadas juntas:
+    uma lista de `comandos` (strings SQL ou dicionários {'sql', 'params'}) ou um `sql` com
+    vários conjuntos de parâmetros em `lista_params`. A resposta traz as linhas afetadas por comando.
+    """
+    return cliente.lote(info_no, comandos, sql, lista_params, espera, timeout_espera)
 
 def encontrar_coordenador(nos):
-    """Pergunta aos nós quem é o atual coordenador."""
-    print("Procurando coordenador...")
-    for no in nos:
-        msg = {'type': 'GET_COORDINATOR'}
-        resposta = _enviar_requisicao(no['ip'], no['port'], msg, timeout=2.0)
-        
-        if resposta and resposta.get('status') == 'success':
-            id_coord = resposta.get('coordinator_id')
-            if id_coord is not None:
-                return id_coord
-    return None
+    """ID do atual coordenador; o cliente o guarda e só pergunta aos nós de novo se ele mudar ou falhar."""
+    return cliente.coordenador(nos)
 
 def principal():
     try:
@@ -58,7 +38,7 @@ def principal():
         print("\nNós Disponíveis:")
         for i, n in enumerate(nos):
             print(f"{i}: Nó {n['id']} ({n['ip']}:{n['port']})")
-        print("a: Auto (Balanceamento de Carga Aleatório)")
+        print("a: Auto (leituras no nó mais rápido, escritas no coordenador)")
         print("c: Coordenador (Enviar para o Líder)")
         
         try:
@@ -69,8 +49,7 @@ def principal():
             indice_no = -1
             
             if escolha.lower() == 'a':
-                indice_no = random.randint(0, len(nos) - 1)
-                print(f"Nó selecionado automaticamente: {nos[indice_no]['id']}")
+                indice_no = None
             elif escolha.lower() == 'c':
                 id_coord = encontrar_coordenador(nos)
                 if id_coord is not None:
@@ -93,7 +72,11 @@ def principal():
             if not sql:
                 continue
                 
-            resultado = enviar_query(nos[indice_no], sql)
+            if indice_no is None:
+                resultado = cliente.executar(sql, nos=nos)
+                print(f"Nó selecionado automaticamente: {resultado.get('node')}")
+            else:
+                resultado = enviar_query(nos[indice_no], sql)
             
             print("\n--- Resultado ---")
             print(json.dumps(resultado, indent=2))
@@ -0,0 +1,654 @@
+import asyncio
+import itertools
+import socket
+import threading
+import time
+from concurrent.futures import Future
+
+from analisador_sql import chave_de_escrita, chave_de_leitura, classificar
+from anel_hash import AnelHash
+from protocolo import LeitorFrames, codificar_frame, juntar_resposta
+from roteador import Roteador
+
+# Mensagens que podem ser reenviadas sem risco mesmo que o nó já as tenha recebido
+SEM_EFEITO = {'GET_COORDINATOR', 'GET_STATS', 'SNAPSHOT'}
+
+
+class ErroCliente(Exception):
+    """Requisição sem resposta do nó (conexão perdida, nó inacessível ou tempo esgotado)."""
+
+
+class ErroConexao(ErroCliente):
+    """Não foi possível conectar ao nó: a requisição não chegou a ser enviada."""
+
+
+def mensagem_query(sql, params=None, espera=None, timeout_espera=None, consistencia=None, posicao=None):
+    msg = {'type': 'CLIENT_QUERY', 'sql': sql}
+    if params is not None:
+        msg['params'] = params
+    if espera:
+        msg['espera'] = espera
+    if timeout_espera is not None:
+        msg['timeout_espera'] = timeout_espera
+    if consistencia:
+        msg['consistencia'] = consistencia
+    if posicao:
+        msg['posicao'] = posicao
+    return msg
+
+
+def mensagem_lote(comandos=None, sql=None, lista_params=None, espera=None, timeout_espera=None):
+    msg = {'type': 'CLIENT_BATCH'}
+    if comandos is not None:
+        msg['comandos'] = [{'sql': c} if isinstance(c, str) else c for c in comandos]
+    else:
+        msg['sql'], msg['lista_params'] = sql, lista_params
+    if espera:
+        msg['espera'] = espera
+    if timeout_espera is not None:
+        msg['timeout_espera'] = timeout_espera
+    return msg
+
+
+def mensagem_carga(tabela, colunas, linhas, espera=None, timeout_espera=None):
+    msg = {'type': 'BULK_LOAD', 'tabela': tabela, 'colunas': colunas, 'linhas': linhas}
+    if espera:
+        msg['espera'] = espera
+    if timeout_espera is not None:
+        msg['timeout_espera'] = timeout_espera
+    return msg
+
+
+def recusada(resposta, no):
+    """Indica se `no` recusou a escrita sem aplicá-la por não ser o coordenador, que vem na resposta."""
+    return resposta.get('status') == 'error' and resposta.get('coordinator_id') not in (None, no.get('id'))
+
+
+def idempotente(msg):
+    """Indica se a mensagem pode ser repetida depois de enviada (leituras e consultas de estado)."""
+    if msg.get('type') in SEM_EFEITO:
+        return True
+    return msg.get('type') == 'CLIENT_QUERY' and not classificar(msg['sql']).escrita
+
+
+def _no_com_id(nos, id_no):
+    return next((n for n in nos if n['id'] == id_no), None) if id_no is not None else None
+
+
+class ConexaoCliente:
+    """
+    Conexão persistente com um nó. Cada requisição leva um `id_req` e várias podem estar em
+    andamento ao mesmo tempo (pipelining): uma thread de leitura junta os frames de cada
+    resposta, marcados com `resposta_a`, e resolve o Future da requisição correspondente.
+    Frames que não respondem a nenhuma requisição (avisos do nó) vão para `ao_avisar`.
+    """
+
+    def __init__(self, no, timeout_conexao=2.0, ao_avisar=None):
+        self.no = no
+        self.ao_avisar = ao_avisar
+        try:
+            self.sock = socket.create_connection((no['ip'], no['port']), timeout=timeout_conexao)
+        except OSError as e:
+            raise ErroConexao(f"Falha ao conectar ao Nó {no.get('id')} ({no['ip']}:{no['port']}): {e}") from e
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.ativa = True
+        self.pendentes = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._lock_envio = threading.Lock()
+        threading.Thread(target=self._loop_leitura, daemon=True).start()
+
+    @property
+    def em_andamento(self):
+        return len(self.pendentes)
+
+    def enviar(self, msg):
+        """Envia a mensagem e retorna um Future com a resposta completa."""
+        futuro = Future()
+        with self._lock:
+            if not self.ativa:
+                raise ErroConexao(f"Conexão com o Nó {self.no.get('id')} encerrada")
+            id_req = next(self._ids)
+            self.pendentes[id_req] = (futuro, [])
+        try:
+            dados = codificar_frame(dict(msg, id_req=id_req))
+            with self._lock_envio:
+                self.sock.sendall(dados)
+        except OSError as e:
+            self.fechar(ErroCliente(f"Conexão com o Nó {self.no.get('id')} perdida: {e}"))
+        except Exception:
+            with self._lock: self.pendentes.pop(id_req, None)
+            raise
+        return futuro
+
+    def abandonar(self, futuro):
+        """Esquece uma requisição cujo tempo esgotou; a resposta, se chegar, é descartada."""
+        with self._lock:
+            for id_req, (pendente, _) in list(self.pendentes.items()):
+                if pendente is futuro:
+                    del self.pendentes[id_req]
+
+    def _loop_leitura(self):
+        leitor = LeitorFrames(self.sock)
+        erro = ErroCliente(f"Conexão com o Nó {self.no.get('id')} encerrada")
+        try:
+            while True:
+                frame = leitor.ler()
+                if frame is None:
+                    break
+                if frame.get('resposta_a') is None:
+                    if self.ao_avisar is not None:
+                        self.ao_avisar(frame)
+                    continue
+                with self._lock:
+                    pendente = self.pendentes.get(frame['resposta_a'])
+                    if pendente is None:
+                        continue
+                    futuro, frames = pendente
+                    frames.append(frame)
+                    completa = not frames[0].get('stream') or frame.get('fim')
+                    if completa:
+                        del self.pendentes[frame['resposta_a']]
+                if completa and not futuro.done():
+                    resposta = juntar_resposta(frames)
+                    resposta.pop('resposta_a', None)
+                    futuro.set_result(resposta)
+        except Exception as e:
+            erro = ErroCliente(f"Conexão com o Nó {self.no.get('id')} perdida: {e}")
+        self.fechar(erro)
+
+    def fechar(self, erro=None):
+        with self._lock:
+            self.ativa = False
+            pendentes, self.pendentes = self.pendentes, {}
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        for futuro, _ in pendentes.values():
+            if not futuro.done():
+                futuro.set_exception(erro or ErroCliente("Conexão fechada"))
+
+
+class PoolNo:
+    """
+    Conexões de um cliente com um nó. Cada requisição vai para a conexão com menos requisições
+    em andamento; uma nova conexão só é aberta quando todas estão ocupadas e ainda há vaga
+    (`max_conexoes`). Acima disso as requisições passam a dividir as conexões em pipeline.
+    """
+
+    def __init__(self, no, max_conexoes=4, timeout_conexao=2.0):
+        self.no = no
+        self.max_conexoes = max(1, max_conexoes)
+        self.timeout_conexao = timeout_conexao
+        self.lock = threading.Lock()
+        self.conexoes = []
+        self.abertas = 0
+
+    def conexao(self):
+        with self.lock:
+            self.conexoes = [c for c in self.conexoes if c.ativa]
+            melhor = min(self.conexoes, key=lambda c: c.em_andamento, default=None)
+            if melhor is not None and (melhor.em_andamento == 0 or len(self.conexoes) >= self.max_conexoes):
+                return melhor
+            # Conecta dentro do lock para que requisições simultâneas não abram conexões a mais
+            nova = ConexaoCliente(self.no, self.timeout_conexao)
+            self.conexoes.append(nova)
+            self.abertas += 1
+            return nova
+
+    def fechar(self):
+        with self.lock:
+            conexoes, self.conexoes = self.conexoes, []
+        for conexao in conexoes:
+            conexao.fechar()
+
+
+class ClienteBD:
+    """
+    Cliente do banco distribuído com conexões persistentes por nó.
+
+    `requisitar` envia qualquer mensagem do protocolo e retorna a resposta completa (já com
+    as partes de resultados grandes reunidas), ou levanta ErroCliente. Falhas de conexão são
+    repetidas até `tentativas` vezes, com espera crescente a partir de `intervalo_tentativa`;
+    uma requisição que já foi enviada só é repetida se for idempotente, para que uma escrita
+    nunca seja aplicada duas vezes. `query`, `lote`, `carregar`, `coordenador` e `estatisticas_no` são
+    atalhos que, como o resto do protocolo, retornam um dicionário com `status: error` em caso
+    de falha. `executar` escolhe o nó sozinho: leituras vão ao nó indicado pelo Roteador, a
+    partir da latência e dos erros observados em todas as requisições, e escritas vão ao
+    coordenador. `ClienteBDAsync` oferece a mesma interface para asyncio.
+
+    O ID do coordenador fica guardado e só é perguntado de novo aos nós quando uma requisição
+    a ele falha ou quando alguma resposta traz um mandato mais novo que o conhecido. Com
+    `assinar_coordenador`, o cliente mantém uma conexão com um nó que avisa cada troca de
+    coordenador (SUBSCRIBE); se ela cair, o ID guardado deixa de valer até a próxima assinatura.
+
+    Com `particionamento` (a mesma seção do config.json dos nós), `executar` monta o anel de
+    hash das tabelas particionadas e manda as queries de uma única linha direto aos nós que a
+    guardam, sem passar pelo coordenador nem pelo encaminhamento entre nós.
+
+    Cada resposta de escrita traz a `posicao` da escrita no log de replicação; o cliente guarda
+    a maior de cada origem (`posicao_sessao`). Com `ler_proprias_escritas`, `executar` manda essa
+    posição nas leituras, e o nó que as recebe só responde depois de aplicar as escritas deste
+    cliente: as leituras continuam espalhadas entre as réplicas sem voltar dados anteriores a elas.
+    """
+
+    def __init__(self, nos=None, max_conexoes=4, timeout=5.0, timeout_conexao=2.0, tentativas=3,
+                 intervalo_tentativa=0.1, roteamento=None, assinar_coordenador=False, particionamento=None,
+                 ler_proprias_escritas=False):
+        self.nos = list(nos or [])
+        self.max_conexoes = max_conexoes
+        self.timeout = timeout
+        self.timeout_conexao = timeout_conexao
+        self.tentativas = max(1, tentativas)
+        self.intervalo_tentativa = intervalo_tentativa
+        self.lock = threading.Lock()
+        self.pools = {}
+        self.roteador = Roteador(self._sondar, **(roteamento or {}))
+        self.assinar_coordenador = assinar_coordenador
+        particionamento = particionamento or {}
+        self.anel = None
+        if particionamento.get('ativo') and self.nos:
+            self.anel = AnelHash([n['id'] for n in self.nos], particionamento.get('vnodes', 64),
+                                 particionamento.get('fator_replicacao', 2))
+        self.tabelas_particionadas = frozenset(t.lower() for t in particionamento.get('tabelas', ['users']))
+        self.chaves_primarias = particionamento.get('chaves_primarias', {})
+        self.ler_proprias_escritas = ler_proprias_escritas
+        self.posicao = {}
+        self.id_coordenador = None
+        self.mandato = None
+        self._assinatura = None
+        self._lock_assinatura = threading.Lock()
+        self.requisicoes = 0
+        self.repetidas = 0
+        self.falhas = 0
+        self.consultas_coordenador = 0
+        self.avisos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+    def _pool(self, no):
+        chave = (no['ip'], no['port'])
+        with self.lock:
+            pool = self.pools.get(chave)
+            if pool is None:
+                pool = self.pools[chave] = PoolNo(no, self.max_conexoes, self.timeout_conexao)
+            return pool
+
+    def enviar(self, no, msg):
+        """Envia sem esperar a resposta: retorna um Future. Levanta ErroConexao se o nó está inacessível."""
+        with self.lock: self.requisicoes += 1
+        return self._pool(no).conexao().enviar(msg)
+
+    def _sondar(self, no):
+        resposta = self.enviar(no, {'type': 'GET_COORDINATOR'}).result(self.timeout_conexao)
+        self._observar(resposta)
+        return resposta.get('status') == 'success'
+
+    def _observar(self, resposta):
+        """
+        Atualiza o coordenador guardado a partir do mandato (e do coordenador, se vier) de uma
+        resposta, e a posição da sessão a partir da posição de uma escrita.
+        """
+        if isinstance(resposta.get('posicao'), dict):
+            with self.lock:
+                for origem, seq in resposta['posicao'].items():
+                    self.posicao[origem] = max(seq, self.posicao.get(origem, 0))
+        mandato = resposta.get('mandato')
+        if mandato is None:
+            return
+        with self.lock:
+            if resposta.get('coordinator_id') is not None:
+                if self.id_coordenador is None or self.mandato is None or mandato >= self.mandato:
+                    self.id_coordenador, self.mandato = resposta['coordinator_id'], mandato
+            elif self.mandato is not None and mandato > self.mandato:
+                # Houve eleição depois que o coordenador foi guardado
+                self.id_coordenador, self.mandato = None, mandato
+
+    def _aviso(self, frame):
+        if frame.get('type') == 'COORDINATOR':
+            with self.lock: self.avisos += 1
+            self._observar(frame)
+
+    def posicao_sessao(self):
+        """Maior posição ({origem: seq}) das escritas feitas por este cliente, para mandar nas leituras."""
+        with self.lock: return dict(self.posicao)
+
+    def _posicao_da_leitura(self, sql, posicao):
+        if posicao is None and self.ler_proprias_escritas and not classificar(sql).escrita:
+            return self.posicao_sessao() or None
+        return posicao
+
+    def invalidar_coordenador(self):
+        with self.lock: self.id_coordenador = None
+
+    def _registrar_falha(self, no, erro, msg, inicio, tentativa, tentativas):
+        """Contabiliza uma tentativa que falhou e indica se ela pode ser repetida."""
+        self.roteador.registrar(no, time.monotonic() - inicio, False, isinstance(erro, ErroConexao))
+        if no.get('id') is not None and no.get('id') == self.id_coordenador:
+            self.invalidar_coordenador()
+        if tentativa + 1 >= tentativas or not (isinstance(erro, ErroConexao) or idempotente(msg)):
+            with self.lock: self.falhas += 1
+            return False
+        with self.lock: self.repetidas += 1
+        return True
+
+    # A lógica de requisitar, executar e coordenador é escrita uma vez, como geradores que
+    # emitem passos de E/S: ('requisicao', no, msg, timeout) envia e espera uma resposta,
+    # ('pausa', segundos) espera antes de repetir e ('assinatura', nos) mantém a assinatura de
+    # coordenador. ClienteBD realiza os passos bloqueando e ClienteBDAsync com await; o
+    # resultado de cada passo volta ao gerador, e um ErroCliente é levantado dentro dele.
+
+    def _conduzir(self, passos):
+        resultado, erro = None, None
+        while True:
+            try:
+                passo = passos.throw(erro) if erro is not None else passos.send(resultado)
+            except StopIteration as fim:
+                return fim.value
+            resultado, erro = None, None
+            try:
+                resultado = self._realizar(passo)
+            except ErroCliente as e:
+                erro = e
+
+    def _realizar(self, passo):
+        if passo[0] == 'requisicao':
+            _, no, msg, timeout = passo
+            futuro = None
+            try:
+                futuro = self.enviar(no, msg)
+                return futuro.result(timeout)
+            except TimeoutError:
+                self._abandonar(no, futuro)
+                raise ErroCliente(f"Sem resposta do Nó {no.get('id')} em {timeout}s") from None
+        if passo[0] == 'pausa':
+            time.sleep(passo[1])
+        elif passo[0] == 'assinatura':
+            self._manter_assinatura(passo[1])
+
+    def _passos_requisitar(self, no, msg, timeout=None, tentativas=None):
+        timeout = self.timeout if timeout is None else timeout
+        tentativas = tentativas or self.tentativas
+        for tentativa in range(tentativas):
+            self.roteador.iniciar(no)
+            inicio = time.monotonic()
+            try:
+                resposta = yield ('requisicao', no, msg, timeout)
+                self.roteador.registrar(no, time.monotonic() - inicio, True)
+                self._observar(resposta)
+                return resposta
+            except ErroCliente as e:
+                erro = e
+            if not self._registrar_falha(no, erro, msg, inicio, tentativa, tentativas):
+                raise erro
+            yield ('pausa', self.intervalo_tentativa * 2 ** tentativa)
+
+    def requisitar(self, no, msg, timeout=None, tentativas=None):
+        return self._conduzir(self._passos_requisitar(no, msg, timeout, tentativas))
+
+    def _abandonar(self, no, futuro):
+        for conexao in list(self._pool(no).conexoes):
+            conexao.abandonar(futuro)
+
+    def _ou_erro(self, no, msg, **kwargs):
+        try:
+            return self.requisitar(no, msg, **kwargs)
+        except ErroCliente as e:
+            return {'status': 'error', 'message': str(e)}
+
+    def query(self, no, sql, params=None, espera=None, timeout_espera=None, timeout=None, consistencia=None,
+              posicao=None):
+        return self._ou_erro(no, mensagem_query(sql, params, espera, timeout_espera, consistencia, posicao),
+                             timeout=timeout)
+
+    def lote(self, no, comandos=None, sql=None, lista_params=None, espera=None, timeout_espera=None, timeout=30.0):
+        return self._ou_erro(no, mensagem_lote(comandos, sql, lista_params, espera, timeout_espera), timeout=timeout)
+
+    def estatisticas_no(self, no, timeout=None):
+        return self._ou_erro(no, {'type': 'GET_STATS'}, timeout=timeout)
+
+    def donos(self, sql, params=None, nos=None):
+        """Nós que guardam a única linha lida ou escrita por `sql` numa tabela particionada; None se não for o caso."""
+        if self.anel is None:
+            return None
+        escrita = classificar(sql).escrita
+        chave = (chave_de_escrita if escrita else chave_de_leitura)(sql, self.chaves_primarias, params)
+        if chave is None or chave[1] is None or chave[0] not in self.tabelas_particionadas:
+            return None
+        nos = nos or self.nos
+        return [no for no in (_no_com_id(nos, id_no) for id_no in self.anel.donos(*chave)) if no is not None] or None
+
+    def executar(self, sql, params=None, espera=None, timeout_espera=None, nos=None, timeout=None, consistencia=None,
+                 posicao=None):
+        """
+        Envia a query sem que o chamador escolha o nó: escritas vão ao coordenador e leituras
+        ao nó escolhido pelo roteador; se ele não responder, a leitura vai a outro nó. Linhas
+        de tabelas particionadas vão aos seus donos (escritas ao principal, se ele responder).
+        Com `consistencia` ('um', 'maioria' ou 'todos'), o nó que recebe a query lê da réplica
+        mais nova entre as consultadas, ou espera as confirmações de escrita correspondentes.
+        Uma leitura com `posicao` (ou, com `ler_proprias_escritas`, a posição da sessão) só é
+        respondida por um nó que já aplicou as escritas até ela.
+        """
+        return self._conduzir(self._passos_executar(sql, params, espera, timeout_espera, nos, timeout, consistencia,
+                                                    posicao))
+
+    def _passos_executar(self, sql, params, espera, timeout_espera, nos, timeout, consistencia, posicao):
+        nos = nos or self.nos
+        msg = mensagem_query(sql, params, espera, timeout_espera, consistencia, self._posicao_da_leitura(sql, posicao))
+        donos = self.donos(sql, params, nos)
+        if donos and classificar(sql).escrita:
+            erro = None
+            for no in donos:
+                try:
+                    return (yield from self._passos_requisitar(no, msg, timeout=timeout))
+                except ErroConexao as e:
+                    erro = e
+                except ErroCliente as e:
+                    return {'status': 'error', 'message': str(e)}
+            return {'status': 'error', 'message': str(erro)}
+        if donos:
+            nos = donos
+        elif classificar(sql).escrita:
+            return (yield from self._passos_ao_coordenador(msg, nos, timeout))
+        tentados, erro = [], ErroCliente("Nenhum nó disponível")
+        while (no := self.roteador.escolher(nos, excluir=tentados)) is not None:
+            try:
+                return (yield from self._passos_requisitar(no, msg, timeout=timeout, tentativas=1))
+            except ErroCliente as e:
+                tentados.append(no)
+                erro = e
+        return {'status': 'error', 'message': str(erro)}
+
+    def _passos_ao_coordenador(self, msg, nos, timeout):
+        erro = ErroCliente("Coordenador não encontrado")
+        # Se a escrita nem chegou ao coordenador guardado, ou ele a recusou por já não ser o
+        # coordenador, vai uma vez ao coordenador atualizado
+        for _ in range(2):
+            no = _no_com_id(nos, (yield from self._passos_coordenador(nos)))
+            if no is None:
+                break
+            try:
+                resposta = yield from self._passos_requisitar(no, msg, timeout=timeout)
+            except ErroConexao as e:
+                erro = e
+                continue
+            except ErroCliente as e:
+                return {'status': 'error', 'message': str(e)}
+            if not recusada(resposta, no):
+                return resposta
+            erro = ErroCliente(resposta.get('message'))
+            with self.lock:
+                if self.id_coordenador == no['id']:
+                    self.id_coordenador = None
+        return {'status': 'error', 'message': str(erro)}
+
+    def carregar(self, tabela, colunas, linhas, espera=None, timeout_espera=None, nos=None, timeout=60.0):
+        """
+        Envia uma parte de carga em massa (BULK_LOAD, ver `importador.py`) ao coordenador, com
+        as mesmas regras das escritas de `executar`. A parte não é reenviada depois de entregue.
+        """
+        msg = mensagem_carga(tabela, colunas, linhas, espera, timeout_espera)
+        return self._conduzir(self._passos_ao_coordenador(msg, nos or self.nos, timeout))
+
+    def coordenador(self, nos=None, timeout=2.0, atualizar=False):
+        """
+        ID do coordenador: o guardado ou, se não há (ou com `atualizar`), o informado pelo
+        primeiro nó que responder, perguntando em ordem. None se nenhum nó responde.
+        """
+        return self._conduzir(self._passos_coordenador(nos, timeout, atualizar))
+
+    def _passos_coordenador(self, nos=None, timeout=2.0, atualizar=False):
+        nos = nos or self.nos
+        if self.assinar_coordenador:
+            yield ('assinatura', nos)
+        if not atualizar and self.id_coordenador is not None:
+            return self.id_coordenador
+        for no in nos:
+            with self.lock: self.consultas_coordenador += 1
+            try:
+                resposta = yield from self._passos_requisitar(no, {'type': 'GET_COORDINATOR'}, timeout, tentativas=1)
+            except ErroCliente:
+                continue
+            if resposta.get('status') == 'success' and resposta.get('coordinator_id') is not None:
+                return resposta['coordinator_id']
+        return None
+
+    def _manter_assinatura(self, nos):
+        """Garante uma conexão de avisos de coordenador aberta, com o primeiro nó em rotação que aceitar."""
+        with self._lock_assinatura:
+            if self._assinatura is not None and self._assinatura.ativa:
+                return
+            # Sem a conexão de avisos, uma troca de coordenador pode ter passado despercebida
+            self._assinatura = None
+            self.invalidar_coordenador()
+            for no in sorted(nos, key=lambda n: not self.roteador.em_rotacao(n)):
+                try:
+                    conexao = ConexaoCliente(no, self.timeout_conexao, ao_avisar=self._aviso)
+                except ErroConexao:
+                    continue
+                try:
+                    self._observar(conexao.enviar({'type': 'SUBSCRIBE'}).result(self.timeout_conexao))
+                except (ErroCliente, TimeoutError):
+                    conexao.fechar()
+                    continue
+                self._assinatura = conexao
+                return
+
+    def estatisticas(self):
+        with self.lock:
+            pools = list(self.pools.values())
+            dados = {'requisicoes': self.requisicoes, 'repetidas': self.repetidas, 'falhas': self.falhas}
+        dados['conexoes'] = {f"{p.no['ip']}:{p.no['port']}": {'abertas': p.abertas, 'ativas': len(p.conexoes)}
+                             for p in pools}
+        dados['roteamento'] = self.roteador.estatisticas()
+        with self.lock:
+            assinatura = self._assinatura
+            dados['coordenador'] = {'id': self.id_coordenador, 'mandato': self.mandato,
+                                    'consultas': self.consultas_coordenador, 'avisos': self.avisos,
+                                    'assinado_em': assinatura.no.get('id') if assinatura and assinatura.ativa else None}
+        return dados
+
+    def fechar(self):
+        with self.lock:
+            pools, self.pools = list(self.pools.values()), {}
+            assinatura, self._assinatura = self._assinatura, None
+        for pool in pools:
+            pool.fechar()
+        if assinatura is not None:
+            assinatura.fechar()
+
+
+class ClienteBDAsync:
+    """
+    Interface asyncio do ClienteBD: as mesmas conexões, regras de repetição e escolha de nó
+    (os passos do ClienteBD), com métodos `async`. A conexão com um nó é aberta fora do event
+    loop; depois disso cada requisição só escreve no socket e aguarda o Future da resposta.
+    """
+
+    def __init__(self, nos=None, **config):
+        self.cliente = ClienteBD(nos, **config)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.fechar()
+
+    async def _conduzir(self, passos):
+        resultado, erro = None, None
+        while True:
+            try:
+                passo = passos.throw(erro) if erro is not None else passos.send(resultado)
+            except StopIteration as fim:
+                return fim.value
+            resultado, erro = None, None
+            try:
+                resultado = await self._realizar(passo)
+            except ErroCliente as e:
+                erro = e
+
+    async def _realizar(self, passo):
+        cliente = self.cliente
+        loop = asyncio.get_running_loop()
+        if passo[0] == 'requisicao':
+            _, no, msg, timeout = passo
+            futuro = None
+            try:
+                futuro = await loop.run_in_executor(None, cliente.enviar, no, msg)
+                return await asyncio.wait_for(asyncio.wrap_future(futuro), timeout)
+            except TimeoutError:
+                cliente._abandonar(no, futuro)
+                raise ErroCliente(f"Sem resposta do Nó {no.get('id')} em {timeout}s") from None
+        if passo[0] == 'pausa':
+            await asyncio.sleep(passo[1])
+        elif passo[0] == 'assinatura':
+            await loop.run_in_executor(None, cliente._manter_assinatura, passo[1])
+
+    async def requisitar(self, no, msg, timeout=None, tentativas=None):
+        return await self._conduzir(self.cliente._passos_requisitar(no, msg, timeout, tentativas))
+
+    async def _ou_erro(self, no, msg, **kwargs):
+        try:
+            return await self.requisitar(no, msg, **kwargs)
+        except ErroCliente as e:
+            return {'status': 'error', 'message': str(e)}
+
+    async def query(self, no, sql, params=None, espera=None, timeout_espera=None, timeout=None, consistencia=None,
+                    posicao=None):
+        return await self._ou_erro(no, mensagem_query(sql, params, espera, timeout_espera, consistencia, posicao),
+                                   timeout=timeout)
+
+    async def lote(self, no, comandos=None, sql=None, lista_params=None, espera=None, timeout_espera=None,
+                   timeout=30.0):
+        return await self._ou_erro(no, mensagem_lote(comandos, sql, lista_params, espera, timeout_espera),
+                                   timeout=timeout)
+
+    async def estatisticas_no(self, no, timeout=None):
+        return await self._ou_erro(no, {'type': 'GET_STATS'}, timeout=timeout)
+
+    async def executar(self, sql, params=None, espera=None, timeout_espera=None, nos=None, timeout=None,
+                       consistencia=None, posicao=None):
+        return await self._conduzir(self.cliente._passos_executar(sql, params, espera, timeout_espera, nos, timeout,
+                                                                  consistencia, posicao))
+
+    async def carregar(self, tabela, colunas, linhas, espera=None, timeout_espera=None, nos=None, timeout=60.0):
+        msg = mensagem_carga(tabela, colunas, linhas, espera, timeout_espera)
+        return await self._conduzir(self.cliente._passos_ao_coordenador(msg, nos or self.cliente.nos, timeout))
+
+    async def coordenador(self, nos=None, timeout=2.0, atualizar=False):
+        return await self._conduzir(self.cliente._passos_coordenador(nos, timeout, atualizar))
+
+    def posicao_sessao(self):
+        return self.cliente.posicao_sessao()
+
+    def estatisticas(self):
+        return self.cliente.estatisticas()
+
+    def fechar(self):
+        self.cliente.fechar()
@@ -0,0 +1,136 @@
+import heapq
+from decimal import Decimal, InvalidOperation
+
+from anel_hash import posicao_sql
+
+
+class ErroParticao(Exception):
+    """Um nó não respondeu (ou respondeu com erro) à sua parte de uma consulta distribuída."""
+
+
+def filtro_responsavel(tabela, chave_primaria, faixas, id_no):
+    """
+    Condição SQL que restringe a consulta às linhas pelas quais `id_no` responde nas `faixas`
+    (ver `AnelHash.faixas`); None se o nó não responde por nenhuma. INTERVAL() faz uma busca
+    binária nos limites, então a posição de cada linha é calculada uma única vez.
+    """
+    limites, responsaveis = faixas
+    indices = [r for r, responsavel in enumerate(responsaveis) if responsavel == id_no]
+    if not indices:
+        return None
+    if len(indices) == len(responsaveis):
+        return "TRUE"
+    return (f"INTERVAL({posicao_sql(tabela, chave_primaria)}, {', '.join(map(str, limites))}) "
+            f"IN ({', '.join(map(str, indices))})")
+
+
+def sql_local(plano, filtro):
+    """
+    SQL da parte de um nó: a consulta do `plano` restrita ao `filtro`. Agregados vão para o nó
+    como resultados parciais (AVG vira SUM e COUNT); o LIMIT vai com o deslocamento somado, já
+    que as primeiras linhas do resultado final podem vir todas do mesmo nó.
+    """
+    lista = plano.lista
+    if plano.agregados is not None:
+        partes = []
+        for i, (funcao, argumento, _) in enumerate(plano.agregados):
+            if funcao == 'AVG':
+                partes += [f"SUM({argumento}) AS `_p{i}`", f"COUNT({argumento}) AS `_q{i}`"]
+            else:
+                partes.append(f"{funcao}({argumento}) AS `_p{i}`")
+        lista = ', '.join(partes)
+    sql = f"SELECT {lista} FROM {plano.origem} WHERE {filtro}" + (f" AND ({plano.onde})" if plano.onde else "")
+    if plano.agregados is None and plano.ordem:
+        sql += f" ORDER BY {plano.ordem_sql}"
+    if plano.agregados is None and plano.limite is not None:
+        sql += f" LIMIT {plano.limite + plano.deslocamento}"
+    return sql
+
+
+def como_no_protocolo(linha):
+    """
+    A linha com os valores como chegariam de outro nó (ver `codificar_frame`): o que não é um
+    tipo do JSON (DECIMAL, datas) vira texto, então as partes se comparam do mesmo jeito.
+    """
+    return {nome: valor if valor is None or isinstance(valor, (str, int, float)) else str(valor)
+            for nome, valor in linha.items()}
+
+
+def _campo(linha, coluna):
+    if coluna in linha:
+        return linha[coluna]
+    return next((valor for nome, valor in linha.items() if nome.lower() == coluna), None)
+
+
+def _valor_de_ordem(valor, decimal=False):
+    # NULL vem antes de tudo, como no MySQL; textos comparados sem distinção de maiúsculas, como na
+    # collation padrão. Valores DECIMAL chegam dos nós como texto e, com `decimal`, são comparados
+    # como números; datas chegam no formato ISO, em que a ordem do texto é a das datas.
+    if valor is None:
+        return (0,)
+    if isinstance(valor, str):
+        if decimal:
+            numero = _numero(valor)
+            if numero is not None:
+                return (1, numero)
+        return (2, valor.casefold())
+    return (1, valor)
+
+
+class _ChaveOrdem:
+    __slots__ = ('valores', 'decrescente')
+
+    def __init__(self, valores, decrescente):
+        self.valores = valores
+        self.decrescente = decrescente
+
+    def __lt__(self, outra):
+        for a, b, decrescente in zip(self.valores, outra.valores, self.decrescente):
+            if a != b:
+                return b < a if decrescente else a < b
+        return False
+
+
+def juntar_ordenado(fontes, ordem, decimais=()):
+    """
+    Intercala (k-way merge) as linhas de `fontes` já ordenadas por `ordem` ([(coluna, decrescente)]).
+    Só a próxima linha de cada fonte é lida, então quem consome pode parar a qualquer momento.
+    As colunas em `decimais` (nomes em minúsculas) são DECIMAL e são comparadas como números;
+    `decimais` pode ser preenchido pelas próprias fontes, antes das suas primeiras linhas.
+    """
+    decrescente = [d for _, d in ordem]
+    return heapq.merge(*fontes, key=lambda linha: _ChaveOrdem(
+        tuple(_valor_de_ordem(_campo(linha, coluna), coluna in decimais) for coluna, _ in ordem), decrescente))
+
+
+def _numero(valor):
+    """Valores DECIMAL chegam pela rede como texto."""
+    if isinstance(valor, str):
+        try:
+            return Decimal(valor)
+        except InvalidOperation:
+            return None
+    return valor
+
+
+def combinar_agregados(plano, parciais, decimais=()):
+    """
+    Combina as linhas parciais (uma por nó) de COUNT/SUM/MIN/MAX/AVG na linha do resultado final.
+    MIN e MAX das colunas parciais em `decimais` são escolhidos pelo valor numérico.
+    """
+    linha = {}
+    for i, (funcao, _, nome) in enumerate(plano.agregados):
+        valores = [p.get(f'_p{i}') for p in parciais if p.get(f'_p{i}') is not None]
+        if funcao == 'COUNT':
+            linha[nome] = sum(_numero(v) for v in valores)
+        elif funcao == 'SUM':
+            linha[nome] = sum(_numero(v) for v in valores) if valores else None
+        elif funcao in ('MIN', 'MAX'):
+            escolher = min if funcao == 'MIN' else max
+            decimal = f'_p{i}' in decimais
+            linha[nome] = escolher(valores, key=lambda v: _valor_de_ordem(v, decimal)) if valores else None
+        else:
+            quantidade = sum(_numero(p.get(f'_q{i}') or 0) for p in parciais)
+            soma = sum(_numero(v) for v in valores)
+            linha[nome] = (soma if isinstance(soma, float) else Decimal(soma)) / quantidade if quantidade else None
+    return linha
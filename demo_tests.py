@@ -7,30 +7,24 @@ Este script executa uma sequência de testes para demonstrar
 todas as funcionalidades do bd-dist.
 """
 
-import socket
 import json
 import time
 import random
 import sys
+from cliente_bd import ClienteBD, ErroCliente
 
 def carregar_configuracao():
     with open('config.json', 'r') as f:
         return json.load(f)['nodes']
 
-def enviar_query(info_no, sql):
-    """Envia query para um nó específico e retorna resultado"""
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(5.0)
-            s.connect((info_no['ip'], info_no['port']))
-            msg = {'type': 'CLIENT_QUERY', 'sql': sql}
-            s.sendall(json.dumps(msg).encode())
-            
-            dados = s.recv(16384)
-            if dados:
-                return json.loads(dados.decode())
-    except Exception as e:
-        return {"status": "error", "message": str(e), "node": info_no['id']}
+cliente = ClienteBD()
+
+def enviar_query(info_no, sql, params=None):
+    """Envia query (com `params` opcionais para os marcadores %s) para um nó específico e retorna resultado"""
+    resultado = cliente.query(info_no, sql, params)
+    if resultado.get('status') != 'success':
+        resultado.setdefault('node', info_no['id'])
+    return resultado
 
 def imprimir_separador(titulo):
     print(f"\n{'='*60}")
@@ -48,11 +42,9 @@ def imprimir_resultado(resultado):
 def verificar_no_vivo(no):
     """Verifica se um nó está respondendo"""
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(2.0)
-            s.connect((no['ip'], no['port']))
-            return True
-    except:
+        cliente.requisitar(no, {'type': 'GET_COORDINATOR'}, timeout=2.0, tentativas=1)
+        return True
+    except ErroCliente:
         return False
 
 def testar_conectividade(nos):
@@ -82,11 +74,11 @@ def testar_replicacao(nos):
     # Insere via Nó 0
     nome_teste = f"Usuario_Teste_{int(time.time())}"
     email_teste = f"teste_{int(time.time())}@demo.com"
-    sql = f"INSERT INTO users (name, email) VALUES ('{nome_teste}', '{email_teste}')"
+    sql = "INSERT INTO users (name, email) VALUES (%s, %s)"
     
     print(f"\n  [2/4] Enviando INSERT para Nó 0:")
-    print(f"        SQL: {sql}")
-    resultado = enviar_query(nos[0], sql)
+    print(f"        SQL: {sql} {[nome_teste, email_teste]}")
+    resultado = enviar_query(nos[0], sql, [nome_teste, email_teste])
     imprimir_resultado(resultado)
     
     # Aguarda replicação
@@ -187,8 +179,7 @@ def testar_multiplas_escritas(nos):
     print("\n  Inserindo dados em nós diferentes:")
     for indice_no, nome, email in dados_teste:
         if indice_no < len(nos):
-            sql = f"INSERT INTO users (name, email) VALUES ('{nome}', '{email}')"
-            resultado = enviar_query(nos[indice_no], sql)
+            resultado = enviar_query(nos[indice_no], "INSERT INTO users (name, email) VALUES (%s, %s)", [nome, email])
             status = "✅" if resultado.get('status') == 'success' else "❌"
             print(f"    Nó {indice_no}: INSERT {nome} {status}")
             time.sleep(0.5)
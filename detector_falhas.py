@@ -0,0 +1,100 @@
+import math
+import threading
+import time
+from collections import deque
+
+
+class DetectorFalhas:
+    """
+    Detector de falhas phi accrual (Hayashibara et al.), alimentado pelos heartbeats dos pares.
+
+    Para cada par, guarda os intervalos entre as últimas `janela` chegadas de heartbeat. Em vez
+    de um sim/não com prazo fixo, `phi(par)` dá o nível de suspeita: -log10 da probabilidade de
+    o próximo heartbeat ainda chegar depois de todo o tempo já passado, supondo intervalos com
+    distribuição normal de média e desvio observados. phi = 8 equivale a uma chance de 1 em
+    10^8 de o par estar vivo. Numa rede estável o desvio é pequeno e a suspeita sobe logo depois
+    do intervalo esperado; com atrasos variáveis, o detector espera mais antes de suspeitar.
+    Uma pausa que gerou suspeita entra nos intervalos como qualquer outro, então pausas
+    frequentes passam a ser toleradas; já um silêncio maior que `max_intervalo` (padrão: 10
+    intervalos esperados) é tratado como reinício do par, e o histórico recomeça.
+
+    `desvio_minimo` evita que intervalos quase idênticos tornem o detector sensível a qualquer
+    atraso, e `pausa_aceitavel` é somada à média para tolerar pausas curtas (ex.: coleta de lixo).
+    Até haver intervalos medidos, vale o `intervalo_esperado` dos heartbeats.
+    """
+
+    def __init__(self, intervalo_esperado=0.1, limiar=8.0, janela=100, desvio_minimo=0.02, pausa_aceitavel=0.25,
+                 max_intervalo=None):
+        self.intervalo_esperado = intervalo_esperado
+        self.limiar = limiar
+        self.janela = max(2, janela)
+        self.desvio_minimo = desvio_minimo
+        self.pausa_aceitavel = pausa_aceitavel
+        self.max_intervalo = 10 * intervalo_esperado + pausa_aceitavel if max_intervalo is None else max_intervalo
+        self.lock = threading.Lock()
+        self._pares = {}
+
+    def registrar(self, par, agora=None):
+        """Registra a chegada de um heartbeat de `par`."""
+        agora = time.monotonic() if agora is None else agora
+        with self.lock:
+            estado = self._pares.get(par)
+            if estado is None or agora - estado['ultimo'] > self.max_intervalo:
+                self._pares[par] = {'ultimo': agora, 'intervalos': deque([self.intervalo_esperado], maxlen=self.janela),
+                                    'soma': self.intervalo_esperado, 'soma_quadrados': self.intervalo_esperado ** 2}
+                return
+            intervalo = agora - estado['ultimo']
+            estado['ultimo'] = agora
+            intervalos = estado['intervalos']
+            if len(intervalos) == intervalos.maxlen:
+                antigo = intervalos[0]
+                estado['soma'] -= antigo
+                estado['soma_quadrados'] -= antigo * antigo
+            intervalos.append(intervalo)
+            estado['soma'] += intervalo
+            estado['soma_quadrados'] += intervalo * intervalo
+
+    def phi(self, par, agora=None):
+        """Nível de suspeita de `par` (0.0 para um par que nunca mandou heartbeat)."""
+        agora = time.monotonic() if agora is None else agora
+        with self.lock:
+            estado = self._pares.get(par)
+            if estado is None:
+                return 0.0
+            quantidade = len(estado['intervalos'])
+            media = estado['soma'] / quantidade
+            variancia = max(0.0, estado['soma_quadrados'] / quantidade - media * media)
+            decorrido = agora - estado['ultimo']
+        desvio = max(math.sqrt(variancia), self.desvio_minimo)
+        return _phi(decorrido, media + self.pausa_aceitavel, desvio)
+
+    def suspeito(self, par, agora=None):
+        return self.phi(par, agora) >= self.limiar
+
+    def estatisticas(self, agora=None):
+        agora = time.monotonic() if agora is None else agora
+        with self.lock:
+            pares = list(self._pares)
+        dados = {}
+        for par in pares:
+            with self.lock:
+                estado = self._pares.get(par)
+                if estado is None:
+                    continue
+                media = estado['soma'] / len(estado['intervalos'])
+            dados[str(par)] = {'phi': round(self.phi(par, agora), 3), 'intervalo_medio_ms': round(1000 * media, 1)}
+        return {'limiar': self.limiar, 'pares': dados}
+
+
+def _phi(decorrido, media, desvio):
+    """-log10(P(intervalo > decorrido)) com a aproximação logística da normal acumulada (erro máximo de ~1,4e-4)."""
+    y = (decorrido - media) / desvio
+    expoente = -y * (1.5976 + 0.070566 * y * y)
+    if expoente < -700:
+        return math.inf
+    if expoente > 700:
+        return 0.0
+    e = math.exp(expoente)
+    if decorrido > media:
+        return -math.log10(e / (1.0 + e))
+    return -math.log10(1.0 - 1.0 / (1.0 + e))
@@ -0,0 +1,192 @@
+import heapq
+import itertools
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import Future
+
+from protocolo import LeitorFrames, codificar_frame
+
+
+class ErroEnlace(Exception):
+    """Mensagem não pôde ser entregue pelo enlace (nó inacessível ou conexão perdida)."""
+
+
+class EnlacePar:
+    """
+    Conexão TCP persistente de um nó para um par, com reconexão automática.
+
+    Todas as mensagens para o par passam por uma fila e são escritas por uma única
+    thread de envio, de modo que quem envia nunca bloqueia na rede. Mensagens
+    enviadas com `requisitar` recebem um `id_req` e a resposta correspondente
+    (marcada com `resposta_a`) resolve o Future devolvido ao chamador. `ao_falhar(msg, erro)`,
+    se dado, é chamado para cada mensagem que não pôde ser escrita para o par.
+    """
+
+    def __init__(self, id_local, no_alvo, timeout_conexao=2.0, backoff_max=5.0, tamanho_fila=10000,
+                 silenciosos=('HEARTBEAT',), ao_falhar=None):
+        self.id_local = id_local
+        self.no_alvo = no_alvo
+        self.timeout_conexao = timeout_conexao
+        self.backoff_max = backoff_max
+        self.silenciosos = set(silenciosos)
+        self.ao_falhar = ao_falhar
+
+        self.fila = queue.Queue(maxsize=tamanho_fila)
+        self.pendentes = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._sock = None
+        self._backoff = 0.0
+        self._proxima_tentativa = 0.0
+        self.ativo = True
+        # Prazos das requisições pendentes (instante, id_req, tipo), vigiados por uma única thread
+        self._prazos = []
+        self._cond_prazos = threading.Condition()
+
+        self.mensagens_enviadas = 0
+        self.reconexoes = 0
+
+        threading.Thread(target=self._loop_envio, daemon=True).start()
+        threading.Thread(target=self._loop_prazos, daemon=True).start()
+
+    @property
+    def conectado(self):
+        return self._sock is not None
+
+    def enviar(self, msg):
+        """Enfileira uma mensagem sem esperar resposta."""
+        self._enfileirar(msg, None)
+
+    def requisitar(self, msg, timeout=None):
+        """Enfileira uma requisição e retorna um Future com a resposta do par."""
+        futuro = Future()
+        msg = dict(msg, id_req=next(self._ids))
+        with self._lock:
+            self.pendentes[msg['id_req']] = futuro
+        if timeout is not None:
+            with self._cond_prazos:
+                heapq.heappush(self._prazos, (time.monotonic() + timeout, msg['id_req'], msg.get('type')))
+                self._cond_prazos.notify()
+        self._enfileirar(msg, futuro)
+        return futuro
+
+    def _enfileirar(self, msg, futuro):
+        try:
+            self.fila.put_nowait((msg, futuro))
+        except queue.Full:
+            self._falhar(msg, ErroEnlace(f"Fila do enlace para Nó {self.no_alvo['id']} cheia"))
+
+    def _expirar(self, id_req, tipo):
+        with self._lock:
+            futuro = self.pendentes.pop(id_req, None)
+        if futuro is not None and not futuro.done():
+            futuro.set_exception(TimeoutError(f"Sem resposta do Nó {self.no_alvo['id']} para {tipo}"))
+
+    def _loop_prazos(self):
+        while self.ativo:
+            with self._cond_prazos:
+                if not self._prazos:
+                    self._cond_prazos.wait(1.0)
+                    continue
+                prazo, id_req, tipo = self._prazos[0]
+                restante = prazo - time.monotonic()
+                if restante > 0:
+                    self._cond_prazos.wait(restante)
+                    continue
+                heapq.heappop(self._prazos)
+            self._expirar(id_req, tipo)
+
+    def _falhar(self, msg, erro):
+        id_req = msg.get('id_req')
+        if id_req is not None:
+            with self._lock:
+                futuro = self.pendentes.pop(id_req, None)
+            if futuro is not None and not futuro.done():
+                futuro.set_exception(erro)
+        # Silencia heartbeats para não poluir o log, mas registra erros de replicação e eleição
+        if msg.get('type') not in self.silenciosos:
+            print(f"[Nó {self.id_local}] Erro ao enviar {msg.get('type')} para Nó {self.no_alvo['id']} ({self.no_alvo['ip']}): {erro}")
+        if self.ao_falhar is not None:
+            self.ao_falhar(msg, erro)
+
+    def _conectar(self):
+        agora = time.monotonic()
+        if agora < self._proxima_tentativa:
+            raise ErroEnlace(f"Nó {self.no_alvo['id']} inacessível, nova tentativa em {self._proxima_tentativa - agora:.1f}s")
+        try:
+            sock = socket.create_connection((self.no_alvo['ip'], self.no_alvo['port']), timeout=self.timeout_conexao)
+        except OSError as e:
+            self._backoff = min(self.backoff_max, max(0.1, self._backoff * 2))
+            self._proxima_tentativa = time.monotonic() + self._backoff
+            raise ErroEnlace(str(e))
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._backoff = 0.0
+        self.reconexoes += 1
+        self._sock = sock
+        threading.Thread(target=self._loop_leitura, args=(sock,), daemon=True).start()
+        return sock
+
+    def _desconectar(self, sock, erro):
+        with self._lock:
+            if self._sock is not sock:
+                return
+            self._sock = None
+            pendentes, self.pendentes = self.pendentes, {}
+        try:
+            sock.close()
+        except OSError:
+            pass
+        for futuro in pendentes.values():
+            if not futuro.done():
+                futuro.set_exception(erro)
+
+    def _loop_envio(self):
+        while self.ativo:
+            try:
+                itens = [self.fila.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            # Drena o que já está na fila para escrever tudo em uma única chamada
+            while len(itens) < 256:
+                try:
+                    itens.append(self.fila.get_nowait())
+                except queue.Empty:
+                    break
+            if not self.ativo:
+                break
+            try:
+                sock = self._sock or self._conectar()
+                sock.sendall(b''.join(codificar_frame(msg) for msg, _ in itens))
+                self.mensagens_enviadas += len(itens)
+            except (OSError, ErroEnlace) as e:
+                if self._sock is not None:
+                    self._desconectar(self._sock, ErroEnlace(str(e)))
+                for msg, _ in itens:
+                    self._falhar(msg, e)
+
+    def _loop_leitura(self, sock):
+        leitor = LeitorFrames(sock)
+        erro = ErroEnlace(f"Conexão com Nó {self.no_alvo['id']} encerrada")
+        try:
+            while True:
+                msg = leitor.ler()
+                if msg is None:
+                    break
+                with self._lock:
+                    futuro = self.pendentes.pop(msg.get('resposta_a'), None)
+                if futuro is not None and not futuro.done():
+                    futuro.set_result(msg)
+        except Exception as e:
+            erro = ErroEnlace(str(e))
+        self._desconectar(sock, erro)
+
+    def fechar(self):
+        self.ativo = False
+        with self._cond_prazos:
+            self._cond_prazos.notify()
+        sock = self._sock
+        if sock is not None:
+            self._desconectar(sock, ErroEnlace("Enlace fechado"))
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Carga em massa de arquivos CSV ou NDJSON em uma tabela replicada.
+
+O arquivo é lido em partes de `--lote` linhas e cada parte vai ao coordenador em uma
+mensagem BULK_LOAD, por `--conexoes` conexões em paralelo do ClienteBD (que acompanha o
+mandato e reenvia a parte ao novo coordenador se ela foi recusada ou nem chegou). O
+coordenador grava a parte em uma transação e a replica aos pares; a fila entre a leitura e
+o envio tem no máximo 2 partes por conexão, então a memória usada não depende do tamanho
+do arquivo.
+
+Uso:
+  python importador.py usuarios.csv --tabela users [--lote 2000] [--conexoes 4] [--espera todos]
+  python importador.py usuarios.ndjson --tabela users
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import queue
+import threading
+import time
+
+from cliente_bd import ClienteBD
+
+FIM = object()
+
+
+def ler_partes(caminho, tamanho_lote, formato=None):
+    """
+    Gera (colunas, linhas) com até `tamanho_lote` linhas por parte. No CSV as colunas vêm do
+    cabeçalho e campos vazios viram NULL; no NDJSON, das chaves do primeiro objeto.
+    """
+    formato = formato or ('ndjson' if caminho.endswith(('.ndjson', '.jsonl')) else 'csv')
+    with open(caminho, 'r', encoding='utf-8', newline='') as f:
+        if formato == 'csv':
+            leitor = csv.reader(f)
+            colunas = next(leitor, None)
+            linhas_arquivo = ([valor if valor != '' else None for valor in linha] for linha in leitor if linha)
+        else:
+            objetos = (json.loads(linha) for linha in f if linha.strip())
+            primeiro = next(objetos, None)
+            colunas = list(primeiro) if primeiro else None
+            linhas_arquivo = ([objeto.get(c) for c in colunas] for objeto in itertools.chain([primeiro], objetos))
+        if not colunas:
+            return
+        parte = []
+        for linha in linhas_arquivo:
+            parte.append(linha)
+            if len(parte) >= tamanho_lote:
+                yield colunas, parte
+                parte = []
+        if parte:
+            yield colunas, parte
+
+
+class Importador:
+    """
+    Envia as partes de um arquivo ao coordenador, com `conexoes` envios em paralelo. Sem
+    `cliente`, usa um ClienteBD próprio, fechado ao fim de cada importação.
+    """
+
+    def __init__(self, nos, tabela, conexoes=4, espera='todos', intervalo_progresso=1.0, cliente=None):
+        self.nos = nos
+        self.tabela = tabela
+        self.conexoes = max(1, conexoes)
+        self.espera = espera
+        self.intervalo_progresso = intervalo_progresso
+        self.cliente_proprio = cliente is None
+        self.cliente = cliente or ClienteBD(nos, max_conexoes=self.conexoes)
+        self.fila = queue.Queue(maxsize=2 * self.conexoes)
+        self.lock = threading.Lock()
+        self.erro = None
+        self.linhas = 0
+        self.partes = 0
+        self.nao_confirmadas = 0
+
+    def importar(self, partes):
+        """Importa as partes (ver `ler_partes`) e retorna um resumo da carga."""
+        try:
+            return self._importar(partes)
+        finally:
+            if self.cliente_proprio:
+                self.cliente.fechar()
+
+    def _importar(self, partes):
+        inicio = time.monotonic()
+        envios = [threading.Thread(target=self._loop_envio, daemon=True) for _ in range(self.conexoes)]
+        for t in envios:
+            t.start()
+        proximo_progresso = inicio + self.intervalo_progresso
+        for parte in partes:
+            # put bloqueia com a fila cheia: a leitura do arquivo anda no ritmo do cluster
+            while self.erro is None:
+                try:
+                    self.fila.put(parte, timeout=0.5)
+                    break
+                except queue.Full:
+                    pass
+            if self.erro is not None:
+                break
+            if time.monotonic() >= proximo_progresso:
+                self._imprimir_progresso(inicio)
+                proximo_progresso = time.monotonic() + self.intervalo_progresso
+        for _ in envios:
+            self.fila.put(FIM)
+        for t in envios:
+            t.join()
+        decorrido = time.monotonic() - inicio
+        self._imprimir_progresso(inicio)
+        return {'linhas': self.linhas, 'partes': self.partes, 'nao_confirmadas': self.nao_confirmadas,
+                'segundos': round(decorrido, 3), 'linhas_por_segundo': round(self.linhas / decorrido, 1) if decorrido > 0 else 0.0,
+                'erro': self.erro}
+
+    def _imprimir_progresso(self, inicio):
+        decorrido = max(time.monotonic() - inicio, 1e-9)
+        with self.lock:
+            print(f"  {self.linhas} linhas em {decorrido:.1f}s ({self.linhas / decorrido:.0f} linhas/s)")
+
+    def _loop_envio(self):
+        while True:
+            parte = self.fila.get()
+            if parte is FIM:
+                return
+            if self.erro is not None:
+                continue
+            colunas, linhas = parte
+            resposta = self.cliente.carregar(self.tabela, colunas, linhas, self.espera, nos=self.nos)
+            with self.lock:
+                if resposta.get('total') is None:
+                    self.erro = resposta.get('message', 'falha na carga')
+                    continue
+                self.linhas += len(linhas)
+                self.partes += 1
+                if resposta.get('status') != 'success':
+                    self.nao_confirmadas += 1  # gravada no coordenador; os pares alcançam pelo catch-up
+
+
+def principal():
+    parser = argparse.ArgumentParser(description="Carga em massa de CSV/NDJSON no banco distribuído")
+    parser.add_argument('arquivo')
+    parser.add_argument('--tabela', required=True)
+    parser.add_argument('--formato', choices=('csv', 'ndjson'), help="padrão: pela extensão do arquivo")
+    parser.add_argument('--lote', type=int, default=2000, help="linhas por parte")
+    parser.add_argument('--conexoes', type=int, default=4, help="partes enviadas em paralelo")
+    parser.add_argument('--espera', default='todos', help="ACKs de replicação por parte (nenhum, um, maioria, todos)")
+    parser.add_argument('--config', default='config.json')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        nos = json.load(f)['nodes']
+    importador = Importador(nos, args.tabela, args.conexoes, args.espera)
+    print(f"Importando {args.arquivo} em {args.tabela} (partes de {args.lote} linhas, {args.conexoes} conexões)")
+    resumo = importador.importar(ler_partes(args.arquivo, args.lote, args.formato))
+    if resumo['erro']:
+        print(f"Carga interrompida: {resumo['erro']}")
+    print(f"{resumo['linhas']} linhas em {resumo['segundos']:.2f}s ({resumo['linhas_por_segundo']:.0f} linhas/s)")
+    if resumo['nao_confirmadas']:
+        print(f"{resumo['nao_confirmadas']} partes sem confirmação de todos os pares (serão recebidas pelo catch-up)")
+
+
+if __name__ == "__main__":
+    principal()
@@ -27,6 +27,9 @@ def inicializar():
                 # Usando 'with' para garantir o fechamento do cursor
                 with conn.cursor() as cursor:
                     cursor.execute("CREATE TABLE IF NOT EXISTS users (id INT AUTO_INCREMENT PRIMARY KEY, name VARCHAR(255), email VARCHAR(255))")
+                    # Última seq de replicação aplicada de cada nó de origem (o nó também a cria ao iniciar)
+                    cursor.execute("CREATE TABLE IF NOT EXISTS replicacao_posicao (origem INT PRIMARY KEY, seq BIGINT NOT NULL)")
+                    cursor.execute("CREATE TABLE IF NOT EXISTS replicacao_aplicada (origem INT NOT NULL, seq BIGINT NOT NULL, PRIMARY KEY (origem, seq))")
                 
                 print(f"Banco de dados do Nó {n['id']} inicializado.")
                 sucesso = True
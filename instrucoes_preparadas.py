@@ -0,0 +1,101 @@
+import re
+import threading
+import weakref
+from collections import OrderedDict
+
+from mysql.connector import errors
+
+# Comando que o MySQL não aceita como prepared statement (ER_UNSUPPORTED_PS)
+ERRO_NAO_PREPARAVEL = 1295
+# Marcador com nome (%(nome)s), o mesmo padrão que o conector reconhece
+MARCADOR_COM_NOME = re.compile(r"%\((.*?)\)s")
+
+
+class InstrucoesPreparadas:
+    """
+    Cache, por conexão, de prepared statements do MySQL.
+
+    Na primeira execução de um comando em uma conexão, ele é preparado em um cursor próprio;
+    as execuções seguintes do mesmo comando reaproveitam esse cursor e enviam só os parâmetros.
+    Cada conexão guarda até `max_por_conexao` comandos (LRU); o cursor que sai do cache é
+    fechado, o que libera o comando no servidor. Uma conexão só é usada por uma thread de cada
+    vez (ela vem do pool), então o cache de cada uma dispensa lock. Os cursores guardam só uma
+    referência fraca à conexão, então o cache some junto com a conexão descartada pelo pool.
+
+    O cursor preparado só reaproveita o comando se receber o mesmo objeto str. Com parâmetros em
+    dicionário, o conector troca os marcadores `%(nome)s` a cada execução e gera um str novo, o
+    que prepararia o comando de novo toda vez; por isso esses marcadores são trocados por `%s` uma
+    única vez, ao guardar o comando, e os valores passam na ordem dos nomes.
+    """
+
+    def __init__(self, max_por_conexao=64):
+        self.max_por_conexao = max(1, max_por_conexao)
+        self.lock = threading.Lock()
+        self._por_conexao = weakref.WeakKeyDictionary()
+        self._nao_preparaveis = set()
+        self.acertos = 0
+        self.preparadas = 0
+        self.descartadas = 0
+
+    def executar(self, conn, sql, params, dicionario=False):
+        """Executa `sql` com `params` (lista ou dicionário) e retorna o cursor com o resultado."""
+        if sql in self._nao_preparaveis:
+            cursor = conn.cursor(dictionary=dicionario)
+            cursor.execute(sql, params)
+            return cursor
+        cache = self._cache(conn)
+        chave = (sql, dicionario)
+        entrada = cache.get(chave)
+        if entrada is not None:
+            cache.move_to_end(chave)
+            with self.lock: self.acertos += 1
+        else:
+            nomes = MARCADOR_COM_NOME.findall(sql)
+            entrada = (MARCADOR_COM_NOME.sub('%s', sql) if nomes else sql,
+                       conn.cursor(prepared=True, dictionary=dicionario), nomes)
+            cache[chave] = entrada
+            with self.lock: self.preparadas += 1
+            while len(cache) > self.max_por_conexao:
+                self._fechar(cache.popitem(last=False)[1][1])
+        sql_preparado, cursor, nomes = entrada
+        valores = params
+        if isinstance(params, dict):
+            try:
+                valores = [params[nome] for nome in nomes]
+            except KeyError as e:
+                raise errors.ProgrammingError(f"Parâmetro sem valor no dicionário: {e}") from e
+        try:
+            cursor.execute(sql_preparado, valores)
+        except errors.Error as e:
+            # Um cursor que falhou pode ter ficado num estado inválido: sai do cache
+            cache.pop(chave, None)
+            self._fechar(cursor)
+            if e.errno != ERRO_NAO_PREPARAVEL: raise
+            with self.lock: self._nao_preparaveis.add(sql)
+            return self.executar(conn, sql, params, dicionario)
+        return cursor
+
+    def _cache(self, conn):
+        with self.lock:
+            cache = self._por_conexao.get(conn)
+            if cache is None:
+                cache = self._por_conexao[conn] = OrderedDict()
+            return cache
+
+    def _fechar(self, cursor):
+        with self.lock: self.descartadas += 1
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+    def estatisticas(self):
+        with self.lock:
+            execucoes = self.acertos + self.preparadas
+            return {
+                'preparadas': self.preparadas,
+                'reutilizadas': self.acertos,
+                'taxa_reuso': round(self.acertos / execucoes, 3) if execucoes else 0.0,
+                'descartadas': self.descartadas,
+                'nao_preparaveis': len(self._nao_preparaveis),
+            }
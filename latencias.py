@@ -0,0 +1,41 @@
+import threading
+from collections import deque
+
+
+class Latencias:
+    """
+    Latências recentes agrupadas por chave (ex.: nível de consistência e tipo de query).
+    Guarda as últimas `max_amostras` de cada chave, o suficiente para estimar p50 e p99 sem
+    que a memória cresça com o tempo de execução; a contagem e a média valem para todas.
+    """
+
+    def __init__(self, max_amostras=1000):
+        self.max_amostras = max_amostras
+        self.lock = threading.Lock()
+        self._amostras = {}
+        self._totais = {}
+
+    def registrar(self, chave, segundos):
+        with self.lock:
+            amostras = self._amostras.get(chave)
+            if amostras is None:
+                amostras = self._amostras[chave] = deque(maxlen=self.max_amostras)
+                self._totais[chave] = [0, 0.0]
+            amostras.append(segundos)
+            totais = self._totais[chave]
+            totais[0] += 1
+            totais[1] += segundos
+
+    def estatisticas(self):
+        with self.lock:
+            copias = {chave: (sorted(amostras), list(self._totais[chave])) for chave, amostras in self._amostras.items()}
+        dados = {}
+        for chave, (amostras, (quantidade, soma)) in copias.items():
+            dados[chave] = {
+                'requisicoes': quantidade,
+                'media_ms': round(1000 * soma / quantidade, 3),
+                'p50_ms': round(1000 * amostras[len(amostras) // 2], 3),
+                'p99_ms': round(1000 * amostras[min(len(amostras) - 1, int(len(amostras) * 0.99))], 3),
+                'max_ms': round(1000 * amostras[-1], 3),
+            }
+        return dados
@@ -0,0 +1,276 @@
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class LogReplicacao:
+    """
+    Log sequenciado das escritas originadas neste nó.
+
+    Cada entrada recebe um `seq` crescente e é gravada em um arquivo append-only
+    (uma entrada JSON por linha). As entradas mais recentes ficam também em memória
+    para atender pedidos de catch-up sem ler o disco (até `max_memoria` entradas e
+    `max_bytes_memoria` bytes, já que uma entrada de carga em massa pode ter milhares de
+    linhas). Quando o arquivo passa de 2 * `retencao` entradas, ele é compactado mantendo
+    apenas as `retencao` últimas.
+
+    Com `fsync`, uma thread grava em disco (fsync) as entradas anexadas desde a última vez,
+    em grupo: várias escritas concorrentes dividem um único fsync. `sincronizar(seq)` espera
+    a entrada `seq` estar em disco.
+    """
+
+    def __init__(self, caminho, retencao=100000, max_memoria=10000, max_bytes_memoria=16 * 1024 * 1024, fsync=True):
+        self.caminho = caminho
+        self.retencao = max(1, retencao)
+        self.max_memoria = max(1, max_memoria)
+        self.max_bytes_memoria = max_bytes_memoria
+        self.lock = threading.Lock()
+        self._recentes = deque()
+        self._tamanhos = deque()
+        self._bytes_memoria = 0
+        self.ultimo_seq = 0
+        self.primeiro_seq = 1
+        self._no_arquivo = 0
+        # Posição do arquivo antes da última entrada (None depois de uma compactação), para `descartar`
+        self._tamanho_antes = None
+        self.fsync = fsync
+        self.cond_fsync = threading.Condition()
+        self.sincronizado = 0
+        # Muda quando entradas são removidas, para que um fsync em andamento não confirme seqs reaproveitadas
+        self._geracao = 0
+        self.fsyncs = 0
+        self.entradas_sincronizadas = 0
+        self.ativo = True
+
+        diretorio = os.path.dirname(caminho)
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+        self._reparar()
+        self._carregar()
+        self._arquivo = open(caminho, 'a', encoding='utf-8')
+        self.sincronizado = self.ultimo_seq
+        if fsync:
+            threading.Thread(target=self._loop_fsync, daemon=True).start()
+
+    def _ler_arquivo(self):
+        if not os.path.exists(self.caminho):
+            return
+        with open(self.caminho, 'r', encoding='utf-8') as f:
+            for linha in f:
+                try:
+                    yield json.loads(linha), len(linha)
+                except ValueError:
+                    # Linha incompleta (queda no meio de uma gravação): ignora o restante
+                    return
+
+    def _reparar(self):
+        """
+        Corta a linha incompleta deixada no final do arquivo por uma queda no meio de uma
+        gravação; sem isso, a próxima entrada seria gravada grudada nela e perdida na leitura.
+        """
+        if not os.path.exists(self.caminho):
+            return
+        valido = 0
+        with open(self.caminho, 'rb') as f:
+            for linha in f:
+                try:
+                    json.loads(linha)
+                except ValueError:
+                    break
+                if not linha.endswith(b'\n'):
+                    break
+                valido += len(linha)
+        if valido < os.path.getsize(self.caminho):
+            print(f"[Log] Descartando o final incompleto de {self.caminho} (a partir do byte {valido})")
+            with open(self.caminho, 'r+b') as f:
+                f.truncate(valido)
+
+    def _carregar(self):
+        for entrada, tamanho in self._ler_arquivo():
+            if self._no_arquivo == 0:
+                self.primeiro_seq = entrada['seq']
+            self._no_arquivo += 1
+            self.ultimo_seq = entrada['seq']
+            self._guardar_recente(entrada, tamanho)
+        if self._no_arquivo == 0:
+            self.primeiro_seq = self.ultimo_seq + 1
+
+    def anexar(self, dados):
+        """Grava uma nova entrada e retorna o seu número de sequência."""
+        with self.lock:
+            seq = self.ultimo_seq + 1
+            entrada = dict(dados, seq=seq)
+            linha = json.dumps(entrada, separators=(',', ':'), default=str) + '\n'
+            self._tamanho_antes = self._arquivo.tell()
+            self._arquivo.write(linha)
+            self._arquivo.flush()
+            self.ultimo_seq = seq
+            self._guardar_recente(entrada, len(linha))
+            self._no_arquivo += 1
+            if self._no_arquivo > 2 * self.retencao:
+                self._compactar()
+        if self.fsync:
+            with self.cond_fsync: self.cond_fsync.notify_all()
+        return seq
+
+    def descartar(self, seq):
+        """Desfaz a última entrada anexada (`seq`), cujo commit no banco falhou; ainda não foi enviada a ninguém."""
+        with self.lock:
+            if seq != self.ultimo_seq or not self._recentes or self._recentes[-1]['seq'] != seq:
+                raise ValueError(f"Só a última entrada do log pode ser descartada (última: {self.ultimo_seq})")
+            if self._tamanho_antes is not None:
+                self._arquivo.truncate(self._tamanho_antes)
+                self._arquivo.seek(0, os.SEEK_END)
+                self._tamanho_antes = None
+            else:
+                # O arquivo foi compactado depois da entrada: reescreve sem ela
+                self._reescrever(entrada for entrada, _ in self._ler_arquivo() if entrada['seq'] < seq)
+            self._recentes.pop()
+            self._bytes_memoria -= self._tamanhos.pop()
+            self._no_arquivo -= 1
+            self.ultimo_seq = seq - 1
+            if self._no_arquivo == 0:
+                self.primeiro_seq = self.ultimo_seq + 1
+            self._redefinir_sincronizado(min(self.sincronizado, self.ultimo_seq))
+
+    def truncar(self, seq):
+        """Remove as entradas com seq maior que `seq` (recuperação após uma queda antes do commit)."""
+        with self.lock:
+            self._reescrever(entrada for entrada, _ in self._ler_arquivo() if entrada['seq'] <= seq)
+            self._recarregar()
+            self._redefinir_sincronizado(self.ultimo_seq)
+
+    def recomecar(self, seq):
+        """
+        Esvazia o log e continua a numeração após `seq`: as entradas até `seq` deixam de estar
+        disponíveis, e quem precisar delas recebe um snapshot (ver `disponivel_desde`).
+        """
+        with self.lock:
+            self._reescrever([])
+            self._recarregar()
+            self.ultimo_seq = max(self.ultimo_seq, seq)
+            self.primeiro_seq = self.ultimo_seq + 1
+            self._redefinir_sincronizado(self.ultimo_seq)
+
+    def _redefinir_sincronizado(self, seq):
+        # _reescrever já faz o fsync do arquivo novo
+        with self.cond_fsync:
+            self.sincronizado = seq
+            self._geracao += 1
+            self.cond_fsync.notify_all()
+
+    def _recarregar(self):
+        self._recentes.clear()
+        self._tamanhos.clear()
+        self._bytes_memoria = 0
+        self._no_arquivo = 0
+        self.ultimo_seq = 0
+        self.primeiro_seq = 1
+        self._carregar()
+
+    def _loop_fsync(self):
+        while True:
+            with self.cond_fsync:
+                self.cond_fsync.wait_for(lambda: not self.ativo or self.ultimo_seq > self.sincronizado)
+                if not self.ativo: return
+            # As entradas anexadas até aqui entram no mesmo fsync; o descritor duplicado continua
+            # válido mesmo que a compactação troque o arquivo durante o fsync
+            with self.lock:
+                alvo, geracao = self.ultimo_seq, self._geracao
+                descritor = os.dup(self._arquivo.fileno())
+            try:
+                os.fsync(descritor)
+            except OSError as e:
+                print(f"[Log] Erro no fsync de {self.caminho}: {e}")
+                time.sleep(0.1)
+                continue
+            finally:
+                os.close(descritor)
+            with self.cond_fsync:
+                if geracao == self._geracao and alvo > self.sincronizado:
+                    self.entradas_sincronizadas += alvo - self.sincronizado
+                    self.sincronizado = alvo
+                self.fsyncs += 1
+                self.cond_fsync.notify_all()
+
+    def sincronizar(self, seq, timeout=None):
+        """Espera a entrada `seq` estar gravada em disco; retorna False se o `timeout` acabar antes."""
+        if not self.fsync:
+            return True
+        with self.cond_fsync:
+            return self.cond_fsync.wait_for(lambda: self.sincronizado >= seq or not self.ativo, timeout) \
+                and self.sincronizado >= seq
+
+    def _guardar_recente(self, entrada, tamanho):
+        self._recentes.append(entrada)
+        self._tamanhos.append(tamanho)
+        self._bytes_memoria += tamanho
+        while len(self._recentes) > 1 and (len(self._recentes) > self.max_memoria
+                                           or self._bytes_memoria > self.max_bytes_memoria):
+            self._recentes.popleft()
+            self._bytes_memoria -= self._tamanhos.popleft()
+
+    def _compactar(self):
+        manter = deque((entrada for entrada, _ in self._ler_arquivo()), maxlen=self.retencao)
+        self._reescrever(manter)
+        self._tamanho_antes = None
+        self._no_arquivo = len(manter)
+        self.primeiro_seq = manter[0]['seq'] if manter else self.ultimo_seq + 1
+
+    def _reescrever(self, entradas):
+        """Substitui o arquivo pelas `entradas`, gravadas em um temporário (com fsync) e trocadas de uma vez."""
+        temporario = self.caminho + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as f:
+            for entrada in entradas:
+                f.write(json.dumps(entrada, separators=(',', ':'), default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._arquivo.close()
+        os.replace(temporario, self.caminho)
+        self._arquivo = open(self.caminho, 'a', encoding='utf-8')
+
+    def ler(self, desde, limite, max_bytes=None):
+        """
+        Retorna até `limite` entradas com seq > `desde`, em ordem. Com `max_bytes`, para antes
+        de passar desse tamanho (mas sempre retorna ao menos uma entrada, se houver).
+        """
+        with self.lock:
+            if self._recentes and self._recentes[0]['seq'] <= desde + 1:
+                inicio = max(0, desde + 1 - self._recentes[0]['seq'])
+                fim = min(len(self._recentes), inicio + limite)
+                return _ate_o_limite(((self._recentes[i], self._tamanhos[i]) for i in range(inicio, fim)), max_bytes)
+            ultimo = self.ultimo_seq
+        novas = ((entrada, tamanho) for entrada, tamanho in self._ler_arquivo() if entrada['seq'] > desde)
+        return _ate_o_limite(itertools.islice(itertools.takewhile(lambda e: e[0]['seq'] <= ultimo, novas), limite), max_bytes)
+
+    def disponivel_desde(self, desde):
+        """Indica se as entradas seguintes a `desde` ainda estão no log (não foram compactadas)."""
+        return desde + 1 >= self.primeiro_seq or desde >= self.ultimo_seq
+
+    def estatisticas(self):
+        with self.cond_fsync:
+            return {'ultimo_seq': self.ultimo_seq, 'sincronizado': self.sincronizado, 'fsyncs': self.fsyncs,
+                    'media_por_fsync': round(self.entradas_sincronizadas / self.fsyncs, 2) if self.fsyncs else 0.0}
+
+    def fechar(self):
+        with self.cond_fsync:
+            self.ativo = False
+            self.cond_fsync.notify_all()
+        with self.lock:
+            if self.fsync and not self._arquivo.closed:
+                self._arquivo.flush()
+                os.fsync(self._arquivo.fileno())
+            self._arquivo.close()
+
+
+def _ate_o_limite(entradas, max_bytes):
+    resultado, total = [], 0
+    for entrada, tamanho in entradas:
+        total += tamanho
+        if resultado and max_bytes is not None and total > max_bytes:
+            break
+        resultado.append(entrada)
+    return resultado
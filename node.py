@@ -1,15 +1,61 @@
 import socket
 import threading
+import asyncio
 import json
 import time
 import hashlib
+import itertools
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, FieldType, errors
 import sys
 import os
+from pool_conexoes import PoolConexoes
+from protocolo import (CABECALHO, ErroProtocolo, LeitorFrames, codificar_frame, enviar_frame, iterar_resposta,
+                       juntar_resposta, receber_resposta)
+from enlace_pares import EnlacePar
+from log_replicacao import LogReplicacao
+from agrupador_replicacao import AgrupadorReplicacao
+from aplicador_paralelo import AplicadorParalelo
+import analisador_sql
+from analisador_sql import chave_de_escrita, chave_de_leitura, classificar, plano_distribuido
+from anel_hash import AnelHash
+from consulta_distribuida import ErroParticao, combinar_agregados, como_no_protocolo, filtro_responsavel, juntar_ordenado, sql_local
+from cache_leituras import CacheLeituras
+from instrucoes_preparadas import InstrucoesPreparadas
+from cliente_bd import ClienteBD, ErroCliente, ErroConexao
+from latencias import Latencias
+from remetente_replicacao import RemetenteReplicacao
+from arvore_merkle import ArvoreMerkle, folha_da_chave, folha_sql, hash_linha_sql
+from detector_falhas import DetectorFalhas
+
+MODOS_SERVIDOR = ('thread', 'async')
+# Quantos pares precisam confirmar (ACK) uma replicação antes de responder ao cliente
+MODOS_ESPERA = ('nenhum', 'um', 'maioria', 'todos')
+# Nível de consistência de uma query: em quantas réplicas a leitura é feita / a escrita é confirmada
+NIVEIS_CONSISTENCIA = {'um': 'um', 'maioria': 'maioria', 'todos': 'todos', 'ONE': 'um', 'QUORUM': 'maioria', 'ALL': 'todos'}
+# A réplica local já conta: consistência 'um' na escrita não espera nenhum par
+ESPERA_DA_CONSISTENCIA = {'um': 'nenhum', 'maioria': 'maioria', 'todos': 'todos'}
+# Quem aceita escritas: qualquer nó ('multimestre') ou só o coordenador, que define a ordem global ('lider')
+MODOS_ESCRITA = ('multimestre', 'lider')
+
+# Erros do próprio comando SQL (e não da conexão): reaplicar não adiantaria
+ERROS_DE_COMANDO = (errors.ProgrammingError, errors.IntegrityError, errors.DataError, errors.NotSupportedError)
+# Colunas que o conector entrega como texto e que se comparam como números
+TIPOS_DECIMAIS = (FieldType.DECIMAL, FieldType.NEWDECIMAL)
+
+# Última seq aplicada de cada nó de origem, gravada na mesma transação da escrita replicada
+SQL_CRIAR_POSICOES = ("CREATE TABLE IF NOT EXISTS replicacao_posicao "
+                      "(origem INT PRIMARY KEY, seq BIGINT NOT NULL)")
+SQL_SALVAR_POSICAO = ("INSERT INTO replicacao_posicao (origem, seq) VALUES (%s, %s) "
+                      "ON DUPLICATE KEY UPDATE seq = GREATEST(seq, VALUES(seq))")
+# Seqs aplicadas fora de ordem pelo aplicador paralelo, acima da posição contígua de cada origem
+SQL_CRIAR_APLICADAS = ("CREATE TABLE IF NOT EXISTS replicacao_aplicada "
+                       "(origem INT NOT NULL, seq BIGINT NOT NULL, PRIMARY KEY (origem, seq))")
+SQL_MARCAR_APLICADA = "INSERT IGNORE INTO replicacao_aplicada (origem, seq) VALUES (%s, %s)"
 
 class No:
-    def __init__(self, id_no, caminho_config='config.json'):
+    def __init__(self, id_no, caminho_config='config.json', modo_servidor=None):
         self.id_no = id_no
         self.carregar_configuracao(caminho_config)
         self.eu = self.info_nos[id_no]
@@ -25,22 +71,159 @@ class No:
             'connect_timeout': 5
         }
         
-        print(f"[Nó {self.id_no}] Iniciado com estratégia de Conexão Sob Demanda na porta DB {self.eu['db_port']}")
+        # Pools separados: a aplicação de replicações não disputa conexões com os clientes
+        config_pool = self.config.get('pool', {})
+        self.pool_clientes = PoolConexoes('clientes', self.criar_conexao, **config_pool.get('clientes', {}))
+        self.pool_replicacao = PoolConexoes('replicacao', self.criar_conexao, **config_pool.get('replicacao', {}))
+        self.pool_clientes.preencher()
+        self.pool_replicacao.preencher()
+        # Prepared statements por conexão, para comandos com parâmetros
+        self.preparadas = InstrucoesPreparadas(**self.config.get('instrucoes_preparadas', {}))
+
+        print(f"[Nó {self.id_no}] Iniciado com Pool de Conexões na porta DB {self.eu['db_port']}")
 
         self.id_coordenador = None
+        # Mandato do coordenador: cresce a cada troca, para que clientes percebam que o seu está velho
+        self.mandato = 0
         self.nos_vivos = {self.id_no: time.time()}
+        # Detector de falhas phi accrual: o prazo para declarar um par offline se adapta aos seus heartbeats
+        config_deteccao = self.config.get('deteccao_falhas', {})
+        self.intervalo_heartbeat = config_deteccao.get('intervalo_heartbeat', 0.1)
+        self.intervalo_verificacao = config_deteccao.get('intervalo_verificacao', 0.05)
+        self.detector = DetectorFalhas(self.intervalo_heartbeat, config_deteccao.get('limiar_phi', 8.0),
+                                       config_deteccao.get('janela', 100), config_deteccao.get('desvio_minimo', 0.02),
+                                       config_deteccao.get('pausa_aceitavel', 0.25))
+        self.nos_declarados_offline = 0
         self.em_execucao = True
         self.lock = threading.Lock()
+
+        # Enlaces persistentes para os outros nós (um por par, reconectam sozinhos)
+        self.enlaces = {n['id']: EnlacePar(self.id_no, n, ao_falhar=lambda msg, erro, par=n['id']: self.falha_de_envio(par, msg))
+                        for n in self.outros_nos}
+        # Heartbeats vão por um enlace próprio: o par trata cada conexão em ordem, e um heartbeat atrás
+        # de uma replicação demorada chegaria atrasado ao detector de falhas
+        self.enlaces_heartbeat = {n['id']: EnlacePar(self.id_no, n) for n in self.outros_nos}
+        self.conexoes_recebidas = set()
+        # Conexões de clientes que pediram aviso de troca de coordenador (SUBSCRIBE)
+        self.assinantes = {}
+        self.linhas_por_parte = self.config.get('protocolo', {}).get('linhas_por_parte', 500)
+        # Latência das queries de clientes por nível de consistência e tipo (leitura ou escrita)
+        self.latencias = Latencias()
+
+        # Cache opcional de resultados de leitura, invalidado por tabela a cada escrita local ou replicada
+        config_cache = self.config.get('cache', {})
+        self.cache = None
+        if config_cache.get('max_entradas', 0) > 0:
+            self.cache = CacheLeituras(config_cache['max_entradas'], config_cache.get('ttl', 5.0),
+                                       config_cache.get('max_linhas', 10000))
+
+        # Servidor: uma thread por conexão ('thread') ou um único event loop asyncio ('async')
+        config_servidor = self.config.get('servidor', {})
+        self.modo_servidor = modo_servidor or config_servidor.get('modo', 'thread')
+        if self.modo_servidor not in MODOS_SERVIDOR:
+            raise ValueError(f"Modo de servidor inválido: {self.modo_servidor} (use {' ou '.join(MODOS_SERVIDOR)})")
+        self.max_workers_bd = config_servidor.get('max_workers_bd',
+                                                  self.pool_clientes.tamanho_max + self.pool_replicacao.tamanho_max)
+        self.servidor_pronto = threading.Event()
+
+        config_replicacao = self.config.get('replicacao', {})
+        self.espera_padrao = config_replicacao.get('espera', 'nenhum')
+        self.timeouts_espera = dict({'um': 1.0, 'maioria': 2.0, 'todos': 5.0}, **config_replicacao.get('timeouts', {}))
+        self.modo_escrita = config_replicacao.get('escritas', 'multimestre')
+        if self.modo_escrita not in MODOS_ESCRITA:
+            raise ValueError(f"Modo de escrita inválido: {self.modo_escrita} (use {' ou '.join(MODOS_ESCRITA)})")
+        self.escritas_repassadas = 0
+        # Quanto uma leitura com token de posição espera este nó alcançá-la antes de ir à origem da escrita
+        self.timeout_posicao = config_replicacao.get('timeout_posicao', 1.0)
+        self.leituras_com_posicao = {'aguardadas': 0, 'repassadas': 0}
+
+        # Log sequenciado das escritas deste nó e posição aplicada de cada origem (catch-up)
+        diretorio_log = config_replicacao.get('diretorio_log', 'dados')
+        self.log_replicacao = LogReplicacao(os.path.join(diretorio_log, f"replog_node{self.id_no}.jsonl"),
+                                            retencao=config_replicacao.get('retencao_log', 100000),
+                                            fsync=config_replicacao.get('fsync', True))
+        self.lote_catchup = config_replicacao.get('lote_catchup', 500)
+        # Tamanho máximo de uma resposta de catch-up (entradas de carga em massa são grandes)
+        self.bytes_catchup = config_replicacao.get('bytes_catchup', 4 * 1024 * 1024)
+        # Atraso (em entradas) a partir do qual o nó prefere um snapshot completo ao replay do log
+        self.limite_snapshot = config_replicacao.get('limite_snapshot', 100000)
+        self.lote_snapshot = config_replicacao.get('lote_snapshot', 5000)
+        self.tabelas_replicadas = config_replicacao.get('tabelas', ['users'])
+
+        # Particionamento opcional: cada linha das tabelas particionadas fica só nos donos indicados pelo anel
+        config_particionamento = self.config.get('particionamento', {})
+        self.anel = None
+        if config_particionamento.get('ativo'):
+            if self.modo_escrita == 'lider':
+                raise ValueError("O modo de escrita 'lider' não combina com o particionamento (cada linha já tem os seus donos)")
+            self.anel = AnelHash([n['id'] for n in self.info_nos], config_particionamento.get('vnodes', 64),
+                                 config_particionamento.get('fator_replicacao', 2))
+        self.tabelas_particionadas = frozenset(t.lower() for t in config_particionamento.get('tabelas', self.tabelas_replicadas))
+        self.encaminhador = None
+        self.particionamento = {'encaminhadas': 0, 'ignoradas': 0, 'distribuidas': 0}
+        self.ultimo_snapshot = None
+        self.cargas = {'partes': 0, 'linhas': 0}
+
+        # Anti-entropia: compara periodicamente as tabelas replicadas com as do coordenador (árvores
+        # de Merkle) e corrige só as faixas de chaves que divergiram
+        config_anti_entropia = self.config.get('anti_entropia', {})
+        self.anti_entropia_ativa = config_anti_entropia.get('ativo', False)
+        if self.anti_entropia_ativa and self.anel is not None:
+            raise ValueError("A anti-entropia não combina com o particionamento (cada nó guarda só parte das linhas)")
+        self.intervalo_anti_entropia = config_anti_entropia.get('intervalo', 60.0)
+        self.profundidade_merkle = config_anti_entropia.get('profundidade', 10)
+        if not 1 <= self.profundidade_merkle <= 20:
+            raise ValueError(f"Profundidade da árvore de Merkle inválida: {self.profundidade_merkle} (use de 1 a 20)")
+        self.lote_anti_entropia = config_anti_entropia.get('lote', 1000)
+        # Limites para a anti-entropia não disputar o banco e a rede com as queries dos clientes
+        self.linhas_por_segundo_anti_entropia = config_anti_entropia.get('linhas_por_segundo', 20000)
+        self.bytes_por_segundo_anti_entropia = config_anti_entropia.get('bytes_por_segundo', 1024 * 1024)
+        self.max_faixas_anti_entropia = config_anti_entropia.get('max_faixas', 64)
+        # Árvores montadas para os pares que estão comparando com este nó, descartadas depois de `validade_arvore` s
+        self.validade_arvore = config_anti_entropia.get('validade_arvore', 60.0)
+        self.arvores_pedidas = {}
+        self.anti_entropia = {'rodadas': 0, 'iguais': 0, 'adiadas': 0, 'faixas_em_transito': 0, 'faixas_corrigidas': 0,
+                              'linhas_corrigidas': 0, 'hashes_recebidos': 0, 'ultima': None}
+
+        # Group commit: escritas replicadas juntas em um REPLICATE_BATCH por janela (janela_ms 0 desliga)
+        config_lote = config_replicacao.get('lote', {})
+        janela_ms = config_lote.get('janela_ms', 2)
+        self.agrupador = None
+        if janela_ms > 0 and self.outros_nos:
+            self.agrupador = AgrupadorReplicacao(self.enviar_lote_replicacao, len(self.outros_nos), janela_ms / 1000.0,
+                                                 config_lote.get('max_entradas', 256))
+        self.lock_log = threading.Lock()
+        self.locks_origem = {n['id']: threading.RLock() for n in self.outros_nos}
+        posicoes, concluidas = self.carregar_posicoes()
+        concluidas.pop(self.id_no, None)
+        self.recuperar_log(posicoes.pop(self.id_no, None))
+        # Reenvio, a partir do log, das escritas que não puderam ser entregues a algum par
+        self.remetente = RemetenteReplicacao(lambda desde, limite: self.log_replicacao.ler(desde, limite, self.bytes_catchup),
+                                             self.reenviar_lote, lote=self.lote_catchup)
+
+        # Aplicador paralelo: escritas na mesma linha em ordem, linhas diferentes em paralelo
+        config_aplicacao = config_replicacao.get('aplicacao', {})
+        self.chaves_primarias = config_aplicacao.get('chaves_primarias', {})
+        self.aplicador = AplicadorParalelo(self.id_no, self.aplicar_itens, workers=config_aplicacao.get('workers', 4),
+                                           max_lote=config_aplicacao.get('max_lote', 64),
+                                           posicoes=posicoes, concluidas=concluidas)
+        # Maior seq contígua aplicada de cada origem (o dicionário é mantido pelo aplicador)
+        self.posicoes_aplicadas = self.aplicador.posicoes
+        self.posicoes_gravadas = dict(self.posicoes_aplicadas)
+        self.lock_posicoes = threading.Lock()
+        self.seq_anunciada = {}
+        self.sincronizando = set()
         
         # Iniciar threads de serviço
         self.iniciar_servicos()
 
     def carregar_configuracao(self, caminho):
         with open(caminho, 'r') as f:
-            self.info_nos = json.load(f)['nodes']
+            self.config = json.load(f)
+        self.info_nos = self.config['nodes']
 
     def criar_conexao(self):
-        """Cria uma nova conexão com o banco de dados."""
+        """Cria uma nova conexão com o banco de dados (fábrica usada pelos pools)."""
         try:
             conn = mysql.connector.connect(**self.config_bd)
             if conn.is_connected():
@@ -53,33 +236,115 @@ class No:
     def calcular_checksum(self, dados):
         return hashlib.md5(dados.encode()).hexdigest()
 
+    def checksum_comando(self, sql, params=None):
+        """Checksum de um comando replicado; com parâmetros, cobre o SQL e os valores."""
+        if params is None: return self.calcular_checksum(sql)
+        return self.calcular_checksum(sql + '\x00' + json.dumps(params, sort_keys=True, separators=(',', ':'), default=str))
+
+    def checksum_entrada(self, entrada):
+        """Checksum de uma entrada de replicação: um comando, uma lista de comandos ou um executemany."""
+        if 'comandos' in entrada:
+            return self.calcular_checksum(json.dumps(entrada['comandos'], sort_keys=True, separators=(',', ':'), default=str))
+        if 'lista_params' in entrada:
+            return self.calcular_checksum(json.dumps([entrada['sql'], entrada['lista_params']], separators=(',', ':'), default=str))
+        return self.checksum_comando(entrada['sql'], entrada.get('params'))
+
+    def executar_sql(self, conn, sql, params=None, dicionario=False):
+        """Executa um comando e retorna o cursor; com parâmetros, usa um prepared statement da conexão."""
+        if params is not None: return self.preparadas.executar(conn, sql, params, dicionario)
+        cursor = conn.cursor(dictionary=dicionario)
+        cursor.execute(sql)
+        return cursor
+
     def enviar_msg(self, no_alvo, msg):
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(2.0)
-                s.connect((no_alvo['ip'], no_alvo['port']))
-                s.sendall(json.dumps(msg).encode())
-        except Exception as e:
-            # Silencia heartbeats para não poluir o log, mas registra erros de replicação e eleição
-            if msg.get('type') not in ['HEARTBEAT']:
-                print(f"[Nó {self.id_no}] Erro ao enviar {msg.get('type')} para Nó {no_alvo['id']} ({no_alvo['ip']}): {e}")
+        self.enlaces[no_alvo['id']].enviar(msg)
+
+    def requisitar_msg(self, no_alvo, msg, timeout=2.0):
+        """Envia uma mensagem pelo enlace do par e retorna um Future com a resposta."""
+        return self.enlaces[no_alvo['id']].requisitar(msg, timeout=timeout)
+
+    def realizar_broadcast(self, msg, espera='nenhum', timeout=None):
+        """
+        Envia `msg` a todos os pares em paralelo. Com `espera` diferente de 'nenhum', aguarda até
+        `timeout` segundos pelos ACKs necessários ('um' par, 'maioria' do cluster contando este nó,
+        ou 'todos' os pares) e retorna um resumo das confirmações.
+        """
+        return self.aguardar_acks(self.difundir(msg, espera), espera, timeout)
 
-    def realizar_broadcast(self, msg):
-        for no in self.outros_nos:
-            self.enviar_msg(no, msg)
+    def difundir(self, msg, espera='nenhum'):
+        """Enfileira `msg` para todos os pares; retorna os Futures dos ACKs (vazio se não há espera)."""
+        if espera == 'nenhum':
+            for no in self.outros_nos:
+                self.enviar_msg(no, msg)
+            return []
+        timeout = self.timeouts_espera.get(espera, 5.0)
+        return [self.requisitar_msg(no, msg, timeout=timeout) for no in self.outros_nos]
+
+    def enviar_lote_replicacao(self, entradas, com_ack):
+        """Envia um lote de escritas a todos os pares; com ACK, usa o maior timeout de espera."""
+        msg = {'type': 'REPLICATE_BATCH', 'origin': self.id_no, 'entradas': entradas}
+        if not com_ack:
+            return self.difundir(msg)
+        timeout = max(self.timeouts_espera.values())
+        futuros = [self.requisitar_msg(no, msg, timeout=timeout) for no in self.outros_nos]
+        for no, futuro in zip(self.outros_nos, futuros):
+            futuro.add_done_callback(lambda f, par=no['id']: self.conferir_ack(f, par, msg))
+        return futuros
+
+    def conferir_ack(self, futuro, par, msg):
+        if futuro.exception() is not None or not futuro.result().get('ok'):
+            self.falha_de_envio(par, msg)
+
+    def falha_de_envio(self, par, msg):
+        """Uma escrita deste nó não chegou (ou não foi confirmada) ao `par`: o remetente a reenvia do log."""
+        if msg.get('type') not in ('REPLICATE', 'REPLICATE_BATCH') or msg.get('origin') != self.id_no:
+            return
+        seqs = [entrada['seq'] for entrada in msg.get('entradas', [msg])]
+        self.remetente.pendente(par, min(seqs) - 1, max(seqs))
+
+    def reenviar_lote(self, par, entradas):
+        no = next(n for n in self.outros_nos if n['id'] == par)
+        return self.requisitar_msg(no, {'type': 'REPLICATE_BATCH', 'origin': self.id_no, 'entradas': entradas},
+                                   timeout=self.remetente.timeout)
+
+    def aguardar_acks(self, futuros, espera='nenhum', timeout=None):
+        necessarios = self.acks_necessarios(espera)
+        timeout = self.timeouts_espera.get(espera, 0) if timeout is None else timeout
+        prazo = time.monotonic() + timeout
+        acks, pendentes = 0, set(futuros)
+        while acks < necessarios and pendentes:
+            restante = prazo - time.monotonic()
+            if restante <= 0: break
+            prontos, pendentes = wait(pendentes, timeout=restante, return_when=FIRST_COMPLETED)
+            acks += sum(1 for f in prontos if not f.exception() and f.result().get('ok'))
+        return {'espera': espera, 'acks': acks, 'necessarios': necessarios, 'confirmada': acks >= necessarios}
+
+    def acks_necessarios(self, espera):
+        if espera not in MODOS_ESPERA:
+            raise ValueError(f"Modo de espera inválido: {espera} (use {', '.join(MODOS_ESPERA)})")
+        return {'nenhum': 0, 'um': min(1, len(self.outros_nos)), 'todos': len(self.outros_nos),
+                'maioria': len(self.info_nos) // 2}[espera]
 
     def iniciar_servicos(self):
-        threading.Thread(target=self.executar_servidor, daemon=True).start()
+        if self.modo_servidor == 'async':
+            threading.Thread(target=self.executar_servidor_async, daemon=True).start()
+        else:
+            threading.Thread(target=self.executar_servidor, daemon=True).start()
+        self.servidor_pronto.wait(timeout=5.0)
         threading.Thread(target=self.enviar_heartbeat, daemon=True).start()
         threading.Thread(target=self.monitorar_nos, daemon=True).start()
+        threading.Thread(target=self.gravar_posicoes, daemon=True).start()
+        if self.anti_entropia_ativa:
+            threading.Thread(target=self.executar_anti_entropia, daemon=True).start()
         self.iniciar_eleicao()
 
     def executar_servidor(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.bind((self.eu['ip'], self.eu['port']))
-        sock.listen(10)
+        sock.listen(socket.SOMAXCONN)
         sock.settimeout(1.0)
+        self.servidor_pronto.set()
         while self.em_execucao:
             try:
                 conn, _ = sock.accept()
@@ -88,125 +353,1474 @@ class No:
                 continue
             except Exception as e:
                 if self.em_execucao: print(f"[Nó {self.id_no}] Erro no socket: {e}")
+        sock.close()
+
+    def executar_servidor_async(self):
+        asyncio.run(self._servidor_async())
+
+    async def _servidor_async(self):
+        """
+        Servidor asyncio: todas as conexões (clientes e enlaces de outros nós) num único
+        event loop. Chamadas bloqueantes ao banco vão para um executor com `max_workers_bd` threads.
+        """
+        self.executor_bd = ThreadPoolExecutor(max_workers=self.max_workers_bd, thread_name_prefix=f"no{self.id_no}-bd")
+        # Limita as tarefas na fila do executor para aplicar contrapressão aos clientes
+        self._vagas_executor = asyncio.Semaphore(self.max_workers_bd * 4)
+        escritores = set()
+
+        async def tratar(reader, writer):
+            escritores.add(writer)
+            try:
+                await self._tratar_cliente_async(reader, writer)
+            finally:
+                escritores.discard(writer)
+
+        servidor = await asyncio.start_server(tratar, self.eu['ip'], self.eu['port'],
+                                              reuse_address=True, backlog=socket.SOMAXCONN)
+        self.servidor_pronto.set()
+        try:
+            while self.em_execucao:
+                await asyncio.sleep(0.5)
+        finally:
+            servidor.close()
+            for writer in list(escritores):
+                writer.close()
+            self.executor_bd.shutdown(wait=False, cancel_futures=True)
+
+    async def _tratar_cliente_async(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None: sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while self.em_execucao:
+                try:
+                    tamanho, = CABECALHO.unpack(await reader.readexactly(CABECALHO.size))
+                    msg = json.loads(await reader.readexactly(tamanho))
+                except asyncio.IncompleteReadError:
+                    break
+                await self._responder_async(msg, writer)
+        except (OSError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            print(f"[Nó {self.id_no}] Erro ao tratar cliente: {e}")
+        finally:
+            with self.lock: self.assinantes.pop(writer, None)
+            writer.close()
+
+    async def _responder_async(self, msg, writer):
+        """
+        Responde uma mensagem no servidor async. Mensagens que não tocam o banco são tratadas
+        no próprio event loop; as demais rodam no executor, que codifica os frames e os entrega
+        ao loop por uma fila limitada por créditos, enquanto o loop os escreve no socket.
+        """
+        if msg.get('type') in ('HEARTBEAT', 'GET_COORDINATOR', 'SUBSCRIBE'):
+            if msg.get('type') == 'SUBSCRIBE':
+                loop = asyncio.get_running_loop()
+                self.assinar(writer, lambda dados: loop.call_soon_threadsafe(writer.write, dados))
+            for frame in self.responder(msg):
+                writer.write(self._codificar_resposta(msg, frame))
+            await writer.drain()
+            return
+
+        loop = asyncio.get_running_loop()
+        fila = asyncio.Queue()
+        creditos = threading.Semaphore(8)
+        abortado = threading.Event()
+        fim = object()
+
+        def produzir():
+            frames = self.responder(msg)
+            try:
+                for frame in frames:
+                    creditos.acquire()
+                    if abortado.is_set(): break
+                    loop.call_soon_threadsafe(fila.put_nowait, self._codificar_resposta(msg, frame))
+            except Exception as e:
+                print(f"[Nó {self.id_no}] Erro ao tratar cliente: {e}")
+            finally:
+                frames.close()
+                try: loop.call_soon_threadsafe(fila.put_nowait, fim)
+                except RuntimeError: pass  # event loop já encerrado
+
+        async with self._vagas_executor:
+            tarefa = loop.run_in_executor(self.executor_bd, produzir)
+            try:
+                while True:
+                    dados = await fila.get()
+                    if dados is fim: break
+                    writer.write(dados)
+                    await writer.drain()
+                    creditos.release()
+            finally:
+                abortado.set()
+                creditos.release()
+            await tarefa
+
+    def _marcar_resposta(self, msg, frame):
+        """Marca a resposta com a requisição a que responde e o mandato atual, se o remetente a identificou."""
+        if msg.get('id_req') is None: return frame
+        return dict(frame, resposta_a=msg['id_req'], mandato=self.mandato)
+
+    def _codificar_resposta(self, msg, frame):
+        return codificar_frame(self._marcar_resposta(msg, frame))
+
+    def assinar(self, conexao, enviar):
+        """Registra `enviar(dados)` para receber os avisos de troca de coordenador até a `conexao` fechar."""
+        with self.lock: self.assinantes[conexao] = enviar
+
+    def avisar_assinantes(self):
+        with self.lock:
+            aviso = codificar_frame({'type': 'COORDINATOR', 'coordinator_id': self.id_coordenador,
+                                     'mandato': self.mandato, 'node': self.id_no})
+            assinantes = list(self.assinantes.items())
+        for conexao, enviar in assinantes:
+            try:
+                enviar(aviso)
+            except (OSError, RuntimeError):
+                with self.lock: self.assinantes.pop(conexao, None)
 
     def tratar_cliente(self, conn):
+        """Atende uma conexão (cliente ou enlace de outro nó): várias mensagens em frames na mesma conexão."""
+        leitor = LeitorFrames(conn)
+        # Avisos de coordenador podem ser escritos por outra thread: as escritas na conexão passam pelo lock
+        lock_envio = threading.Lock()
+        def enviar(dados):
+            with lock_envio: conn.sendall(dados)
+        with self.lock: self.conexoes_recebidas.add(conn)
         try:
             with conn:
-                dados = conn.recv(8192)
-                if not dados: return
-                msg = json.loads(dados.decode())
-                if msg.get('type') == 'CLIENT_QUERY':
-                    resposta = self.executar_query(msg['sql'])
-                    conn.sendall(json.dumps(resposta).encode())
-                elif msg.get('type') == 'GET_COORDINATOR':
-                    resposta = {'status': 'success', 'coordinator_id': self.id_coordenador}
-                    conn.sendall(json.dumps(resposta).encode())
-                else:
-                    self.processar_mensagem(msg)
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                while self.em_execucao:
+                    msg = leitor.ler()
+                    if msg is None: break
+                    if msg.get('type') == 'SUBSCRIBE': self.assinar(conn, enviar)
+                    for frame in self.responder(msg):
+                        enviar(self._codificar_resposta(msg, frame))
+        except OSError:
+            pass
         except Exception as e:
             print(f"[Nó {self.id_no}] Erro ao tratar cliente: {e}")
+        finally:
+            with self.lock:
+                self.conexoes_recebidas.discard(conn)
+                self.assinantes.pop(conn, None)
+
+    def responder(self, msg):
+        """Gera os frames de resposta de uma mensagem (nenhum, um ou vários, no caso de resultados em partes)."""
+        tipo_msg = msg.get('type')
+        if tipo_msg == 'CLIENT_QUERY':
+            inicio = time.monotonic()
+            if self.escrita_do_lider(msg):
+                yield self.repassar_ao_lider(msg)
+            else:
+                yield from self.executar_query_em_partes(msg['sql'], msg.get('espera'), msg.get('timeout_espera'),
+                                                         msg.get('params'), msg.get('local', False), msg.get('consistencia'),
+                                                         msg.get('posicao'))
+            if not msg.get('local'):
+                nivel = NIVEIS_CONSISTENCIA.get(msg.get('consistencia'), 'padrao')
+                tipo = 'escrita' if classificar(msg['sql']).escrita else 'leitura'
+                self.latencias.registrar(f"{nivel}:{tipo}", time.monotonic() - inicio)
+        elif tipo_msg == 'CLIENT_BATCH':
+            yield self.repassar_ao_lider(msg) if self.escrita_do_lider(msg) else self.executar_lote(msg)
+        elif tipo_msg == 'BULK_LOAD':
+            yield self.carregar_em_massa(msg)
+        elif tipo_msg in ('GET_COORDINATOR', 'SUBSCRIBE'):
+            yield {'status': 'success', 'coordinator_id': self.id_coordenador, 'mandato': self.mandato}
+        elif tipo_msg == 'SNAPSHOT':
+            yield from self.gerar_snapshot(msg)
+        elif tipo_msg == 'MERKLE':
+            yield self.atender_merkle(msg)
+        elif tipo_msg == 'MERKLE_LINHAS':
+            yield from self.gerar_linhas_merkle(msg)
+        elif tipo_msg == 'GET_STATS':
+            yield {'status': 'success', 'node': self.id_no, 'stats': self.estatisticas()}
+        else:
+            resposta = self.processar_mensagem(msg)
+            if resposta is not None and msg.get('id_req') is not None:
+                yield resposta
 
     def processar_mensagem(self, msg):
+        """Trata uma mensagem do cluster; o retorno, se houver, é a resposta ao remetente."""
         tipo_msg = msg.get('type')
         if tipo_msg == 'HEARTBEAT':
-            with self.lock: self.nos_vivos[msg['id']] = time.time()
+            with self.lock:
+                self.nos_vivos[msg['id']] = time.time()
+                self.detector.registrar(msg['id'])
+                self.mandato = max(self.mandato, msg.get('mandato', 0))
+            self.verificar_atraso(msg['id'], msg.get('seq', 0))
         elif tipo_msg == 'ELECTION':
             if msg['id'] < self.id_no:
-                remetente = next(n for n in self.info_nos if n['id'] == msg['id'])
-                self.enviar_msg(remetente, {'type': 'ELECTION_OK', 'id': self.id_no})
-                self.iniciar_eleicao()
+                # A eleição roda fora do enlace para não atrasar as próximas mensagens do par
+                threading.Thread(target=self.iniciar_eleicao, daemon=True).start()
+                return {'type': 'ELECTION_OK', 'id': self.id_no}
         elif tipo_msg == 'COORDINATOR':
             with self.lock:
+                # Um coordenador que acabou de subir pode anunciar um mandato menor que o já conhecido
+                trocou = 1 if self.id_coordenador != msg['id'] else 0
+                self.mandato = max(self.mandato + trocou, msg.get('mandato', 0))
                 self.id_coordenador = msg['id']
                 print(f"[Nó {self.id_no}] Novo Coordenador: {self.id_coordenador}")
-        elif tipo_msg == 'REPLICATE':
-            self.executar_query_replicada(msg)
+            self.avisar_assinantes()
+        elif tipo_msg in ('REPLICATE', 'REPLICATE_BATCH'):
+            return {'type': 'REPLICATE_ACK', 'id': self.id_no, 'ok': self.executar_query_replicada(msg)}
+        elif tipo_msg == 'CATCHUP_REQ':
+            return self.atender_catchup(msg)
+        elif tipo_msg == 'GET_VERSION':
+            return {'type': 'VERSION', 'id': self.id_no, 'versao': self.versao()}
 
     def enviar_heartbeat(self):
         while self.em_execucao:
-            self.realizar_broadcast({'type': 'HEARTBEAT', 'id': self.id_no})
-            time.sleep(2)
+            # O heartbeat anuncia a última seq do log, para que pares atrasados peçam o que falta
+            heartbeat = {'type': 'HEARTBEAT', 'id': self.id_no, 'seq': self.log_replicacao.ultimo_seq, 'mandato': self.mandato}
+            for enlace in self.enlaces_heartbeat.values(): enlace.enviar(heartbeat)
+            time.sleep(self.intervalo_heartbeat)
 
     def monitorar_nos(self):
         while self.em_execucao:
-            time.sleep(5)
-            agora = time.time()
+            time.sleep(self.intervalo_verificacao)
+            perdeu_coordenador = False
             with self.lock:
-                nos_mortos = [nid for nid, visto in self.nos_vivos.items() 
-                              if agora - visto > 10 and nid != self.id_no]
+                suspeitas = {nid: self.detector.phi(nid) for nid in self.nos_vivos if nid != self.id_no}
+                nos_mortos = [nid for nid, phi in suspeitas.items() if phi >= self.detector.limiar]
                 for nid in nos_mortos:
-                    print(f"[Nó {self.id_no}] Nó {nid} offline")
+                    print(f"[Nó {self.id_no}] Nó {nid} offline (phi {suspeitas[nid]:.1f})")
                     del self.nos_vivos[nid]
+                    self.nos_declarados_offline += 1
                     if self.id_coordenador == nid:
                         self.id_coordenador = None
-                        self.iniciar_eleicao()
+                        perdeu_coordenador = True
+            # A eleição espera respostas da rede, então roda fora do lock (o servidor async também o usa)
+            if perdeu_coordenador: self.iniciar_eleicao()
 
     def iniciar_eleicao(self):
         print(f"[Nó {self.id_no}] Iniciando eleição...")
         superiores = [n for n in self.outros_nos if n['id'] > self.id_no]
         if not superiores:
-            self.id_coordenador = self.id_no
-            self.realizar_broadcast({'type': 'COORDINATOR', 'id': self.id_no})
+            self.assumir_coordenacao()
             print(f"[Nó {self.id_no}] Eu sou o coordenador")
         else:
-            for n in superiores: self.enviar_msg(n, {'type': 'ELECTION', 'id': self.id_no})
-            time.sleep(2.0)
+            futuros = [self.requisitar_msg(n, {'type': 'ELECTION', 'id': self.id_no}) for n in superiores]
+            wait(futuros, timeout=2.0)
+            algum_ok = any(f.done() and not f.exception() for f in futuros)
+            # Se um nó superior respondeu, aguarda o anúncio dele antes de assumir
+            if algum_ok: time.sleep(2.0)
             if self.id_coordenador is None:
-                self.id_coordenador = self.id_no
-                self.realizar_broadcast({'type': 'COORDINATOR', 'id': self.id_no})
+                self.assumir_coordenacao()
 
-    def executar_query(self, sql):
-        eh_escrita = any(p in sql.upper() for p in ["INSERT", "UPDATE", "DELETE", "CREATE", "DROP", "ALTER"])
-        checksum = self.calcular_checksum(sql)
-        print(f"[Nó {self.id_no}] Executando Query: {sql}")
-        
-        # Conexão Sob Demanda
-        conn = self.criar_conexao()
-        if not conn: 
-            return {"status": "error", "node": self.id_no, "message": "Falha ao conectar ao Banco de Dados"}
+    def assumir_coordenacao(self):
+        with self.lock:
+            # Reanunciar a coordenação (ex.: eleição puxada por um nó que acabou de subir) não abre mandato novo
+            if self.id_coordenador != self.id_no: self.mandato += 1
+            self.id_coordenador = self.id_no
+            mandato = self.mandato
+        self.realizar_broadcast({'type': 'COORDINATOR', 'id': self.id_no, 'mandato': mandato})
+        self.avisar_assinantes()
+
+    def executar_query(self, sql, espera=None, timeout_espera=None, params=None):
+        return juntar_resposta(self.executar_query_em_partes(sql, espera, timeout_espera, params))
+
+    def executar_query_em_partes(self, sql, espera=None, timeout_espera=None, params=None, local=False, consistencia=None,
+                                 posicao=None):
+        """
+        Executa a query e gera os frames da resposta. Resultados de leitura são enviados
+        em partes de até `linhas_por_parte` linhas, lidas do cursor conforme são enviadas.
+        Escritas são replicadas e, conforme `espera`, aguardam os ACKs dos pares.
+        Com `params` (lista para %s, dicionário para %(nome)s), o comando roda como prepared
+        statement e é replicado com os mesmos parâmetros. No modo particionado, a query de uma
+        única linha que este nó não guarda é repassada aos donos dela (ver `encaminhar`), e
+        leituras das demais linhas são distribuídas entre os nós (ver `consultar_particoes`);
+        com `local`, a query é a parte de outro nó e roda só aqui. A `consistencia` ('um',
+        'maioria' ou 'todos'; ONE, QUORUM ou ALL) define quantas réplicas confirmam uma escrita
+        e quantas são consultadas numa leitura (ver `replica_mais_nova`). Uma leitura com a `posicao`
+        devolvida por uma escrita só roda depois que este nó aplicou essa escrita (ver `aguardar_posicao`).
+        """
+        if consistencia is not None:
+            if consistencia not in NIVEIS_CONSISTENCIA:
+                yield {"status": "error", "node": self.id_no, "message": f"Nível de consistência inválido: {consistencia}"}
+                return
+            consistencia = NIVEIS_CONSISTENCIA[consistencia]
+            espera = ESPERA_DA_CONSISTENCIA[consistencia]
+        if posicao is not None and not (isinstance(posicao, dict) and all(
+                origem in {str(n['id']) for n in self.info_nos} and type(seq) is int for origem, seq in posicao.items())):
+            yield {"status": "error", "node": self.id_no, "message": f"Posição inválida: {posicao}"}
+            return
+        espera = espera or self.espera_padrao
+        if espera not in MODOS_ESPERA:
+            yield {"status": "error", "node": self.id_no, "message": f"Modo de espera inválido: {espera}"}
+            return
+        # Classificação pelos tokens do comando (literais e comentários não contam), memoizada por texto
+        classificacao = classificar(sql)
+        eh_escrita = classificacao.escrita
+        if params is not None and not isinstance(params, (list, dict)):
+            yield {"status": "error", "node": self.id_no, "message": "params deve ser uma lista ou um objeto"}
+            return
+        checksum = self.checksum_comando(sql, params)
+        print(f"[Nó {self.id_no}] Executando Query: {sql}" + (f" {params}" if params is not None else ""))
+
+        donos = None
+        cabecalho = {"status": "success", "node": self.id_no}
+        if self.anel is not None and not local:
+            donos = self.donos_da_linha((chave_de_escrita if eh_escrita else chave_de_leitura)(sql, self.chaves_primarias, params))
+            if donos is not None and self.id_no not in donos:
+                with self.lock: self.particionamento['encaminhadas'] += 1
+                yield self.encaminhar(donos, {'type': 'CLIENT_QUERY', 'sql': sql, 'params': params, 'espera': espera,
+                                              'timeout_espera': timeout_espera, 'consistencia': consistencia,
+                                              'posicao': posicao}, eh_escrita)
+                return
+            if classificacao.tipo == 'SELECT' and donos is None and self.le_particionada(classificacao):
+                plano = plano_distribuido(sql)
+                if plano is not None and plano.tabela in self.tabelas_particionadas:
+                    yield from self.consultar_particoes(plano, params, posicao)
+                    return
+                # Só com as linhas guardadas neste nó, o resultado sairia incompleto
+                yield {"status": "error", "node": self.id_no,
+                       "message": "Consulta em tabela particionada que não pode ser distribuída (junção, subconsulta, "
+                                  "DISTINCT, GROUP BY ou ordenação por expressão)"}
+                return
+        if posicao and not eh_escrita:
+            atrasadas = self.aguardar_posicao(posicao)
+            if atrasadas and local:
+                yield {"status": "error", "node": self.id_no, "message": f"Nó {self.id_no} não alcançou a posição {posicao} "
+                                                                          f"em {self.timeout_posicao}s"}
+                return
+            if atrasadas:
+                # A origem de uma escrita sempre a tem aplicada; as outras origens da posição ela
+                # ainda precisa esperar, sem repassar de novo
+                with self.lock: self.leituras_com_posicao['repassadas'] += 1
+                yield self.encaminhar(atrasadas[:1], {'type': 'CLIENT_QUERY', 'sql': sql, 'params': params, 'local': True,
+                                                      'posicao': posicao, 'consistencia': consistencia}, False)
+                return
+        if not eh_escrita and not local and consistencia in ('maioria', 'todos'):
+            replicas = donos or [n['id'] for n in self.info_nos]
+            mais_nova = self.replica_mais_nova(replicas, consistencia)
+            if mais_nova is None:
+                yield {"status": "error", "node": self.id_no, "consistencia": consistencia,
+                       "message": f"Réplicas insuficientes para leitura com consistência '{consistencia}'"}
+                return
+            if mais_nova != self.id_no:
+                yield dict(self.encaminhar([mais_nova], {'type': 'CLIENT_QUERY', 'sql': sql, 'params': params,
+                                                         'local': True, 'posicao': posicao}, False), consistencia=consistencia)
+                return
+            cabecalho['consistencia'] = consistencia
+
+        ticket = None
+        if not eh_escrita and self.cache:
+            em_cache, ticket = self.cache.obter(sql, params)
+            if em_cache is not None:
+                yield dict(cabecalho, stream=True, cache=True)
+                for i in range(0, len(em_cache), self.linhas_por_parte):
+                    yield {"rows": em_cache[i:i + self.linhas_por_parte]}
+                yield {"fim": True, "total": len(em_cache)}
+                return
         
         try:
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute(sql)
-            resultado = cursor.fetchall() if not eh_escrita else None
-            conn.commit()
-            
-            if eh_escrita:
-                print(f"[Nó {self.id_no}] Replicando Checksum: {checksum}")
-                self.realizar_broadcast({
-                    'type': 'REPLICATE', 'sql': sql, 'checksum': checksum, 'origin': self.id_no
-                })
-            return {"status": "success", "node": self.id_no, "data": resultado}
+            with self.pool_clientes.conexao() as conn:
+                # A escrita só é confirmada no commit de replicar_escrita, na mesma transação da sua seq
+                if eh_escrita: conn.start_transaction()
+                try:
+                    cursor = self.executar_sql(conn, sql, params, dicionario=True)
+                except Error:
+                    if eh_escrita: conn.rollback()
+                    raise
+                if not eh_escrita:
+                    # A parte de uma consulta distribuída indica as colunas DECIMAL, que chegam como texto
+                    # e precisam ser comparadas como números ao juntar as partes (ver `juntar_ordenado`)
+                    decimais = [d[0].lower() for d in (cursor.description or ()) if d[1] in TIPOS_DECIMAIS] if local else []
+                    yield dict(cabecalho, stream=True, decimais=decimais) if decimais else dict(cabecalho, stream=True)
+                    total = 0
+                    # Guarda as linhas para o cache enquanto o resultado couber nele
+                    guardadas = [] if ticket else None
+                    try:
+                        while True:
+                            linhas = cursor.fetchmany(self.linhas_por_parte)
+                            if not linhas: break
+                            total += len(linhas)
+                            if guardadas is not None:
+                                guardadas.extend(linhas)
+                                if len(guardadas) > self.cache.max_linhas: guardadas = None
+                            yield {"rows": linhas}
+                    except Error as e:
+                        print(f"[Nó {self.id_no}] Erro SQL: {e}")
+                        yield {"status": "error", "node": self.id_no, "message": str(e), "fim": True}
+                        return
+                    if guardadas is not None: self.cache.guardar(ticket, guardadas)
+                    yield {"fim": True, "total": total}
+                    return
+                entrada = {'sql': sql, 'checksum': checksum}
+                if params is not None: entrada['params'] = params
+                if donos is not None: entrada['donos'] = donos
+                futuros, seq = self.replicar_escrita(conn, entrada, espera)
+            yield self.resposta_escrita(futuros, seq, espera, timeout_espera, data=None)
         except Error as e:
             print(f"[Nó {self.id_no}] Erro SQL: {e}")
-            return {"status": "error", "node": self.id_no, "message": str(e)}
+            yield {"status": "error", "node": self.id_no, "message": str(e)}
+
+    def executar_lote(self, msg):
+        """
+        Executa um CLIENT_BATCH em uma única transação: uma lista de `comandos` ({'sql', 'params'})
+        ou um `sql` com vários conjuntos de parâmetros em `lista_params` (executemany). O lote é
+        replicado como uma só entrada do log e a resposta traz as linhas afetadas por comando.
+        """
+        if msg.get('comandos'):
+            entrada = {'comandos': [{'sql': c['sql'], 'params': c['params']} if c.get('params') is not None
+                                    else {'sql': c['sql']} for c in msg['comandos']]}
+        elif msg.get('sql') and msg.get('lista_params'):
+            entrada = {'sql': msg['sql'], 'lista_params': msg['lista_params']}
+        else:
+            return {"status": "error", "node": self.id_no, "message": "CLIENT_BATCH precisa de 'comandos' ou de 'sql' e 'lista_params'"}
+        leituras = [sql for sql in self.sqls_da_entrada(entrada) if not classificar(sql).escrita]
+        if leituras:
+            return {"status": "error", "node": self.id_no, "message": f"CLIENT_BATCH só aceita escritas: {leituras[0]}"}
+        print(f"[Nó {self.id_no}] Executando lote: {len(entrada.get('comandos') or entrada['lista_params'])} comandos")
+        donos = self.donos_dos_comandos(entrada)
+        if donos is not None: entrada['donos_por_comando'] = donos
+        return self.gravar_lote(entrada, msg.get('espera') or self.espera_padrao, msg.get('timeout_espera'))
+
+    def carregar_em_massa(self, msg):
+        """
+        Insere uma parte de uma carga em massa (BULK_LOAD): `linhas` da `tabela`, nas `colunas`
+        dadas. Só o coordenador aceita cargas; a parte é gravada em uma transação e replicada
+        em um lote próprio. Com a espera padrão 'todos', a resposta só sai depois que os pares
+        aplicaram a parte, o que limita quanto o importador pode adiantar.
+        """
+        if self.id_coordenador != self.id_no:
+            return {"status": "error", "node": self.id_no, "coordinator_id": self.id_coordenador, "mandato": self.mandato,
+                    "message": "Cargas em massa devem ser enviadas ao coordenador"}
+        tabela, colunas, linhas = msg.get('tabela'), msg.get('colunas') or [], msg.get('linhas') or []
+        if tabela not in self.tabelas_replicadas:
+            return {"status": "error", "node": self.id_no, "message": f"Tabela não replicada: {tabela}"}
+        if not colunas or any('`' in c for c in colunas) or any(len(linha) != len(colunas) for linha in linhas):
+            return {"status": "error", "node": self.id_no, "message": "Colunas inválidas na carga"}
+        if not linhas:
+            return {"status": "success", "node": self.id_no, "linhas": [0], "total": 0}
+        sql = (f"INSERT INTO `{tabela}` ({', '.join(f'`{c}`' for c in colunas)}) "
+               f"VALUES ({', '.join(['%s'] * len(colunas))})")
+        entrada = {'sql': sql, 'lista_params': linhas}
+        chave = self.chaves_primarias.get(tabela.lower(), 'id').lower()
+        nomes = [c.lower() for c in colunas]
+        # Tabela particionada: cada linha fica só com os seus donos (sem a chave, em todos os nós)
+        if self.anel is not None and tabela.lower() in self.tabelas_particionadas and chave in nomes:
+            indice = nomes.index(chave)
+            entrada['donos_por_comando'] = [self.anel.donos(tabela.lower(), linha[indice]) for linha in linhas]
+        resposta = self.gravar_lote(entrada, msg.get('espera') or 'todos', msg.get('timeout_espera'), sozinha=True)
+        if resposta.get('total') is not None:
+            with self.lock:
+                self.cargas['partes'] += 1
+                self.cargas['linhas'] += len(linhas)
+        return resposta
+
+    def gravar_lote(self, entrada, espera, timeout_espera=None, sozinha=False):
+        """
+        Executa os comandos de `entrada` em uma transação, replica-a e monta a resposta com as linhas
+        afetadas. Comandos de linhas que este nó não guarda (ver `donos_dos_comandos`) só são replicados.
+        """
+        if espera not in MODOS_ESPERA:
+            return {"status": "error", "node": self.id_no, "message": f"Modo de espera inválido: {espera}"}
+        entrada['checksum'] = self.checksum_entrada(entrada)
+        indice = 0
+        try:
+            with self.pool_clientes.conexao() as conn:
+                try:
+                    conn.start_transaction()
+                    cursor = conn.cursor()
+                    if 'lista_params' in entrada:
+                        guardados = self.comandos_guardados(entrada)
+                        if guardados: cursor.executemany(entrada['sql'], guardados)
+                        linhas = [cursor.rowcount if guardados else 0]
+                    else:
+                        linhas = []
+                        donos = entrada.get('donos_por_comando') or [None] * len(entrada['comandos'])
+                        for indice, comando in enumerate(entrada['comandos']):
+                            guardado = donos[indice] is None or self.id_no in donos[indice]
+                            linhas.append(self.executar_comando(conn, cursor, comando['sql'], comando.get('params')).rowcount
+                                          if guardado else 0)
+                except Error:
+                    conn.rollback()
+                    raise
+                futuros, seq = self.replicar_escrita(conn, entrada, espera, sozinha)
+            return self.resposta_escrita(futuros, seq, espera, timeout_espera, linhas=linhas, total=sum(linhas))
+        except Error as e:
+            print(f"[Nó {self.id_no}] Erro SQL no lote (comando {indice}): {e}")
+            return {"status": "error", "node": self.id_no, "message": str(e), "comando": indice}
+
+    def replicar_escrita(self, conn, entrada, espera, sozinha=False):
+        """
+        Grava a entrada no log, faz o commit da escrita local e a envia aos pares; retorna os
+        Futures dos ACKs e a seq. A escrita precisa estar numa transação aberta em `conn`, ainda
+        sem commit. Log, commit e envio ficam sob o mesmo lock: a ordem das seqs é a dos commits.
+        A seq é gravada na mesma transação (ver `recuperar_log`), e a resposta só sai depois do fsync
+        do log, feito em grupo. Com `sozinha`, a entrada não é agrupada com outras no group commit.
+        Se a seq não puder ser gravada, a transação é desfeita e a entrada sai do log.
+        """
+        with self.lock_log:
+            seq = self.log_replicacao.anexar(entrada)
+            try:
+                conn.cursor().execute(SQL_SALVAR_POSICAO, (self.id_no, seq))
+                conn.commit()
+            except Error:
+                self.log_replicacao.descartar(seq)
+                conn.rollback()
+                raise
+            print(f"[Nó {self.id_no}] Replicando Checksum: {entrada['checksum']} (seq {seq})")
+            entrada = dict(entrada, seq=seq)
+            if self.agrupador:
+                futuros = self.agrupador.adicionar(entrada, com_ack=espera != 'nenhum', sozinha=sozinha)
+            else:
+                futuros = self.difundir(dict(entrada, type='REPLICATE', origin=self.id_no), espera)
+        if self.cache: self.cache.invalidar(self.tabelas_alteradas(self.sqls_da_entrada(entrada)))
+        self.log_replicacao.sincronizar(seq)
+        return futuros, seq
+
+    def resposta_escrita(self, futuros, seq, espera, timeout_espera, **dados):
+        """
+        Aguarda os ACKs pedidos em `espera` e monta a resposta da escrita ao cliente. A `posicao`
+        da resposta ({origem: seq}) é o token que o cliente manda nas leituras seguintes para ver
+        a própria escrita em qualquer réplica (ver `aguardar_posicao`).
+        """
+        dados['posicao'] = {str(self.id_no): seq}
+        replicacao = self.aguardar_acks(futuros, espera, timeout_espera)
+        if not replicacao['confirmada']:
+            return dict(dados, status="error", node=self.id_no, replicacao=replicacao,
+                        message=f"Replicação não confirmada ({replicacao['acks']}/{replicacao['necessarios']} ACKs); escrita aplicada localmente")
+        return dict(dados, status="success", node=self.id_no, replicacao=replicacao)
+
+    def executar_comando(self, conn, cursor, sql, params=None):
+        """Executa uma escrita no `cursor` comum, ou em um prepared statement se houver parâmetros."""
+        if params is None:
+            cursor.execute(sql)
+            return cursor
+        return self.preparadas.executar(conn, sql, params)
+
+    def donos_da_linha(self, chave):
+        """
+        IDs dos nós que guardam a linha `chave` = (tabela, valor) de uma tabela particionada, o
+        principal primeiro; None se a linha não é de uma tabela particionada ou não foi identificada,
+        caso em que o comando vale para todos os nós (como sem particionamento).
+        """
+        if self.anel is None or chave is None or chave[1] is None or chave[0] not in self.tabelas_particionadas:
+            return None
+        return self.anel.donos(*chave)
+
+    def le_particionada(self, classificacao):
+        """
+        Indica se uma leitura pode envolver tabelas particionadas: pelas tabelas da classificação
+        ou, quando elas não são conhecidas (subconsultas, por exemplo), pelos nomes nos tokens.
+        """
+        if classificacao.tabelas is not None: return bool(classificacao.tabelas & self.tabelas_particionadas)
+        return any(token.strip('`').lower() in self.tabelas_particionadas for token in classificacao.normalizado.split())
+
+    def versao(self):
+        """Versão dos dados deste nó: a última seq aplicada de cada origem, incluindo as escritas do próprio nó."""
+        versao = {str(origem): seq for origem, seq in dict(self.posicoes_aplicadas).items()}
+        versao[str(self.id_no)] = self.log_replicacao.ultimo_seq
+        return versao
+
+    def aguardar_posicao(self, posicao):
+        """
+        Espera, por até `timeout_posicao` segundos, este nó aplicar as escritas até a `posicao`
+        ({origem: seq}, das respostas de escrita). Retorna as origens que continuam atrasadas.
+        """
+        atrasadas = [int(origem) for origem, seq in posicao.items()
+                     if int(origem) != self.id_no and self.posicoes_aplicadas.get(int(origem), 0) < seq]
+        if not atrasadas: return []
+        with self.lock: self.leituras_com_posicao['aguardadas'] += 1
+        prazo = time.monotonic() + self.timeout_posicao
+        return [origem for origem in atrasadas
+                if not self.aplicador.aguardar_posicao(origem, posicao[str(origem)], max(0.0, prazo - time.monotonic()))]
+
+    def replica_mais_nova(self, replicas, consistencia):
+        """
+        Pergunta em paralelo a versão (ver `versao`) das `replicas` e retorna o ID da mais nova
+        entre as primeiras a responder: a maioria delas ou todas, conforme a `consistencia`.
+        A versão é comparada pelo total de escritas aplicadas; num empate, fica este nó, que não
+        precisa repassar a leitura. None se não responderam réplicas suficientes a tempo.
+        """
+        necessarias = len(replicas) // 2 + 1 if consistencia == 'maioria' else len(replicas)
+        versoes = {self.id_no: self.versao()}
+        timeout = self.timeouts_espera.get(consistencia, 5.0)
+        pendentes = {self.requisitar_msg(no, {'type': 'GET_VERSION'}, timeout=timeout)
+                     for no in self.outros_nos if no['id'] in replicas}
+        prazo = time.monotonic() + timeout
+        while len(versoes) < necessarias and pendentes:
+            restante = prazo - time.monotonic()
+            if restante <= 0: break
+            prontos, pendentes = wait(pendentes, timeout=restante, return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                if not futuro.exception(): versoes[futuro.result()['id']] = futuro.result()['versao']
+        if len(versoes) < necessarias: return None
+        return max(versoes, key=lambda id_no: (sum(versoes[id_no].values()), id_no == self.id_no))
+
+    def escrita_do_lider(self, msg):
+        """No modo de escrita 'lider', diz se `msg` é uma escrita que este nó, por não ser o coordenador, não aplica."""
+        if self.modo_escrita != 'lider' or self.id_coordenador == self.id_no: return False
+        return msg['type'] == 'CLIENT_BATCH' or classificar(msg['sql']).escrita
+
+    def repassar_ao_lider(self, msg):
+        """
+        Repassa a escrita ao coordenador, que a executa e a replica na sua sequência: todas as
+        réplicas aplicam as escritas na mesma ordem. O repasse usa as conexões persistentes do
+        encaminhador, então escritas concorrentes seguem em pipeline. Uma escrita já repassada
+        que chega a um nó que deixou de ser o coordenador é recusada, em vez de repassada de novo.
+        """
+        coordenador = self.id_coordenador
+        if coordenador is None or msg.get('repassada'):
+            return {"status": "error", "node": self.id_no, "coordinator_id": coordenador,
+                    "message": f"Nó {self.id_no} não é o coordenador; escrita não aplicada"}
+        with self.lock: self.escritas_repassadas += 1
+        return self.encaminhar([coordenador], dict(msg, repassada=True), True)
+
+    def encaminhar(self, donos, msg, eh_escrita):
+        """
+        Repassa uma query aos nós `donos` (os que guardam a linha, a réplica mais nova ou o coordenador), em ordem,
+        e retorna a resposta do primeiro que atender. Uma escrita só vai ao próximo se nem chegou ao anterior.
+        """
+        with self.lock:
+            if self.encaminhador is None:
+                self.encaminhador = ClienteBD(self.outros_nos, tentativas=1, timeout=max(self.timeouts_espera.values()) + 5.0)
+        msg = {chave: valor for chave, valor in msg.items() if valor is not None}
+        erro = None
+        for id_dono in donos:
+            no = next(n for n in self.outros_nos if n['id'] == id_dono)
+            try:
+                return dict(self.encaminhador.requisitar(no, msg), encaminhada_por=self.id_no)
+            except ErroCliente as e:
+                erro = e
+                if eh_escrita and not isinstance(e, ErroConexao): break
+        return {"status": "error", "node": self.id_no, "donos": donos, "message": f"Nós {donos} inacessíveis: {erro}"}
+
+    def consultar_particoes(self, plano, params=None, posicao=None):
+        """
+        Executa uma leitura de tabela particionada em todos os nós (scatter-gather) e gera os
+        frames do resultado combinado. Cada nó vivo responde pelas faixas do anel em que é o
+        primeiro dono vivo, e roda a consulta restrita a elas, já com o ORDER BY, o LIMIT e os
+        agregados parciais. As partes chegam em paralelo e são lidas aos poucos: as linhas são
+        intercaladas (k-way merge) na ordem pedida e o resultado termina quando o LIMIT é atingido.
+        """
+        with self.lock:
+            vivos = list(self.nos_vivos)
+            self.particionamento['distribuidas'] += 1
+        faixas = self.anel.faixas(vivos)
+        chave_primaria = self.chaves_primarias.get(plano.tabela, 'id')
+        conexoes, partes = [], []
+        try:
+            for no in self.info_nos:
+                filtro = filtro_responsavel(plano.tabela, chave_primaria, faixas, no['id'])
+                if filtro is None: continue
+                if no['id'] == self.id_no:
+                    # A parte deste nó roda aqui mesmo, sem ocupar mais uma conexão (e uma thread de atendimento) consigo
+                    partes.append((no, self.executar_query_em_partes(sql_local(plano, filtro), params=params, local=True,
+                                                                     posicao=posicao)))
+                    continue
+                msg = {'type': 'CLIENT_QUERY', 'sql': sql_local(plano, filtro), 'local': True}
+                if params is not None: msg['params'] = params
+                if posicao: msg['posicao'] = posicao
+                try:
+                    sock = socket.create_connection((no['ip'], no['port']), timeout=2.0)
+                    sock.settimeout(30.0)
+                    conexoes.append(sock)
+                    enviar_frame(sock, msg)
+                    partes.append((no, iterar_resposta(LeitorFrames(sock))))
+                except OSError as e:
+                    yield {"status": "error", "node": self.id_no, "message": f"Nó {no['id']} inacessível: {e}"}
+                    return
+            decimais = set()
+            fontes = [self.linhas_da_parte(no, frames, decimais) for no, frames in partes]
+            cabecalho = {"status": "success", "node": self.id_no, "stream": True, "nos": [no['id'] for no, _ in partes]}
+            # Faixa sem nenhum dono vivo: as linhas dela ficam de fora
+            if None in faixas[1]: cabecalho['parcial'] = True
+            if plano.agregados is not None:
+                try:
+                    linhas = [combinar_agregados(plano, [linha for fonte in fontes for linha in fonte], decimais)]
+                except ErroParticao as e:
+                    yield {"status": "error", "node": self.id_no, "message": str(e)}
+                    return
+                yield cabecalho
+                yield {"rows": linhas}
+                yield {"fim": True, "total": 1}
+                return
+            linhas = juntar_ordenado(fontes, plano.ordem, decimais) if plano.ordem else itertools.chain.from_iterable(fontes)
+            if plano.limite is not None:
+                linhas = itertools.islice(linhas, plano.deslocamento, plano.deslocamento + plano.limite)
+            yield cabecalho
+            total = 0
+            try:
+                while True:
+                    parte = list(itertools.islice(linhas, self.linhas_por_parte))
+                    if not parte: break
+                    total += len(parte)
+                    yield {"rows": parte}
+            except ErroParticao as e:
+                yield {"status": "error", "node": self.id_no, "message": str(e), "fim": True}
+                return
+            yield {"fim": True, "total": total}
+            # O que sobrou das partes é no máximo o LIMIT de cada nó. Lido até o fim (já depois da
+            # resposta), não deixa no nó um resultado pela metade, que o faria descartar a conexão com o banco
+            try:
+                for fonte in fontes:
+                    for _ in fonte: pass
+            except ErroParticao:
+                pass
         finally:
-            if conn: conn.close()
+            # Fechar a parte deste nó devolve ao pool a conexão que ela ainda estiver usando
+            for _, frames in partes: frames.close()
+            for sock in conexoes: sock.close()
+
+    def linhas_da_parte(self, no, frames, decimais):
+        """
+        Gera as linhas da parte de uma consulta distribuída, conforme chegam do nó. As colunas
+        DECIMAL informadas no cabeçalho da parte entram em `decimais` antes da primeira linha.
+        As linhas da parte deste nó saem como as dos outros, com os valores como no protocolo.
+        """
+        proprio = no['id'] == self.id_no
+        try:
+            for frame in frames:
+                if frame.get('status') == 'error':
+                    raise ErroParticao(f"Erro no Nó {no['id']}: {frame.get('message')}")
+                decimais.update(frame.get('decimais', ()))
+                yield from map(como_no_protocolo, frame.get('rows', ())) if proprio else frame.get('rows', ())
+        except (OSError, ErroProtocolo) as e:
+            raise ErroParticao(f"Nó {no['id']} não completou a sua parte: {e}")
+
+    def donos_dos_comandos(self, entrada):
+        """
+        Donos da linha de cada comando de um lote (cada conjunto de `lista_params` conta como um
+        comando), ou None se nenhum altera uma linha identificada de tabela particionada (ver
+        `donos_da_linha`). Os comandos sem dono valem para todos os nós.
+        """
+        if self.anel is None: return None
+        tabelas = self.tabelas_alteradas(self.sqls_da_entrada(entrada))
+        if tabelas is not None and not tabelas & self.tabelas_particionadas: return None
+        donos = [self.donos_da_linha(chave_de_escrita(sql, self.chaves_primarias, params))
+                 for sql, params in self.comandos_da_entrada(entrada)]
+        return None if all(d is None for d in donos) else donos
+
+    def comandos_guardados(self, entrada):
+        """Os comandos (ou conjuntos de `lista_params`) de um lote cujas linhas este nó guarda."""
+        comandos = entrada['comandos'] if 'comandos' in entrada else entrada['lista_params']
+        if 'donos_por_comando' not in entrada: return comandos
+        return [comando for comando, donos in zip(comandos, entrada['donos_por_comando'])
+                if donos is None or self.id_no in donos]
+
+    def comandos_da_entrada(self, entrada):
+        """Os comandos de uma entrada como (sql, params); cada conjunto de `lista_params` conta como um comando."""
+        if 'comandos' in entrada: return [(comando['sql'], comando.get('params')) for comando in entrada['comandos']]
+        if 'lista_params' in entrada: return [(entrada['sql'], params) for params in entrada['lista_params']]
+        return [(entrada['sql'], entrada.get('params'))]
+
+    def sqls_da_entrada(self, entrada):
+        if 'comandos' in entrada: return [comando['sql'] for comando in entrada['comandos']]
+        return [entrada['sql']]
+
+    def chave_da_entrada(self, entrada):
+        """Chave de ordenação de uma entrada (ver `chave_de_escrita`); lotes valem para a tabela ou para tudo."""
+        if 'comandos' in entrada:
+            chaves = {chave_de_escrita(c['sql'], self.chaves_primarias, c.get('params')) for c in entrada['comandos']}
+        elif 'lista_params' in entrada:
+            # Muitos conjuntos de parâmetros: não vale analisar um a um, a escrita vale para a tabela
+            chave = chave_de_escrita(entrada['sql'], self.chaves_primarias)
+            chaves = {None if chave is None else (chave[0], None)}
+        else:
+            return chave_de_escrita(entrada['sql'], self.chaves_primarias, entrada.get('params'))
+        if len(chaves) == 1: return chaves.pop()
+        if None in chaves or len({tabela for tabela, _ in chaves}) > 1: return None
+        return (next(iter(chaves))[0], None)
 
     def executar_query_replicada(self, msg):
-        if self.calcular_checksum(msg['sql']) != msg['checksum']: 
-            print(f"[Nó {self.id_no}] Checksum inválido na replicação")
+        """
+        Recebe uma escrita (REPLICATE) ou um lote de escritas (REPLICATE_BATCH) de outro nó e as
+        entrega ao aplicador paralelo. Seqs já recebidas são ignoradas; se houver lacuna, busca antes
+        as entradas que faltam no log da origem. Só espera a aplicação quando o remetente pediu ACK.
+        """
+        origem = msg['origin']
+        entradas = msg['entradas'] if 'entradas' in msg else [msg]
+        with self.locks_origem[origem]:
+            recebida = self.aplicador.recebida(origem)
+            entradas = [e for e in entradas if e['seq'] > recebida]
+            if not entradas:
+                return True
+            if entradas[0]['seq'] > recebida + 1:
+                if not self.sincronizar_com(origem, ate=entradas[0]['seq'] - 1): return False
+                # O catch-up pode já ter trazido estas próprias seqs do log da origem
+                recebida = self.aplicador.recebida(origem)
+                entradas = [e for e in entradas if e['seq'] > recebida]
+                if not entradas: return True
+            futuros = self.despachar_entradas(origem, entradas)
+        if futuros is None: return False
+        # Sem pedido de ACK não há o que esperar: o enlace já pode entregar a próxima mensagem
+        if msg.get('id_req') is None: return True
+        return all(f.result() for f in futuros)
+
+    def despachar_entradas(self, origem, entradas):
+        """Entrega as entradas ao aplicador, cada uma com a chave da linha que altera; None se o checksum não confere."""
+        for entrada in entradas:
+            if self.checksum_entrada(entrada) != entrada['checksum']:
+                print(f"[Nó {self.id_no}] Checksum inválido na replicação (Nó {origem}, seq {entrada['seq']})")
+                return None
+        return [self.aplicador.despachar(origem, entrada, self.chave_da_entrada(entrada)) for entrada in entradas]
+
+    def aplicar_itens(self, itens):
+        """
+        Grava em uma transação um lote de um worker do aplicador, marcando cada seq em
+        `replicacao_aplicada`. Falhas de conexão são repetidas até dar certo; um comando com
+        erro (como antes) é registrado como aplicado para não travar os seguintes.
+        """
+        while self.em_execucao:
+            try:
+                erro_lote = None
+                with self.pool_replicacao.conexao() as conn:
+                    print(f"[Nó {self.id_no}] Aplicando replicação: {len(itens)} escritas "
+                          f"(Nó {itens[0]['origem']} seq {itens[0]['entrada']['seq']}..)")
+                    try:
+                        conn.start_transaction()
+                        cursor = conn.cursor()
+                        for item in itens:
+                            self.aplicar_entrada(conn, cursor, item['entrada'])
+                        cursor.executemany(SQL_MARCAR_APLICADA, [(item['origem'], item['entrada']['seq']) for item in itens])
+                        conn.commit()
+                    except Error as e:
+                        conn.rollback()
+                        if not isinstance(e, ERROS_DE_COMANDO): raise
+                        erro_lote = e
+                if erro_lote is None:
+                    if self.cache:
+                        self.cache.invalidar(self.tabelas_alteradas([sql for item in itens for sql in self.sqls_da_entrada(item['entrada'])]))
+                    return [True] * len(itens)
+                if len(itens) > 1:
+                    # Um comando do lote falhou: reaplica um a um para não perder os demais
+                    print(f"[Nó {self.id_no}] Erro no lote de replicação, aplicando individualmente: {erro_lote}")
+                    return [self.aplicar_itens([item])[0] for item in itens]
+                print(f"[Nó {self.id_no}] Erro na replicação (Nó {itens[0]['origem']}, seq {itens[0]['entrada']['seq']}): {erro_lote}")
+                with self.pool_replicacao.conexao() as conn:
+                    conn.cursor().execute(SQL_MARCAR_APLICADA, (itens[0]['origem'], itens[0]['entrada']['seq']))
+                return [False]
+            except Error as e:
+                print(f"[Nó {self.id_no}] Erro na replicação, nova tentativa em 1s: {e}")
+                time.sleep(1)
+        return [False] * len(itens)
+
+    def aplicar_entrada(self, conn, cursor, entrada):
+        """Executa, na transação aberta em `conn`, os comandos de uma entrada replicada."""
+        # Linha de tabela particionada que este nó não guarda: a entrada só avança a posição da origem
+        if 'donos' in entrada and self.id_no not in entrada['donos']:
+            with self.lock: self.particionamento['ignoradas'] += 1
+            return
+        if 'comandos' in entrada or 'lista_params' in entrada:
+            guardados = self.comandos_guardados(entrada)
+            if not guardados:
+                with self.lock: self.particionamento['ignoradas'] += 1
+            elif 'comandos' in entrada:
+                for comando in guardados:
+                    self.executar_comando(conn, cursor, comando['sql'], comando.get('params'))
+            else:
+                cursor.executemany(entrada['sql'], guardados)
+        else:
+            self.executar_comando(conn, cursor, entrada['sql'], entrada.get('params'))
+
+    def tabelas_alteradas(self, sqls):
+        """Tabelas alteradas pelos comandos `sqls`; None se algum pode ter alterado qualquer tabela."""
+        tabelas = set()
+        for sql in sqls:
+            classificacao = classificar(sql)
+            if not classificacao.tabelas: return None
+            tabelas |= classificacao.tabelas
+        return tabelas
+
+    def recuperar_log(self, confirmada):
+        """
+        Confere o log com a última seq própria confirmada no banco, gravada na transação de cada
+        escrita. Entradas além dela foram gravadas no log, mas o nó caiu antes do commit e elas
+        nunca foram enviadas: saem do log. Se o banco está à frente, o final do log se perdeu
+        (queda do sistema antes do fsync): o log recomeça depois da seq confirmada, e um par que
+        não tenha recebido essas escritas recebe um snapshot no catch-up.
+        """
+        if confirmada is None: return
+        ultimo = self.log_replicacao.ultimo_seq
+        if ultimo > confirmada:
+            print(f"[Nó {self.id_no}] Descartando do log as seqs {confirmada + 1}..{ultimo}, que não chegaram ao commit")
+            self.log_replicacao.truncar(confirmada)
+        elif ultimo < confirmada:
+            print(f"[Nó {self.id_no}] Log sem as seqs {ultimo + 1}..{confirmada} confirmadas no banco; recomeçando após a {confirmada}")
+            self.log_replicacao.recomecar(confirmada)
+
+    def carregar_posicoes(self):
+        """
+        Cria as tabelas de posição, se preciso, e carrega a posição contígua de cada origem
+        e as seqs aplicadas acima dela. Retorna (posições, {origem: seqs}).
+        """
+        try:
+            with self.pool_replicacao.conexao() as conn:
+                cursor = conn.cursor()
+                cursor.execute(SQL_CRIAR_POSICOES)
+                cursor.execute(SQL_CRIAR_APLICADAS)
+                cursor.execute("SELECT origem, seq FROM replicacao_posicao")
+                posicoes = {int(origem): int(seq) for origem, seq in cursor.fetchall()}
+                cursor.execute("SELECT origem, seq FROM replicacao_aplicada")
+                concluidas = {}
+                for origem, seq in cursor.fetchall():
+                    concluidas.setdefault(int(origem), set()).add(int(seq))
+                return posicoes, concluidas
+        except Error as e:
+            print(f"[Nó {self.id_no}] Erro ao carregar posições de replicação: {e}")
+            return {}, {}
+
+    def gravar_posicoes(self):
+        while self.em_execucao:
+            time.sleep(1)
+            self.salvar_posicoes()
+
+    def salvar_posicoes(self):
+        """Grava a posição contígua de cada origem que avançou e apaga as seqs marcadas até ela."""
+        with self.lock_posicoes:
+            with self.aplicador.cond:
+                novas = {origem: seq for origem, seq in self.posicoes_aplicadas.items()
+                         if seq > self.posicoes_gravadas.get(origem, 0)}
+            if not novas: return
+            try:
+                with self.pool_replicacao.conexao() as conn:
+                    try:
+                        conn.start_transaction()
+                        cursor = conn.cursor()
+                        for origem, seq in novas.items():
+                            cursor.execute(SQL_SALVAR_POSICAO, (origem, seq))
+                            cursor.execute("DELETE FROM replicacao_aplicada WHERE origem = %s AND seq <= %s", (origem, seq))
+                        conn.commit()
+                    except Error:
+                        conn.rollback()
+                        raise
+                self.posicoes_gravadas.update(novas)
+            except Error as e:
+                print(f"[Nó {self.id_no}] Erro ao salvar posição de replicação: {e}")
+
+    def verificar_atraso(self, origem, seq_anunciada):
+        """
+        Dispara o catch-up de `origem` se uma seq anunciada no heartbeat anterior ainda não foi
+        aplicada (esperar um heartbeat evita buscar escritas que ainda estão a caminho).
+        """
+        anterior = self.seq_anunciada.get(origem, 0)
+        self.seq_anunciada[origem] = seq_anunciada
+        if self.aplicador.recebida(origem) >= min(anterior, seq_anunciada):
             return
-            
-        conn = self.criar_conexao()
-        if not conn: return
+        self.sincronizar_em_segundo_plano(origem)
+
+    def sincronizar_em_segundo_plano(self, origem):
+        with self.lock:
+            if origem in self.sincronizando: return
+            self.sincronizando.add(origem)
+
+        def sincronizar():
+            try: self.sincronizar_com(origem)
+            finally:
+                with self.lock: self.sincronizando.discard(origem)
+        threading.Thread(target=sincronizar, daemon=True).start()
+
+    def sincronizar_com(self, origem, ate=None):
+        """
+        Busca no log do nó `origem` as escritas ainda não aplicadas e as aplica em lotes. Se o log
+        já não tem as entradas (ou o atraso passa de `limite_snapshot`), transfere antes um snapshot.
+        """
+        no_origem = next(n for n in self.info_nos if n['id'] == origem)
+        snapshot_feito = False
+        with self.locks_origem[origem]:
+            while self.em_execucao:
+                desde = self.aplicador.recebida(origem)
+                if ate is not None and desde >= ate: return True
+                try:
+                    resposta = self.requisitar_msg(no_origem, {'type': 'CATCHUP_REQ', 'id': self.id_no, 'desde': desde,
+                                                               'limite': self.lote_catchup}, timeout=10.0).result()
+                except Exception as e:
+                    print(f"[Nó {self.id_no}] Falha no catch-up com Nó {origem}: {e}")
+                    return False
+                atraso = resposta['ultimo'] - desde
+                if (resposta.get('truncado') or atraso > self.limite_snapshot) and not snapshot_feito:
+                    motivo = "não tem mais as entradas" if resposta.get('truncado') else f"está {atraso} entradas à frente"
+                    print(f"[Nó {self.id_no}] Log do Nó {origem} {motivo} após a seq {desde}; transferindo snapshot")
+                    if not self.transferir_snapshot(no_origem): return False
+                    snapshot_feito = True
+                    continue
+                if resposta.get('truncado'):
+                    print(f"[Nó {self.id_no}] Log do Nó {origem} não tem mais as entradas após a seq {desde}")
+                    return False
+                if not resposta['entradas']: return ate is None
+                print(f"[Nó {self.id_no}] Catch-up com Nó {origem}: {len(resposta['entradas'])} entradas após a seq {desde}")
+                if self.despachar_entradas(origem, resposta['entradas']) is None: return False
+            return False
+
+    def transferir_snapshot(self, no_doador):
+        """
+        Substitui as tabelas replicadas por um snapshot consistente de `no_doador`, recebido em
+        partes, e adota as posições de replicação do snapshot; o catch-up aplica depois só o delta.
+        """
+        travados = []
         try:
-            print(f"[Nó {self.id_no}] Aplicando replicação do Nó {msg['origin']}")
+            # Nenhuma replicação é aplicada enquanto as tabelas são substituídas
+            for origem in sorted(self.locks_origem):
+                if not self.locks_origem[origem].acquire(timeout=30):
+                    print(f"[Nó {self.id_no}] Snapshot adiado: replicação do Nó {origem} ocupada")
+                    return False
+                travados.append(self.locks_origem[origem])
+            if not self.aplicador.aguardar_ociosidade(timeout=30):
+                print(f"[Nó {self.id_no}] Snapshot adiado: aplicador ainda ocupado")
+                return False
+            print(f"[Nó {self.id_no}] Transferindo snapshot do Nó {no_doador['id']}...")
+            inicio = time.monotonic()
+            with self.lock_posicoes, socket.create_connection((no_doador['ip'], no_doador['port']), timeout=30) as s:
+                enviar_frame(s, {'type': 'SNAPSHOT', 'id': self.id_no, 'tabelas': self.tabelas_replicadas})
+                with self.pool_replicacao.conexao() as conn:
+                    posicoes, linhas = self.carregar_snapshot(conn, iterar_resposta(LeitorFrames(s)))
+                posicoes = {origem: posicoes.get(origem, 0) for origem in self.locks_origem}
+                self.aplicador.redefinir(posicoes)
+                self.posicoes_gravadas = dict(posicoes)
+                if self.cache: self.cache.invalidar()
+            decorrido = time.monotonic() - inicio
+            self.ultimo_snapshot = {'doador': no_doador['id'], 'linhas': linhas, 'segundos': round(decorrido, 3),
+                                    'linhas_por_segundo': round(linhas / decorrido, 1) if decorrido > 0 else 0.0}
+            print(f"[Nó {self.id_no}] Snapshot do Nó {no_doador['id']} carregado: {linhas} linhas em {decorrido:.2f}s "
+                  f"({self.ultimo_snapshot['linhas_por_segundo']:.0f} linhas/s)")
+        except (OSError, ErroProtocolo, Error) as e:
+            print(f"[Nó {self.id_no}] Falha no snapshot do Nó {no_doador['id']}: {e}")
+            return False
+        finally:
+            for lock in travados: lock.release()
+        # As demais origens seguem do ponto do snapshot pelo catch-up normal
+        for origem in self.locks_origem:
+            if origem != no_doador['id']: self.sincronizar_em_segundo_plano(origem)
+        return True
+
+    def carregar_snapshot(self, conn, frames):
+        """
+        Carrega os frames de um snapshot em uma única transação (tabelas e posições mudam juntas,
+        então uma queda no meio não deixa o nó meio carregado). As escritas deste nó que o doador
+        ainda não tinha aplicado são refeitas a partir do próprio log (ver `refazer_proprias`).
+        Retorna (posições, linhas).
+        """
+        frames = iter(frames)
+        cabecalho = next(frames)
+        if cabecalho.get('status') != 'success':
+            raise Error(msg=f"Snapshot recusado: {cabecalho.get('message')}")
+        posicoes = {int(origem): seq for origem, seq in cabecalho['posicoes'].items()}
+        proprias = posicoes.pop(self.id_no, 0)
+        if not self.log_replicacao.disponivel_desde(proprias):
+            raise Error(msg=f"Snapshot recusado: o doador só tem as escritas deste nó até a seq {proprias} "
+                            f"e o log já não tem as seguintes")
+        linhas, sql_insercao = 0, None
+        try:
+            conn.start_transaction()
             cursor = conn.cursor()
-            cursor.execute(msg['sql'])
-            conn.commit()
+            for frame in frames:
+                if frame.get('status') == 'error':
+                    raise Error(msg=f"Snapshot interrompido: {frame.get('message')}")
+                if 'tabela' in frame:
+                    if frame['tabela'] not in self.tabelas_replicadas:
+                        raise Error(msg=f"Tabela não replicada no snapshot: {frame['tabela']}")
+                    colunas = frame['colunas']
+                    cursor.execute(f"DELETE FROM `{frame['tabela']}`")
+                    sql_insercao = (f"INSERT INTO `{frame['tabela']}` ({', '.join(f'`{c}`' for c in colunas)}) "
+                                    f"VALUES ({', '.join(['%s'] * len(colunas))})")
+                elif frame.get('rows'):
+                    cursor.executemany(sql_insercao, [tuple(linha) for linha in frame['rows']])
+                    linhas += len(frame['rows'])
+            cursor.execute("DELETE FROM replicacao_posicao WHERE origem <> %s", (self.id_no,))
+            cursor.execute("DELETE FROM replicacao_aplicada WHERE origem <> %s", (self.id_no,))
+            for origem, seq in posicoes.items():
+                cursor.execute(SQL_SALVAR_POSICAO, (origem, seq))
+            # Sob lock_log nenhuma escrita local chega ao commit: as refeitas vão até a última do log
+            with self.lock_log:
+                self.refazer_proprias(conn, cursor, proprias)
+                conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return posicoes, linhas
+
+    def refazer_proprias(self, conn, cursor, desde):
+        """
+        Aplica de novo, na transação do snapshot, as entradas do próprio log após a seq `desde`:
+        as escritas deste nó que o doador ainda não tinha quando gerou o snapshot. Um comando
+        com erro fica de fora, como na replicação (ver `aplicar_itens`).
+        """
+        refeitas = 0
+        while desde < self.log_replicacao.ultimo_seq:
+            entradas = self.log_replicacao.ler(desde, self.lote_catchup)
+            if not entradas: break
+            for entrada in entradas:
+                cursor.execute("SAVEPOINT refazer")
+                try:
+                    self.aplicar_entrada(conn, cursor, entrada)
+                    refeitas += 1
+                except ERROS_DE_COMANDO as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT refazer")
+                    print(f"[Nó {self.id_no}] Erro ao refazer a própria seq {entrada['seq']} após o snapshot: {e}")
+            desde = entradas[-1]['seq']
+        if refeitas: print(f"[Nó {self.id_no}] {refeitas} escritas próprias refeitas sobre o snapshot")
+        return refeitas
+
+    def gerar_snapshot(self, msg):
+        """
+        Gera os frames de um snapshot consistente das tabelas replicadas: o cabeçalho traz a
+        posição de replicação de cada origem e cada tabela vem em partes de `lote_snapshot` linhas.
+        """
+        tabelas = [t for t in msg.get('tabelas', self.tabelas_replicadas) if t in self.tabelas_replicadas]
+        print(f"[Nó {self.id_no}] Enviando snapshot de {', '.join(tabelas)} para Nó {msg.get('id')}")
+        total = 0
+        try:
+            with self.pool_clientes.conexao() as conn:
+                # Commit e seq das escritas locais andam juntos sob lock_log: o snapshot aberto
+                # aqui contém exatamente as escritas até `ultimo_seq`
+                with self.lock_log:
+                    conn.start_transaction(consistent_snapshot=True, isolation_level='REPEATABLE READ', readonly=True)
+                    seq_proprio = self.log_replicacao.ultimo_seq
+                cursor = conn.cursor()
+                # As posições das outras origens são gravadas com as escritas, então vêm do mesmo snapshot
+                cursor.execute("SELECT origem, seq FROM replicacao_posicao")
+                posicoes = {str(origem): int(seq) for origem, seq in cursor.fetchall()}
+                posicoes[str(self.id_no)] = seq_proprio
+                yield {"status": "success", "node": self.id_no, "stream": True, "posicoes": posicoes}
+                for tabela in tabelas:
+                    cursor.execute(f"SELECT * FROM `{tabela}`")
+                    yield {"tabela": tabela, "colunas": list(cursor.column_names)}
+                    while True:
+                        linhas = cursor.fetchmany(self.lote_snapshot)
+                        if not linhas: break
+                        total += len(linhas)
+                        yield {"rows": [list(linha) for linha in linhas]}
+                conn.commit()
         except Error as e:
-            print(f"[Nó {self.id_no}] Erro na replicação: {e}")
+            print(f"[Nó {self.id_no}] Erro ao gerar snapshot: {e}")
+            yield {"status": "error", "node": self.id_no, "message": str(e), "fim": True}
+            return
+        yield {"fim": True, "total": total}
+
+    def atender_catchup(self, msg):
+        desde = msg['desde']
+        if not self.log_replicacao.disponivel_desde(desde):
+            return {'type': 'CATCHUP_RESP', 'entradas': [], 'truncado': True, 'ultimo': self.log_replicacao.ultimo_seq}
+        entradas = self.log_replicacao.ler(desde, min(msg.get('limite', self.lote_catchup), self.lote_catchup),
+                                           self.bytes_catchup)
+        return {'type': 'CATCHUP_RESP', 'entradas': entradas, 'truncado': False, 'ultimo': self.log_replicacao.ultimo_seq}
+
+    def construir_arvore(self, tabela, profundidade):
+        """
+        Monta a árvore de Merkle de `tabela` a partir de uma leitura consistente, em páginas de
+        `lote_anti_entropia` linhas pela chave primária. O hash de cada linha é calculado no banco,
+        então só a chave, a folha e o hash trafegam; as páginas são espaçadas para não passar de
+        `linhas_por_segundo_anti_entropia`. Retorna (árvore, versão dos dados lidos).
+        """
+        chave = self.chaves_primarias.get(tabela, 'id')
+        arvore = ArvoreMerkle(profundidade)
+        with self.pool_clientes.conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT * FROM `{tabela}` LIMIT 0")
+            colunas = list(cursor.column_names)
+            cursor.fetchall()
+            sql = f"SELECT `{chave}`, {folha_sql(tabela, chave, profundidade)}, {hash_linha_sql(colunas)} FROM `{tabela}`"
+            # Como no snapshot: a versão corresponde às escritas próprias contidas na leitura
+            with self.lock_log:
+                conn.start_transaction(consistent_snapshot=True, isolation_level='REPEATABLE READ', readonly=True)
+                versao = self.versao()
+            try:
+                inicio, lidas, ultima = time.monotonic(), 0, None
+                while self.em_execucao:
+                    if ultima is None:
+                        cursor.execute(f"{sql} ORDER BY `{chave}` LIMIT {self.lote_anti_entropia}")
+                    else:
+                        cursor.execute(f"{sql} WHERE `{chave}` > %s ORDER BY `{chave}` LIMIT {self.lote_anti_entropia}", (ultima,))
+                    pagina = cursor.fetchall()
+                    for _, folha, hash_linha in pagina:
+                        arvore.adicionar(int(folha), int(hash_linha))
+                    lidas += len(pagina)
+                    if len(pagina) < self.lote_anti_entropia: break
+                    ultima = pagina[-1][0]
+                    time.sleep(max(0.0, inicio + lidas / self.linhas_por_segundo_anti_entropia - time.monotonic()))
+            finally:
+                conn.commit()
+        return arvore, versao
+
+    def atender_merkle(self, msg):
+        """
+        Responde com os hashes dos nós `indices` do `nivel` da árvore de `tabela`. O nível 0 (a raiz)
+        abre uma comparação e monta a árvore, guardada para as consultas seguintes do mesmo nó.
+        """
+        tabela, nivel = msg.get('tabela'), msg.get('nivel', 0)
+        if tabela not in self.tabelas_replicadas:
+            return {'status': 'error', 'message': f"Tabela não replicada: {tabela}"}
+        try:
+            if nivel == 0:
+                arvore, versao = self.construir_arvore(tabela, msg['profundidade'])
+                with self.lock:
+                    self.descartar_arvores_vencidas()
+                    self.arvores_pedidas[(msg['id'], tabela)] = (arvore, versao, time.monotonic())
+            with self.lock: arvore, versao, _ = self.arvores_pedidas[(msg['id'], tabela)]
+            return {'status': 'success', 'node': self.id_no, 'versao': versao, 'linhas': arvore.linhas,
+                    'hashes': arvore.hashes(nivel, msg['indices'])}
+        except KeyError:
+            return {'status': 'error', 'message': "Comparação não iniciada (peça antes o nível 0)"}
+        except (Error, ValueError, IndexError) as e:
+            return {'status': 'error', 'message': str(e)}
+
+    def gerar_linhas_merkle(self, msg):
+        """Gera, em partes, as linhas de `tabela` nas `folhas` pedidas, com a versão dos dados lidos."""
+        tabela = msg.get('tabela')
+        with self.lock: self.arvores_pedidas.pop((msg.get('id'), tabela), None)
+        if tabela not in self.tabelas_replicadas:
+            yield {'status': 'error', 'message': f"Tabela não replicada: {tabela}"}
+            return
+        chave = self.chaves_primarias.get(tabela, 'id')
+        total = 0
+        try:
+            with self.pool_clientes.conexao() as conn:
+                with self.lock_log:
+                    conn.start_transaction(consistent_snapshot=True, isolation_level='REPEATABLE READ', readonly=True)
+                    versao = self.versao()
+                cursor = conn.cursor()
+                cursor.execute(f"SELECT * FROM `{tabela}` WHERE {folha_sql(tabela, chave, msg['profundidade'])} "
+                               f"IN ({', '.join(str(int(f)) for f in msg['folhas'])})")
+                yield {'status': 'success', 'node': self.id_no, 'stream': True, 'versao': versao,
+                       'colunas': list(cursor.column_names)}
+                while True:
+                    linhas = cursor.fetchmany(self.lote_anti_entropia)
+                    if not linhas: break
+                    total += len(linhas)
+                    yield {'rows': [list(linha) for linha in linhas]}
+                conn.commit()
+        except Error as e:
+            print(f"[Nó {self.id_no}] Erro ao ler faixas para a anti-entropia: {e}")
+            yield {'status': 'error', 'node': self.id_no, 'message': str(e), 'fim': True}
+            return
+        yield {'fim': True, 'total': total}
+
+    def descartar_arvores_vencidas(self):
+        """Descarta (sob self.lock) as árvores de comparações que o par abandonou, por queda ou erro."""
+        limite = time.monotonic() - self.validade_arvore
+        for chave in [chave for chave, (_, _, criada) in self.arvores_pedidas.items() if criada < limite]:
+            del self.arvores_pedidas[chave]
+
+    def executar_anti_entropia(self):
+        while self.em_execucao:
+            time.sleep(self.intervalo_anti_entropia)
+            with self.lock: self.descartar_arvores_vencidas()
+            # O coordenador é a referência: as demais réplicas convergem para as suas tabelas
+            coordenador = self.id_coordenador
+            if coordenador is None or coordenador == self.id_no: continue
+            no_coordenador = next(n for n in self.outros_nos if n['id'] == coordenador)
+            for tabela in self.tabelas_replicadas:
+                if not self.em_execucao: return
+                self.comparar_com(no_coordenador, tabela)
+
+    def comparar_com(self, no_referencia, tabela):
+        """
+        Uma rodada de anti-entropia de `tabela` com `no_referencia`, por uma conexão própria. As
+        árvores são comparadas a partir da raiz, e as linhas das folhas diferentes (até
+        `max_faixas_anti_entropia`) são trocadas pelas da referência. Cada árvore é lida numa
+        posição fixa do log (a versão dos dados lidos); as folhas alteradas pelas escritas entre
+        as duas posições podem diferir só por replicação a caminho e ficam para outra rodada
+        (ver `folhas_em_transito`). Retorna o resumo da rodada, ou None se falhou.
+        """
+        profundidade = self.profundidade_merkle
+        resumo = {'tabela': tabela, 'referencia': no_referencia['id'], 'faixas': 0, 'linhas': 0}
+        try:
+            with socket.create_connection((no_referencia['ip'], no_referencia['port']), timeout=60) as s:
+                leitor = LeitorFrames(s)
+                inicio = time.monotonic()
+                versao_referencia = {}
+
+                def limitar_banda():
+                    time.sleep(max(0.0, inicio + leitor.bytes_lidos / self.bytes_por_segundo_anti_entropia - time.monotonic()))
+
+                def consultar(nivel, indices):
+                    enviar_frame(s, {'type': 'MERKLE', 'id': self.id_no, 'tabela': tabela, 'profundidade': profundidade,
+                                     'nivel': nivel, 'indices': indices})
+                    resposta = receber_resposta(leitor)
+                    if resposta.get('status') != 'success':
+                        raise Error(msg=f"Árvore recusada: {resposta.get('message')}")
+                    versao_referencia.update(resposta['versao'])
+                    self.anti_entropia['hashes_recebidos'] += len(resposta['hashes'])
+                    limitar_banda()
+                    return resposta['hashes']
+
+                arvore, versao = self.construir_arvore(tabela, profundidade)
+                self.anti_entropia['rodadas'] += 1
+                folhas = arvore.folhas_diferentes(consultar, self.max_faixas_anti_entropia)
+                if not folhas:
+                    self.anti_entropia['iguais'] += 1
+                    return resumo
+                em_transito = self.folhas_em_transito(tabela, profundidade, versao, versao_referencia)
+                if em_transito is None:
+                    self.anti_entropia['adiadas'] += 1
+                    resumo['adiada'] = True
+                    return resumo
+                resumo['em_transito'] = len([f for f in folhas if f in em_transito])
+                self.anti_entropia['faixas_em_transito'] += resumo['em_transito']
+                folhas = [f for f in folhas if f not in em_transito]
+                if not folhas: return resumo
+                print(f"[Nó {self.id_no}] Anti-entropia: {len(folhas)} faixas de {tabela} diferem do Nó {no_referencia['id']}")
+                enviar_frame(s, {'type': 'MERKLE_LINHAS', 'id': self.id_no, 'tabela': tabela,
+                                 'profundidade': profundidade, 'folhas': folhas})
+                frames = iterar_resposta(leitor)
+                cabecalho = next(frames)
+                if cabecalho.get('status') != 'success':
+                    raise Error(msg=f"Linhas recusadas: {cabecalho.get('message')}")
+                linhas = []
+                for frame in frames:
+                    if frame.get('status') == 'error':
+                        raise Error(msg=f"Leitura das faixas interrompida: {frame.get('message')}")
+                    linhas.extend(frame.get('rows', ()))
+                    limitar_banda()
+            corrigidas = self.corrigir_faixas(tabela, profundidade, folhas, cabecalho['colunas'], linhas, cabecalho['versao'])
+            if corrigidas is None:
+                self.anti_entropia['adiadas'] += 1
+                resumo['adiada'] = True
+                return resumo
+            folhas, linhas = corrigidas
+            self.anti_entropia['faixas_corrigidas'] += len(folhas)
+            self.anti_entropia['linhas_corrigidas'] += len(linhas)
+            resumo.update(faixas=len(folhas), linhas=len(linhas))
+            print(f"[Nó {self.id_no}] Anti-entropia: {len(folhas)} faixas de {tabela} corrigidas ({len(linhas)} linhas)")
+            return resumo
+        except (OSError, ErroProtocolo, Error) as e:
+            print(f"[Nó {self.id_no}] Falha na anti-entropia de {tabela} com Nó {no_referencia['id']}: {e}")
+            resumo['erro'] = str(e)
+            return None
+        finally:
+            self.anti_entropia['ultima'] = resumo
+
+    def corrigir_faixas(self, tabela, profundidade, folhas, colunas, linhas, versao_referencia):
+        """
+        Substitui, em uma transação, as linhas de `tabela` nas `folhas` pelas que a referência leu na
+        versão `versao_referencia`. A replicação fica parada e as escritas locais esperam (lock_log)
+        até o commit, e as folhas alteradas entre a versão deste nó e a da referência ficam de fora,
+        para não apagar uma escrita que a referência ainda não recebeu nem trazer uma que este nó
+        ainda vai aplicar. Retorna (folhas, linhas) corrigidas, ou None se a correção foi adiada.
+        """
+        chave = self.chaves_primarias.get(tabela, 'id')
+        travados = []
+        try:
+            for origem in sorted(self.locks_origem):
+                if not self.locks_origem[origem].acquire(timeout=30): return None
+                travados.append(self.locks_origem[origem])
+            if not self.aplicador.aguardar_ociosidade(timeout=30): return None
+            # As posições das outras origens já não mudam; as escritas delas são buscadas fora do lock_log
+            outras = self.folhas_em_transito(tabela, profundidade, self.versao(), versao_referencia,
+                                             [origem for origem in self.locks_origem if origem != self.id_no])
+            if outras is None: return None
+            with self.lock_log:
+                proprias = self.folhas_em_transito(tabela, profundidade, self.versao(), versao_referencia, [self.id_no])
+                if proprias is None: return None
+                restantes = [f for f in folhas if f not in outras and f not in proprias]
+                if len(restantes) < len(folhas):
+                    indice = [c.lower() for c in colunas].index(chave.lower())
+                    linhas = [linha for linha in linhas if folha_da_chave(tabela, linha[indice], profundidade) in restantes]
+                    folhas = restantes
+                if not folhas: return folhas, linhas
+                with self.pool_replicacao.conexao() as conn:
+                    try:
+                        conn.start_transaction()
+                        cursor = conn.cursor()
+                        cursor.execute(f"DELETE FROM `{tabela}` WHERE {folha_sql(tabela, chave, profundidade)} "
+                                       f"IN ({', '.join(map(str, folhas))})")
+                        if linhas:
+                            cursor.executemany(f"INSERT INTO `{tabela}` ({', '.join(f'`{c}`' for c in colunas)}) "
+                                               f"VALUES ({', '.join(['%s'] * len(colunas))})", [tuple(linha) for linha in linhas])
+                        conn.commit()
+                    except BaseException:
+                        conn.rollback()
+                        raise
         finally:
-            if conn: conn.close()
+            for lock in travados: lock.release()
+        if self.cache: self.cache.invalidar({tabela.lower()})
+        return folhas, linhas
+
+    def folhas_em_transito(self, tabela, profundidade, versao_a, versao_b, origens=None):
+        """
+        Folhas de `tabela` alteradas pelas escritas que estão numa das versões (ver `versao`) e não
+        na outra, lidas do log de cada origem (de `origens`, ou de todas). Nessas folhas as réplicas
+        podem diferir só porque a replicação ainda não chegou. None se alguma dessas escritas pode
+        ter alterado a tabela sem uma chave conhecida, ou se não foi possível lê-las.
+        """
+        folhas = set()
+        for origem in (origens if origens is not None else [n['id'] for n in self.info_nos]):
+            a, b = versao_a.get(str(origem), 0), versao_b.get(str(origem), 0)
+            if a == b: continue
+            entradas = self.entradas_entre(origem, min(a, b), max(a, b))
+            if entradas is None: return None
+            for entrada in entradas:
+                for sql, params in self.comandos_da_entrada(entrada):
+                    chave = chave_de_escrita(sql, self.chaves_primarias, params)
+                    if chave is None or (chave[0] == tabela.lower() and chave[1] is None): return None
+                    if chave[0] == tabela.lower(): folhas.add(folha_da_chave(tabela, chave[1], profundidade))
+        return folhas
+
+    def entradas_entre(self, origem, desde, ate):
+        """Entradas do log de `origem` com seq em (desde, ate]; None se o log já não as tem ou a origem não respondeu."""
+        entradas = []
+        no_origem = next(n for n in self.info_nos if n['id'] == origem)
+        while desde < ate:
+            if origem == self.id_no:
+                if not self.log_replicacao.disponivel_desde(desde): return None
+                lote = self.log_replicacao.ler(desde, ate - desde, self.bytes_catchup)
+            else:
+                try:
+                    resposta = self.requisitar_msg(no_origem, {'type': 'CATCHUP_REQ', 'id': self.id_no, 'desde': desde,
+                                                               'limite': ate - desde}, timeout=10.0).result()
+                except Exception as e:
+                    print(f"[Nó {self.id_no}] Falha ao ler o log do Nó {origem}: {e}")
+                    return None
+                if resposta.get('truncado'): return None
+                lote = resposta['entradas']
+            lote = [entrada for entrada in lote if entrada['seq'] <= ate]
+            if not lote: return None
+            entradas.extend(lote)
+            desde = lote[-1]['seq']
+        return entradas
+
+    def estatisticas(self):
+        return {
+            'pools': {
+                'clientes': self.pool_clientes.estatisticas(),
+                'replicacao': self.pool_replicacao.estatisticas(),
+            },
+            'replicacao': {
+                'ultimo_seq': self.log_replicacao.ultimo_seq,
+                'aplicados': {str(origem): seq for origem, seq in self.posicoes_aplicadas.items()},
+                'ultimo_snapshot': self.ultimo_snapshot,
+                'lotes': self.agrupador.estatisticas() if self.agrupador else None,
+                'aplicador': self.aplicador.estatisticas(),
+                'cargas': dict(self.cargas),
+                'leituras_com_posicao': dict(self.leituras_com_posicao),
+                'log': self.log_replicacao.estatisticas(),
+                'reenvio': self.remetente.estatisticas(),
+            },
+            'cache': self.cache.estatisticas() if self.cache else None,
+            'analisador_sql': analisador_sql.estatisticas(),
+            'instrucoes_preparadas': self.preparadas.estatisticas(),
+            'particionamento': dict(self.particionamento, **self.anel.estatisticas()) if self.anel else None,
+            'consistencia': self.latencias.estatisticas(),
+            'escritas': {'modo': self.modo_escrita, 'repassadas_ao_lider': self.escritas_repassadas},
+            'anti_entropia': dict(self.anti_entropia) if self.anti_entropia_ativa else None,
+            'deteccao_falhas': dict(self.detector.estatisticas(), declarados_offline=self.nos_declarados_offline),
+        }
 
     def parar(self):
         self.em_execucao = False
+        # Envia o último lote pendente antes de fechar os enlaces
+        if self.agrupador: self.agrupador.fechar()
+        self.remetente.fechar()
+        for enlace in itertools.chain(self.enlaces.values(), self.enlaces_heartbeat.values()): enlace.fechar()
+        if self.encaminhador: self.encaminhador.fechar()
+        self.aplicador.fechar()
+        self.salvar_posicoes()
+        with self.lock: recebidos = list(self.conexoes_recebidas)
+        for conn in recebidos:
+            try: conn.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+        self.pool_clientes.fechar()
+        self.pool_replicacao.fechar()
+        self.log_replicacao.fechar()
         print(f"[Nó {self.id_no}] Parado.")
 
 if __name__ == "__main__":
     if len(sys.argv) < 2: sys.exit(1)
     id_no_args = int(sys.argv[1])
+    # Modo do servidor opcional: python node.py <id> [thread|async]
+    modo_args = sys.argv[2] if len(sys.argv) > 2 else None
     
     dir_logs = "logs"
     if not os.path.exists(dir_logs): os.makedirs(dir_logs)
@@ -216,7 +1830,7 @@ if __name__ == "__main__":
     sys.stdout = fp_log
     sys.stderr = fp_log
 
-    no = No(id_no_args)
+    no = No(id_no_args, modo_servidor=modo_args)
     try:
         while True: time.sleep(1)
     except KeyboardInterrupt:
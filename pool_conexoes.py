@@ -0,0 +1,196 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from mysql.connector import Error
+
+
+class ErroPool(Error):
+    """Falha ao obter conexão do pool (banco indisponível ou pool esgotado)."""
+
+
+class PoolConexoes:
+    """
+    Pool limitado de conexões MySQL.
+
+    Mantém entre `tamanho_min` e `tamanho_max` conexões abertas, descarta as
+    que ficam ociosas por mais de `ocioso_max` segundos e verifica a conexão
+    na retirada quando ela ficou parada por mais de `verificar_apos` segundos.
+    """
+
+    def __init__(self, nome, fabrica, tamanho_min=1, tamanho_max=8, ocioso_max=300.0,
+                 timeout_retirada=5.0, verificar_apos=1.0):
+        if tamanho_max < 1 or tamanho_min > tamanho_max:
+            raise ValueError(f"Tamanhos inválidos para o pool '{nome}': min={tamanho_min}, max={tamanho_max}")
+        self.nome = nome
+        self.fabrica = fabrica
+        self.tamanho_min = tamanho_min
+        self.tamanho_max = tamanho_max
+        self.ocioso_max = ocioso_max
+        self.timeout_retirada = timeout_retirada
+        self.verificar_apos = verificar_apos
+
+        self._livres = deque()  # (conexão, instante da devolução)
+        self._total = 0
+        self._cond = threading.Condition()
+        self._fechado = False
+
+        self._inicio = time.monotonic()
+        self._retiradas = 0
+        self._abertas = 0
+        self._descartadas = 0
+        self._timeouts = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+
+    def _abrir(self):
+        """Abre uma conexão nova pela fábrica; a vaga já deve estar reservada em _total."""
+        try:
+            conn = self.fabrica()
+        except Exception:
+            conn = None
+        if conn is None:
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            raise ErroPool(msg=f"Falha ao conectar ao Banco de Dados (pool '{self.nome}')")
+        with self._cond:
+            self._abertas += 1
+        return conn
+
+    def _fechar_conexao(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _conexao_saudavel(self, conn):
+        try:
+            return conn.is_connected()
+        except Exception:
+            return False
+
+    def _coletar_ociosas(self):
+        """Remove (sob o lock) as conexões ociosas além do mínimo e as retorna para fechamento."""
+        if self.ocioso_max is None:
+            return []
+        limite = time.monotonic() - self.ocioso_max
+        expiradas = []
+        # As mais antigas ficam à esquerda, pois as devoluções entram pela direita
+        while self._livres and self._total > self.tamanho_min and self._livres[0][1] < limite:
+            conn, _ = self._livres.popleft()
+            self._total -= 1
+            self._descartadas += 1
+            expiradas.append(conn)
+        return expiradas
+
+    def preencher(self):
+        """Abre conexões até atingir o tamanho mínimo. Falhas são toleradas."""
+        while True:
+            with self._cond:
+                if self._fechado or self._total >= self.tamanho_min:
+                    return
+                self._total += 1
+            try:
+                conn = self._abrir()
+            except ErroPool:
+                return
+            self.devolver(conn)
+
+    def retirar(self, timeout=None):
+        timeout = self.timeout_retirada if timeout is None else timeout
+        inicio = time.monotonic()
+        prazo = inicio + timeout
+        while True:
+            conn, precisa_abrir, ociosa_ha = None, False, 0.0
+            with self._cond:
+                expiradas = self._coletar_ociosas()
+                while not self._livres and self._total >= self.tamanho_max and not self._fechado:
+                    restante = prazo - time.monotonic()
+                    if restante <= 0:
+                        self._timeouts += 1
+                        raise ErroPool(msg=f"Pool '{self.nome}' esgotado ({self.tamanho_max} conexões em uso)")
+                    self._cond.wait(restante)
+                if self._fechado:
+                    raise ErroPool(msg=f"Pool '{self.nome}' fechado")
+                if self._livres:
+                    conn, devolvida_em = self._livres.pop()
+                    ociosa_ha = time.monotonic() - devolvida_em
+                else:
+                    self._total += 1
+                    precisa_abrir = True
+            for c in expiradas:
+                self._fechar_conexao(c)
+
+            if precisa_abrir:
+                conn = self._abrir()
+            elif ociosa_ha > self.verificar_apos and not self._conexao_saudavel(conn):
+                self.devolver(conn, descartar=True)
+                continue
+
+            espera = time.monotonic() - inicio
+            with self._cond:
+                self._retiradas += 1
+                self._espera_total += espera
+                self._espera_max = max(self._espera_max, espera)
+            return conn
+
+    def devolver(self, conn, descartar=False):
+        with self._cond:
+            if descartar or self._fechado:
+                self._total -= 1
+                self._descartadas += 1
+                self._cond.notify()
+            else:
+                self._livres.append((conn, time.monotonic()))
+                self._cond.notify()
+                conn = None
+        if conn is not None:
+            self._fechar_conexao(conn)
+
+    @contextmanager
+    def conexao(self, timeout=None):
+        """
+        Empresta uma conexão. Após erros de conexão do MySQL, ou se o uso for interrompido
+        por outra exceção (ex.: resultado lido pela metade), ela é descartada em vez de devolvida.
+        """
+        conn = self.retirar(timeout)
+        descartar = False
+        try:
+            yield conn
+        except Error as e:
+            descartar = not isinstance(e, ErroPool) and not self._conexao_saudavel(conn)
+            raise
+        except BaseException:
+            descartar = True
+            raise
+        finally:
+            self.devolver(conn, descartar=descartar)
+
+    def estatisticas(self):
+        with self._cond:
+            decorrido = max(time.monotonic() - self._inicio, 1e-9)
+            return {
+                'total': self._total,
+                'livres': len(self._livres),
+                'em_uso': self._total - len(self._livres),
+                'min': self.tamanho_min,
+                'max': self.tamanho_max,
+                'retiradas': self._retiradas,
+                'conexoes_abertas': self._abertas,
+                'conexoes_descartadas': self._descartadas,
+                'conexoes_por_segundo': round(self._abertas / decorrido, 4),
+                'timeouts': self._timeouts,
+                'espera_media_ms': round(1000 * self._espera_total / self._retiradas, 3) if self._retiradas else 0.0,
+                'espera_max_ms': round(1000 * self._espera_max, 3),
+            }
+
+    def fechar(self):
+        with self._cond:
+            self._fechado = True
+            livres = [c for c, _ in self._livres]
+            self._total -= len(livres)
+            self._livres.clear()
+            self._cond.notify_all()
+        for c in livres:
+            self._fechar_conexao(c)
@@ -0,0 +1,99 @@
+import json
+import struct
+
+# Cada frame é um inteiro de 4 bytes (big-endian) com o tamanho do corpo, seguido do JSON.
+# Como o primeiro byte de um frame menor que 16 MiB é sempre 0x00, ele nunca se confunde
+# com uma mensagem JSON crua (que começa com '{').
+CABECALHO = struct.Struct('!I')
+TAMANHO_MAX_FRAME = 16 * 1024 * 1024 - 1
+
+
+class ErroProtocolo(Exception):
+    """Frame inválido ou conexão encerrada no meio de um frame."""
+
+
+def codificar_frame(msg):
+    corpo = json.dumps(msg, separators=(',', ':'), default=str).encode()
+    if len(corpo) > TAMANHO_MAX_FRAME:
+        raise ErroProtocolo(f"Frame de {len(corpo)} bytes excede o limite de {TAMANHO_MAX_FRAME}")
+    return CABECALHO.pack(len(corpo)) + corpo
+
+
+def enviar_frame(sock, msg):
+    sock.sendall(codificar_frame(msg))
+
+
+class LeitorFrames:
+    """Lê frames de um socket reaproveitando o mesmo buffer de recepção entre leituras."""
+
+    def __init__(self, sock, tamanho_bloco=65536):
+        self.sock = sock
+        self._bloco = bytearray(tamanho_bloco)
+        self._visao = memoryview(self._bloco)
+        self._buffer = bytearray()
+        # Total recebido do socket, para quem precisa limitar a banda usada
+        self.bytes_lidos = 0
+
+    def _extrair(self):
+        if len(self._buffer) < CABECALHO.size:
+            return None
+        tamanho, = CABECALHO.unpack_from(self._buffer)
+        if tamanho > TAMANHO_MAX_FRAME:
+            raise ErroProtocolo(f"Tamanho de frame inválido: {tamanho}")
+        fim = CABECALHO.size + tamanho
+        if len(self._buffer) < fim:
+            return None
+        msg = json.loads(self._buffer[CABECALHO.size:fim])
+        del self._buffer[:fim]
+        return msg
+
+    def ler(self):
+        """Retorna a próxima mensagem, ou None se o outro lado encerrou a conexão."""
+        while True:
+            msg = self._extrair()
+            if msg is not None:
+                return msg
+            lidos = self.sock.recv_into(self._bloco)
+            self.bytes_lidos += lidos
+            if not lidos:
+                if self._buffer:
+                    raise ErroProtocolo("Conexão encerrada no meio de um frame")
+                return None
+            self._buffer += self._visao[:lidos]
+
+
+def iterar_resposta(leitor):
+    """
+    Gera os frames de uma resposta. Respostas em partes começam com `stream: True`
+    e terminam no frame com `fim: True`; as demais têm um único frame.
+    """
+    msg = leitor.ler()
+    if msg is None:
+        raise ErroProtocolo("Conexão encerrada antes da resposta")
+    yield msg
+    if not msg.get('stream'):
+        return
+    while not msg.get('fim'):
+        msg = leitor.ler()
+        if msg is None:
+            raise ErroProtocolo("Conexão encerrada no meio de uma resposta em partes")
+        yield msg
+
+
+def juntar_resposta(frames):
+    """Reúne os frames de uma resposta em um único dicionário com todas as linhas em `data`."""
+    frames = iter(frames)
+    resposta = dict(next(frames))
+    if not resposta.pop('stream', False):
+        return resposta
+    dados = []
+    for frame in frames:
+        if frame.get('status') == 'error':
+            resposta.update(status='error', message=frame.get('message'))
+        dados.extend(frame.get('rows', ()))
+    resposta['data'] = dados
+    return resposta
+
+
+def receber_resposta(leitor):
+    return juntar_resposta(iterar_resposta(leitor))
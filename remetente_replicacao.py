@@ -0,0 +1,100 @@
+import threading
+import time
+
+
+class RemetenteReplicacao:
+    """
+    Reenvia aos pares, em segundo plano, trechos do log de replicação que não chegaram a eles.
+
+    O envio normal (ver AgrupadorReplicacao) não repete nada. Quando uma mensagem de replicação
+    não é entregue a um par, `pendente(par, desde, ate)` registra as seqs (desde, ate] que ele
+    pode não ter. Uma única thread lê esses trechos do log em lotes de até `lote` entradas
+    (`ler_log(desde, limite)`) e os envia com `enviar(par, entradas)`, que retorna um Future com
+    a confirmação do par. Sem confirmação, o trecho é tentado de novo com espera crescente, até
+    `backoff_max` segundos. O par ignora as seqs que já recebeu (a seq identifica a mensagem),
+    então reenviar uma entrada que já tinha chegado nunca a aplica duas vezes.
+    """
+
+    def __init__(self, ler_log, enviar, lote=500, backoff_max=5.0, timeout=10.0):
+        self.ler_log = ler_log
+        self.enviar = enviar
+        self.lote = max(1, lote)
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self._pendentes = {}
+        self.ativo = True
+
+        self.reenviadas = 0
+        self.tentativas_falhas = 0
+
+        self._thread = threading.Thread(target=self._loop_reenvio, daemon=True)
+        self._thread.start()
+
+    def pendente(self, par, desde, ate):
+        """Registra que o `par` pode não ter recebido as seqs de `desde` (exclusive) a `ate`."""
+        with self.cond:
+            trecho = self._pendentes.get(par)
+            if trecho is None:
+                self._pendentes[par] = {'desde': desde, 'ate': ate, 'proxima': time.monotonic(), 'backoff': 0.0}
+            else:
+                trecho['desde'] = min(trecho['desde'], desde)
+                trecho['ate'] = max(trecho['ate'], ate)
+            self.cond.notify()
+
+    def _proximo(self):
+        """Espera até algum par pendente poder ser tentado de novo; retorna (par, desde), ou None ao fechar."""
+        with self.cond:
+            while self.ativo:
+                agora = time.monotonic()
+                prontos = [(trecho['proxima'], par) for par, trecho in self._pendentes.items()]
+                if prontos and min(prontos)[0] <= agora:
+                    par = min(prontos)[1]
+                    return par, self._pendentes[par]['desde']
+                self.cond.wait(min(prontos)[0] - agora if prontos else 1.0)
+            return None
+
+    def _loop_reenvio(self):
+        while True:
+            proximo = self._proximo()
+            if proximo is None:
+                return
+            par, desde = proximo
+            entradas = self.ler_log(desde, self.lote)
+            confirmado = False
+            if entradas:
+                try:
+                    confirmado = bool(self.enviar(par, entradas).result(self.timeout).get('ok'))
+                except Exception:
+                    confirmado = False
+            with self.cond:
+                trecho = self._pendentes.get(par)
+                if trecho is None:
+                    continue
+                if not entradas:
+                    # O log já não tem o trecho (foi compactado): o catch-up do par resolve com um snapshot
+                    del self._pendentes[par]
+                elif confirmado:
+                    self.reenviadas += len(entradas)
+                    trecho['desde'] = max(trecho['desde'], entradas[-1]['seq'])
+                    trecho['backoff'] = 0.0
+                    if trecho['desde'] >= trecho['ate']:
+                        del self._pendentes[par]
+                else:
+                    self.tentativas_falhas += 1
+                    trecho['backoff'] = min(self.backoff_max, max(0.1, trecho['backoff'] * 2))
+                    trecho['proxima'] = time.monotonic() + trecho['backoff']
+
+    def estatisticas(self):
+        with self.cond:
+            return {
+                'pendentes': {str(par): trecho['ate'] - trecho['desde'] for par, trecho in self._pendentes.items()},
+                'reenviadas': self.reenviadas,
+                'tentativas_falhas': self.tentativas_falhas,
+            }
+
+    def fechar(self, timeout=2.0):
+        with self.cond:
+            self.ativo = False
+            self.cond.notify()
+        self._thread.join(timeout)
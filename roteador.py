@@ -0,0 +1,117 @@
+import random
+import threading
+import time
+
+
+class Roteador:
+    """
+    Escolhe o nó que atende cada leitura a partir do desempenho observado pelo cliente.
+
+    Para cada nó são mantidas médias móveis exponenciais (peso `alfa`) da latência e da
+    taxa de erro, além do número de requisições em andamento. A escolha usa "power of two
+    choices": sorteia dois nós em rotação e fica com o de menor custo, o que evita que todos
+    os clientes corram para o mesmo nó ao mesmo tempo. Nós ainda sem medidas têm custo zero
+    e são experimentados primeiro.
+
+    Um nó que recusa a conexão sai da rotação na hora; outras falhas (tempo esgotado,
+    conexão perdida) o retiram depois de `max_falhas` seguidas. Uma thread sonda os nós
+    fora da rotação a cada `intervalo_sonda` segundos, com a função `sondar(no) -> bool`, e
+    os devolve à rotação quando respondem.
+    """
+
+    def __init__(self, sondar=None, alfa=0.2, max_falhas=3, intervalo_sonda=1.0):
+        self.sondar = sondar
+        self.alfa = alfa
+        self.max_falhas = max(1, max_falhas)
+        self.intervalo_sonda = intervalo_sonda
+        self.lock = threading.Lock()
+        self._nos = {}
+        self._sondando = False
+        self.retirados = 0
+        self.devolvidos = 0
+
+    def _estado(self, no):
+        chave = (no['ip'], no['port'])
+        estado = self._nos.get(chave)
+        if estado is None:
+            estado = self._nos[chave] = {'no': no, 'latencia': None, 'erro': 0.0, 'em_andamento': 0,
+                                         'falhas_seguidas': 0, 'fora_desde': None}
+        return estado
+
+    def _custo(self, estado):
+        latencia = estado['latencia'] or 0.0
+        return latencia * (1 + estado['em_andamento']) / max(1.0 - estado['erro'], 0.05)
+
+    def escolher(self, nos, excluir=()):
+        """Retorna o melhor nó de `nos` para uma leitura (None se todos foram excluídos)."""
+        excluidos = {(n['ip'], n['port']) for n in excluir}
+        with self.lock:
+            candidatos = [self._estado(n) for n in nos if (n['ip'], n['port']) not in excluidos]
+            if not candidatos:
+                return None
+            # Com todos fora da rotação, ainda vale tentar um deles em vez de desistir
+            em_rotacao = [e for e in candidatos if e['fora_desde'] is None] or candidatos
+            sorteados = random.sample(em_rotacao, min(2, len(em_rotacao)))
+            return min(sorteados, key=self._custo)['no']
+
+    def iniciar(self, no):
+        with self.lock:
+            self._estado(no)['em_andamento'] += 1
+
+    def registrar(self, no, latencia, ok, recusado=False):
+        """Registra o fim de uma requisição ao nó; `recusado` indica que a conexão nem foi aceita."""
+        with self.lock:
+            estado = self._estado(no)
+            estado['em_andamento'] = max(0, estado['em_andamento'] - 1)
+            estado['erro'] += self.alfa * ((0.0 if ok else 1.0) - estado['erro'])
+            if ok:
+                estado['falhas_seguidas'] = 0
+                anterior = estado['latencia']
+                estado['latencia'] = latencia if anterior is None else anterior + self.alfa * (latencia - anterior)
+                if estado['fora_desde'] is not None:
+                    estado['fora_desde'] = None
+                    self.devolvidos += 1
+                return
+            estado['falhas_seguidas'] += 1
+            if estado['fora_desde'] is None and (recusado or estado['falhas_seguidas'] >= self.max_falhas):
+                estado['fora_desde'] = time.monotonic()
+                self.retirados += 1
+                if self.sondar is not None and not self._sondando:
+                    self._sondando = True
+                    threading.Thread(target=self._loop_sonda, daemon=True).start()
+
+    def _loop_sonda(self):
+        while True:
+            time.sleep(self.intervalo_sonda)
+            with self.lock:
+                fora = [e for e in self._nos.values() if e['fora_desde'] is not None]
+                if not fora:
+                    self._sondando = False
+                    return
+            for estado in fora:
+                try:
+                    ok = self.sondar(estado['no'])
+                except Exception:
+                    ok = False
+                if ok:
+                    with self.lock:
+                        if estado['fora_desde'] is not None:
+                            estado.update(fora_desde=None, falhas_seguidas=0, erro=0.0, latencia=None)
+                            self.devolvidos += 1
+
+    def em_rotacao(self, no):
+        with self.lock:
+            return self._estado(no)['fora_desde'] is None
+
+    def estatisticas(self):
+        with self.lock:
+            return {
+                'nos': {f"{e['no']['ip']}:{e['no']['port']}": {
+                    'latencia_ms': round(1000 * e['latencia'], 3) if e['latencia'] is not None else None,
+                    'taxa_erro': round(e['erro'], 3),
+                    'em_andamento': e['em_andamento'],
+                    'em_rotacao': e['fora_desde'] is None,
+                } for e in self._nos.values()},
+                'retirados': self.retirados,
+                'devolvidos': self.devolvidos,
+            }
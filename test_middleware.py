@@ -1,3 +1,5 @@
+import asyncio
+import bisect
 import unittest
 from unittest.mock import MagicMock, patch
 import threading
@@ -6,11 +8,89 @@ import json
 import socket
 import os
 import sys
+import shutil
+import tempfile
+from concurrent.futures import Future
+from decimal import Decimal
 
 # Adiciona o diretório pai ao sys.path para importar o node
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from node import No
+from node import No, SQL_SALVAR_POSICAO
+from pool_conexoes import PoolConexoes, ErroPool
+from mysql.connector import FieldType, errors
+from mysql.connector.connection import MySQLConnection
+from mysql.connector.cursor import MySQLCursorPrepared
+from log_replicacao import LogReplicacao
+from remetente_replicacao import RemetenteReplicacao
+from arvore_merkle import ArvoreMerkle, folha_da_chave
+from detector_falhas import DetectorFalhas
+from aplicador_paralelo import AplicadorParalelo
+from analisador_sql import AnalisadorSql, _classificar, chave_de_escrita, chave_de_leitura, classificar, plano_distribuido, tokenizar
+import anel_hash
+from anel_hash import AnelHash
+from cache_leituras import CacheLeituras
+from instrucoes_preparadas import InstrucoesPreparadas
+from importador import Importador, ler_partes
+from cliente_bd import ClienteBD, ClienteBDAsync, idempotente
+from roteador import Roteador
+from enlace_pares import ErroEnlace
+from protocolo import LeitorFrames, enviar_frame, iterar_resposta, receber_resposta
+
+class ConexaoTransacional:
+    """
+    Conexão simulada que respeita transações: com autocommit, um comando fora de
+    start_transaction é confirmado sozinho; dentro, só no commit. `commits` guarda os
+    comandos de cada commit, e `falhar` é um SQL que levanta erro ao ser executado.
+    """
+
+    def __init__(self):
+        self.autocommit = True
+        self.em_transacao = False
+        self.pendentes = []
+        self.commits = []
+        self.rollbacks = 0
+        self.falhar = None
+
+    def is_connected(self):
+        return True
+
+    def start_transaction(self):
+        self.em_transacao = True
+
+    def commit(self):
+        if self.pendentes:
+            self.commits.append(self.pendentes)
+        self.pendentes, self.em_transacao = [], False
+
+    def rollback(self):
+        self.pendentes, self.em_transacao = [], False
+        self.rollbacks += 1
+
+    def cursor(self, **kwargs):
+        conn = self
+
+        class Cursor:
+            rowcount = 1
+            description = None
+
+            def execute(self, sql, params=None):
+                if sql == conn.falhar:
+                    raise errors.DatabaseError(msg="falha simulada")
+                conn.pendentes.append((sql, params))
+                if conn.autocommit and not conn.em_transacao:
+                    conn.commit()
+
+            def fetchmany(self, tamanho=None):
+                return []
+
+            def close(self):
+                pass
+        return Cursor()
+
+    def close(self):
+        pass
+
 
 class TesteBancoDistribuido(unittest.TestCase):
     def setUp(self):
@@ -18,21 +98,24 @@ class TesteBancoDistribuido(unittest.TestCase):
         self.mock_conns = []
         self.mock_cursors = []
         self.arquivo_config = f"test_config_{threading.get_ident()}.json"
+        self.dir_dados = tempfile.mkdtemp(prefix='test_dados_')
 
     def tearDown(self):
         for no in self.nos:
             no.parar()
         if os.path.exists(self.arquivo_config):
             os.remove(self.arquivo_config)
+        shutil.rmtree(self.dir_dados, ignore_errors=True)
         time.sleep(1)
 
-    def criar_nos_com_config(self, ids_nos, porta_base):
+    def criar_nos_com_config(self, ids_nos, porta_base, config_replicacao=None, config_extra=None, **kwargs_no):
         info_nos = []
         for i in ids_nos:
             info_nos.append({"id": i, "ip": "127.0.0.1", "port": porta_base + i, "db_port": 3306 + i})
         
         with open(self.arquivo_config, 'w') as f:
-            json.dump({"nodes": info_nos}, f)
+            config = {"nodes": info_nos, "replicacao": dict({"diretorio_log": self.dir_dados}, **(config_replicacao or {}))}
+            json.dump(dict(config, **(config_extra or {})), f)
 
         nos_criados = []
         for i in ids_nos:
@@ -44,7 +127,7 @@ class TesteBancoDistribuido(unittest.TestCase):
             self.mock_cursors.append(mock_cursor)
             
             with patch('mysql.connector.connect', return_value=mock_conn):
-                no = No(i, caminho_config=self.arquivo_config)
+                no = No(i, caminho_config=self.arquivo_config, **kwargs_no)
                 self.nos.append(no)
                 nos_criados.append(no)
         return nos_criados
@@ -80,7 +163,9 @@ class TesteBancoDistribuido(unittest.TestCase):
         self.assertEqual(resposta['status'], 'success')
         time.sleep(2)
 
-        self.mock_cursors[0].execute.assert_called_with(sql)
+        # A escrita e a marca da sua seq vão na mesma transação
+        self.mock_cursors[0].execute.assert_any_call(sql)
+        self.mock_cursors[0].execute.assert_any_call(SQL_SALVAR_POSICAO, (0, 1))
         
         encontrado_n1 = any(call.args[0] == sql for call in self.mock_cursors[1].execute.call_args_list)
         encontrado_n2 = any(call.args[0] == sql for call in self.mock_cursors[2].execute.call_args_list)
@@ -91,6 +176,269 @@ class TesteBancoDistribuido(unittest.TestCase):
         self.assertTrue(encontrado_n1)
         self.assertTrue(encontrado_n2)
 
+    def test_escrita_e_seq_no_mesmo_commit(self):
+        print("\n--- Testando Escrita e Seq na Mesma Transação ---")
+        n0, = self.criar_nos_com_config([0], 10700)
+        time.sleep(1)
+        conn = ConexaoTransacional()
+        n0.pool_clientes.fechar()
+        n0.pool_clientes = PoolConexoes('clientes', lambda: conn, tamanho_min=1, tamanho_max=1)
+
+        sql = "INSERT INTO users (name) VALUES ('Teste')"
+        self.assertEqual(n0.executar_query(sql)['status'], 'success')
+        # A escrita não é confirmada antes de ganhar a seq: as duas saem no mesmo commit
+        self.assertEqual(conn.commits, [[(sql, None), (SQL_SALVAR_POSICAO, (0, 1))]])
+
+        # Se a seq não é gravada, a escrita é desfeita e não fica no log
+        conn.falhar = SQL_SALVAR_POSICAO
+        self.assertEqual(n0.executar_query("DELETE FROM users WHERE id = 1")['status'], 'error')
+        self.assertEqual(len(conn.commits), 1)
+        self.assertEqual(conn.rollbacks, 1)
+        self.assertEqual(n0.log_replicacao.ultimo_seq, 1)
+
+        # Um erro na própria escrita também desfaz a transação
+        conn.falhar = "UPDATE users SET name = 'x'"
+        self.assertEqual(n0.executar_query(conn.falhar)['status'], 'error')
+        self.assertEqual((len(conn.commits), conn.rollbacks, conn.em_transacao), (1, 2, False))
+
+    def test_query_parametrizada(self):
+        print("\n--- Testando Query Parametrizada ---")
+        n0, n1 = self.criar_nos_com_config([0, 1], 9100)
+        time.sleep(2)
+
+        sql = "UPDATE users SET name = %s WHERE id = %s"
+        for params in (['Ana', 1], ['Bia', 2]):
+            self.assertEqual(n0.executar_query(sql, params=params)['status'], 'success')
+        time.sleep(2)
+
+        # O comando vai aos pares com os parâmetros, não como SQL montado
+        for cursor in self.mock_cursors:
+            self.assertIn(((sql, ['Ana', 1]),), [(c.args,) for c in cursor.execute.call_args_list])
+            self.assertIn(((sql, ['Bia', 2]),), [(c.args,) for c in cursor.execute.call_args_list])
+        self.assertEqual(n0.log_replicacao.ler(0, 10)[1]['params'], ['Bia', 2])
+        self.assertEqual(n0.estatisticas()['instrucoes_preparadas']['reutilizadas'], 1)
+        self.assertEqual(n0.executar_query(sql, params="x")['status'], 'error')
+
+    def test_lote_de_comandos(self):
+        print("\n--- Testando CLIENT_BATCH ---")
+        n0, n1 = self.criar_nos_com_config([0, 1], 9200)
+        time.sleep(2)
+        for cursor in self.mock_cursors:
+            cursor.rowcount = 1
+
+        comandos = [{'sql': "INSERT INTO users (id, name) VALUES (1, 'Ana')"},
+                    {'sql': "UPDATE users SET name = %s WHERE id = %s", 'params': ['Bia', 1]}]
+        resposta = list(n0.responder({'type': 'CLIENT_BATCH', 'comandos': comandos, 'espera': 'todos'}))[0]
+        self.assertEqual(resposta['status'], 'success')
+        self.assertEqual(resposta['linhas'], [1, 1])
+        self.assertTrue(resposta['replicacao']['confirmada'])
+
+        sql = "INSERT INTO users (name) VALUES (%s)"
+        lista = [[f'u{i}'] for i in range(100)]
+        resposta = list(n0.responder({'type': 'CLIENT_BATCH', 'sql': sql, 'lista_params': lista, 'espera': 'todos'}))[0]
+        self.assertEqual(resposta['status'], 'success')
+        # Uma transação por lote e uma entrada do log por lote, aplicada do mesmo jeito no par
+        self.assertEqual(self.mock_conns[0].start_transaction.call_count, 2)
+        self.assertEqual(n0.log_replicacao.ultimo_seq, 2)
+        self.mock_cursors[1].executemany.assert_any_call(sql, lista)
+        self.assertIn(((comandos[1]['sql'], ['Bia', 1]),), [(c.args,) for c in self.mock_cursors[1].execute.call_args_list])
+
+        resposta = list(n0.responder({'type': 'CLIENT_BATCH', 'comandos': [{'sql': "SELECT * FROM users"}]}))[0]
+        self.assertEqual(resposta['status'], 'error')
+
+    def test_carga_em_massa(self):
+        print("\n--- Testando Carga em Massa ---")
+        n0, n1 = self.criar_nos_com_config([0, 1], 9300)
+        time.sleep(3)
+        self.assertEqual(n0.id_coordenador, 1)
+        for cursor in self.mock_cursors:
+            cursor.rowcount = 10
+
+        # Só o coordenador aceita cargas; os outros nós indicam quem ele é
+        resposta = list(n0.responder({'type': 'BULK_LOAD', 'tabela': 'users', 'colunas': ['name'], 'linhas': [['a']]}))[0]
+        self.assertEqual((resposta['status'], resposta['coordinator_id']), ('error', 1))
+        resposta = list(n1.responder({'type': 'BULK_LOAD', 'tabela': 'senhas', 'colunas': ['x'], 'linhas': [['a']]}))[0]
+        self.assertEqual(resposta['status'], 'error')
+
+        partes = [(['name', 'email'], [[f'u{i}', f'u{i}@x.com'] for i in range(j, j + 10)]) for j in range(0, 50, 10)]
+        importador = Importador([n0.eu, n1.eu], 'users', conexoes=2)
+        importador.cliente.id_coordenador = n0.id_no  # começa no nó errado, que recusa a parte e indica o coordenador
+        # Os envios em paralelo abrem novas conexões: cada nó continua com o seu banco simulado
+        with patch('mysql.connector.connect', side_effect=lambda **cfg: self.mock_conns[cfg['port'] - 3306]):
+            resumo = importador.importar(partes)
+        self.assertIsNone(resumo['erro'])
+        self.assertEqual((resumo['linhas'], resumo['partes'], resumo['nao_confirmadas']), (50, 5, 0))
+        self.assertEqual(importador.cliente.estatisticas()['coordenador']['id'], 1)
+        sql = "INSERT INTO `users` (`name`, `email`) VALUES (%s, %s)"
+        self.mock_cursors[1].executemany.assert_any_call(sql, partes[0][1])
+        self.mock_cursors[0].executemany.assert_any_call(sql, partes[4][1])
+        self.assertEqual(n1.estatisticas()['replicacao']['cargas'], {'partes': 5, 'linhas': 50})
+
+    def test_espera_de_acks(self):
+        print("\n--- Testando Espera por ACKs ---")
+        porta_base = 7500
+        n0, n1, n2 = self.criar_nos_com_config([0, 1, 2], porta_base)
+        time.sleep(1)
+
+        resposta = n0.executar_query("INSERT INTO users (name) VALUES ('Todos')", espera='todos')
+        self.assertEqual(resposta['status'], 'success')
+        self.assertEqual(resposta['replicacao']['acks'], 2)
+
+        n2.parar()
+        time.sleep(0.5)
+        inicio = time.time()
+        resposta = n0.executar_query("INSERT INTO users (name) VALUES ('Maioria')", espera='maioria')
+        self.assertEqual(resposta['status'], 'success')
+        self.assertEqual(resposta['replicacao']['necessarios'], 1)
+
+        # Um par fora do ar não deixa a escrita esperar mais que o timeout pedido
+        resposta = n0.executar_query("INSERT INTO users (name) VALUES ('Todos2')", espera='todos', timeout_espera=0.5)
+        self.assertEqual(resposta['status'], 'error')
+        self.assertEqual(resposta['replicacao']['acks'], 1)
+        self.assertLess(time.time() - inicio, 2.0)
+
+        resposta = n0.executar_query("INSERT INTO users (name) VALUES ('x')", espera='quase')
+        self.assertEqual(resposta['status'], 'error')
+
+    def test_catchup_apos_mensagens_perdidas(self):
+        print("\n--- Testando Catch-up da Replicação ---")
+        porta_base = 7600
+        n0, n1 = self.criar_nos_com_config([0, 1], porta_base)
+        time.sleep(1)
+
+        # Simula REPLICATEs perdidos enquanto o Nó 1 estava inacessível
+        n0.enlaces[1].enviar = lambda msg: None
+        perdidas = [f"INSERT INTO users (name) VALUES ('Perdido{i}')" for i in range(3)]
+        for sql in perdidas:
+            n0.executar_query(sql)
+        del n0.enlaces[1].enviar
+
+        # A próxima escrita revela a lacuna e o Nó 1 busca só o intervalo que falta
+        sql_final = "INSERT INTO users (name) VALUES ('Final')"
+        resposta = n0.executar_query(sql_final, espera='todos')
+        self.assertEqual(resposta['status'], 'success')
+
+        aplicadas = [c.args[0] for c in self.mock_cursors[1].execute.call_args_list if 'Perdido' in c.args[0] or 'Final' in c.args[0]]
+        self.assertEqual(aplicadas, perdidas + [sql_final])
+        self.assertEqual(n1.posicoes_aplicadas[0], 4)
+
+        # Reentregas de seqs já aplicadas são ignoradas
+        self.mock_cursors[1].execute.reset_mock()
+        self.assertTrue(n1.executar_query_replicada({'sql': sql_final, 'checksum': n0.calcular_checksum(sql_final),
+                                                     'origin': 0, 'seq': 4}))
+        self.mock_cursors[1].execute.assert_not_called()
+
+    def test_reenvio_do_log_apos_falha_de_envio(self):
+        print("\n--- Testando Reenvio da Replicação a partir do Log ---")
+        porta_base = 10200
+        n0, n1 = self.criar_nos_com_config([0, 1], porta_base)
+        time.sleep(1)
+
+        # O Nó 1 fica inacessível: a conexão cai e as novas tentativas falham
+        enlace = n0.enlaces[1]
+        enlace._conectar = MagicMock(side_effect=ErroEnlace("Nó 1 fora do ar"))
+        if enlace._sock is not None:
+            enlace._desconectar(enlace._sock, ErroEnlace("Nó 1 fora do ar"))
+        sql = "INSERT INTO users (name) VALUES ('Durante a queda')"
+        self.assertEqual(n0.executar_query(sql)['status'], 'success')
+        time.sleep(0.5)
+        self.assertGreaterEqual(n0.estatisticas()['replicacao']['reenvio']['tentativas_falhas'], 1)
+
+        # Quando o par volta, o remetente entrega o trecho que ficou no log
+        del enlace._conectar
+        limite = time.time() + 10
+        while n1.posicoes_aplicadas.get(0, 0) < 1 and time.time() < limite:
+            time.sleep(0.1)
+        self.assertTrue(any(c.args[0] == sql for c in self.mock_cursors[1].execute.call_args_list))
+        while n0.estatisticas()['replicacao']['reenvio']['pendentes'] and time.time() < limite:
+            time.sleep(0.1)
+        self.assertGreaterEqual(n0.estatisticas()['replicacao']['reenvio']['reenviadas'], 1)
+
+    def test_snapshot_com_log_compactado(self):
+        print("\n--- Testando Transferência de Snapshot ---")
+        porta_base = 7700
+        n0, n1 = self.criar_nos_com_config([0, 1], porta_base, config_replicacao={'retencao_log': 2})
+        time.sleep(1)
+
+        # O Nó 1 perde escritas que o log do Nó 0 já descartou na compactação
+        n0.enlaces[1].enviar = lambda msg: None
+        for i in range(5):
+            n0.executar_query(f"INSERT INTO users (name) VALUES ('Antigo{i}')")
+        # O agrupador envia o lote depois que a escrita retorna: ele tem que sair antes de o enlace voltar
+        while n0.agrupador.estatisticas()['entradas'] < 5: time.sleep(0.01)
+        del n0.enlaces[1].enviar
+        self.assertFalse(n0.log_replicacao.disponivel_desde(0))
+        # E o Nó 0 não recebe uma escrita do Nó 1, que não pode sumir com o snapshot
+        n1.enlaces[0].enviar = lambda msg: None
+        n1.executar_query("INSERT INTO users (name) VALUES ('Proprio')")
+        while n1.agrupador.estatisticas()['entradas'] < 1: time.sleep(0.01)
+        del n1.enlaces[0].enviar
+
+        self.mock_cursors[0].fetchall.return_value = []
+        self.mock_cursors[0].column_names = ('id', 'name', 'email')
+        self.mock_cursors[0].fetchmany.side_effect = [[(1, 'Ana', 'ana@x'), (2, 'Bia', 'bia@x')], []]
+
+        self.assertTrue(n1.sincronizar_com(0))
+        self.mock_conns[0].start_transaction.assert_any_call(consistent_snapshot=True, isolation_level='REPEATABLE READ',
+                                                             readonly=True)
+        self.mock_cursors[1].execute.assert_any_call("DELETE FROM `users`")
+        self.mock_cursors[1].executemany.assert_called_once_with(
+            "INSERT INTO `users` (`id`, `name`, `email`) VALUES (%s, %s, %s)", [(1, 'Ana', 'ana@x'), (2, 'Bia', 'bia@x')])
+        self.assertEqual(n1.posicoes_aplicadas[0], 5)
+        self.assertEqual(n1.ultimo_snapshot['linhas'], 2)
+        comandos = [c.args[0] for c in self.mock_cursors[1].execute.call_args_list]
+        refeita = max(i for i, sql in enumerate(comandos) if 'Proprio' in sql)
+        self.assertGreater(refeita, comandos.index("DELETE FROM `users`"))
+
+        # Depois do snapshot, só o delta segue pela replicação normal
+        resposta = n0.executar_query("INSERT INTO users (name) VALUES ('Novo')", espera='todos')
+        self.assertEqual(resposta['status'], 'success')
+        self.assertEqual(n1.posicoes_aplicadas[0], 6)
+
+    def test_replicacao_em_lotes(self):
+        print("\n--- Testando Replicação em Lotes (Group Commit) ---")
+        porta_base = 7800
+        n0, n1 = self.criar_nos_com_config([0, 1], porta_base, config_replicacao={'lote': {'janela_ms': 100}})
+        time.sleep(1)
+        commits_antes = self.mock_conns[1].commit.call_count
+
+        respostas = []
+        threads = [threading.Thread(target=lambda i=i: respostas.append(
+                       n0.executar_query(f"INSERT INTO users (name) VALUES ('Lote{i}')", espera='todos')))
+                   for i in range(10)]
+        # Escritas concorrentes abrem novas conexões no pool
+        with patch('mysql.connector.connect', return_value=self.mock_conns[0]):
+            for t in threads: t.start()
+            for t in threads: t.join()
+
+        self.assertEqual([r['status'] for r in respostas], ['success'] * 10)
+        self.assertEqual(n1.posicoes_aplicadas[0], 10)
+        # As 10 escritas chegam ao par em poucos lotes e são aplicadas em poucas transações
+        self.assertLess(n0.agrupador.estatisticas()['lotes'], 10)
+        self.assertLess(self.mock_conns[1].commit.call_count - commits_antes, 10)
+
+    def test_cache_de_leituras(self):
+        print("\n--- Testando Cache de Leituras ---")
+        porta_base = 7900
+        n0, n1 = self.criar_nos_com_config([0, 1], porta_base, config_extra={'cache': {'max_entradas': 10}})
+        time.sleep(1)
+        self.mock_cursors[1].fetchmany.side_effect = [[{'id': 1, 'name': 'Luiz'}], [],
+                                                      [{'id': 1, 'name': 'Luiz'}, {'id': 2, 'name': 'Ana'}], []]
+
+        sql = "SELECT * FROM users"
+        self.assertEqual(n1.executar_query(sql)['data'], [{'id': 1, 'name': 'Luiz'}])
+        self.mock_cursors[1].execute.reset_mock()
+        # Mesma consulta (com outra formatação) vem do cache, sem ir ao banco
+        self.assertEqual(n1.executar_query("SELECT  *  FROM users;")['data'], [{'id': 1, 'name': 'Luiz'}])
+        self.mock_cursors[1].execute.assert_not_called()
+
+        # Uma escrita replicada em users invalida o resultado
+        resposta = n0.executar_query("INSERT INTO users (name) VALUES ('Ana')", espera='todos')
+        self.assertEqual(resposta['status'], 'success')
+        self.assertEqual(n1.executar_query(sql)['data'], [{'id': 1, 'name': 'Luiz'}, {'id': 2, 'name': 'Ana'}])
+        self.assertEqual(n1.estatisticas()['cache']['acertos'], 1)
+        self.assertEqual(n1.estatisticas()['cache']['falhas'], 2)
+
     def test_operacao_leitura(self):
         print("\n--- Testando Operação de Leitura ---")
         porta_base = 9000
@@ -98,7 +446,7 @@ class TesteBancoDistribuido(unittest.TestCase):
         n0, n1 = criados
         
         time.sleep(2)
-        self.mock_cursors[0].fetchall.return_value = [{'id': 1, 'name': 'Luiz'}]
+        self.mock_cursors[0].fetchmany.side_effect = [[{'id': 1, 'name': 'Luiz'}], []]
 
         sql = "SELECT * FROM users"
         print(f"Executando '{sql}' no Nó 0")
@@ -106,11 +454,1114 @@ class TesteBancoDistribuido(unittest.TestCase):
 
         self.assertEqual(resposta['status'], 'success')
         self.assertEqual(resposta['data'], [{'id': 1, 'name': 'Luiz'}])
+
+        # Palavras de escrita dentro de literais ou comentários não tornam a leitura uma escrita
+        self.mock_cursors[0].fetchmany.side_effect = [[], []]
+        for sql in ("SELECT * FROM users WHERE name = 'UPDATEd'", "/* DELETE */ SELECT id FROM users"):
+            self.assertEqual(n0.executar_query(sql)['status'], 'success')
+        self.assertEqual(n0.log_replicacao.ultimo_seq, 0)
         
         self.mock_cursors[1].reset_mock()
         time.sleep(1)
         self.mock_cursors[1].execute.assert_not_called()
         print("Operação de leitura corretamente NÃO replicada.")
 
+    def test_enlace_persistente(self):
+        print("\n--- Testando Enlace Persistente ---")
+        porta_base = 7100
+        n0, n1 = self.criar_nos_com_config([0, 1], porta_base)
+        time.sleep(0.5)
+
+        # Várias requisições no mesmo enlace, cada uma casada pela sua resposta
+        futuros = [n0.requisitar_msg(n1.eu, {'type': 'ELECTION', 'id': 0}) for _ in range(20)]
+        respostas = [f.result(timeout=5) for f in futuros]
+        self.assertTrue(all(r['type'] == 'ELECTION_OK' and r['id'] == 1 for r in respostas))
+        self.assertEqual(sorted(r['resposta_a'] for r in respostas), sorted(set(r['resposta_a'] for r in respostas)))
+
+        time.sleep(3)
+        self.assertIn(0, n1.nos_vivos)
+        self.assertEqual(n0.enlaces[1].reconexoes, 1)
+
+    def test_resultado_em_partes(self):
+        print("\n--- Testando Resultado em Partes ---")
+        porta_base = 7200
+        n0, = self.criar_nos_com_config([0], porta_base)
+        n0.linhas_por_parte = 2
+        linhas = [{'id': i, 'name': 'x' * 5000} for i in range(5)]
+        self.mock_cursors[0].fetchmany.side_effect = [linhas[0:2], linhas[2:4], linhas[4:5], []]
+
+        # SQL maior que o antigo buffer de 8 KB e resposta maior que o de 16 KB
+        sql = "SELECT * FROM users WHERE name <> '" + 'y' * 10000 + "'"
+        with socket.create_connection(('127.0.0.1', porta_base)) as s:
+            enviar_frame(s, {'type': 'CLIENT_QUERY', 'sql': sql})
+            frames = list(iterar_resposta(LeitorFrames(s)))
+
+            self.assertTrue(frames[0]['stream'])
+            self.assertEqual([len(f['rows']) for f in frames[1:-1]], [2, 2, 1])
+            self.assertEqual(frames[-1], {'fim': True, 'total': 5})
+            self.mock_cursors[0].execute.assert_called_with(sql)
+
+            # A mesma conexão atende a requisição seguinte
+            enviar_frame(s, {'type': 'GET_COORDINATOR'})
+            self.assertEqual(receber_resposta(LeitorFrames(s))['coordinator_id'], 0)
+
+    def test_servidor_async(self):
+        print("\n--- Testando Servidor Async ---")
+        porta_base = 7300
+        n0, n1 = self.criar_nos_com_config([0, 1], porta_base, modo_servidor='async')
+        time.sleep(1)
+        self.assertEqual(n0.id_coordenador, 1)
+
+        self.mock_cursors[0].fetchmany.side_effect = [[{'id': 1, 'name': 'Luiz'}], []]
+        with socket.create_connection(('127.0.0.1', porta_base)) as s:
+            leitor = LeitorFrames(s)
+            enviar_frame(s, {'type': 'CLIENT_QUERY', 'sql': "SELECT * FROM users", 'id_req': 7})
+            resposta = receber_resposta(leitor)
+            self.assertEqual(resposta['data'], [{'id': 1, 'name': 'Luiz'}])
+            self.assertEqual(resposta['resposta_a'], 7)
+
+            sql = "INSERT INTO users (name) VALUES ('Async')"
+            enviar_frame(s, {'type': 'CLIENT_QUERY', 'sql': sql})
+            self.assertEqual(receber_resposta(leitor)['status'], 'success')
+
+        time.sleep(1)
+        self.mock_cursors[1].execute.assert_any_call(sql)
+
+    def test_modo_servidor_invalido(self):
+        with self.assertRaises(ValueError):
+            self.criar_nos_com_config([0], 7400, modo_servidor='processo')
+
+    def test_cliente_sdk(self):
+        print("\n--- Testando Cliente com Conexões Persistentes ---")
+        porta_base = 9400
+        n0, = self.criar_nos_com_config([0], porta_base)
+        n0.linhas_por_parte = 2
+        self.mock_cursors[0].fetchmany.side_effect = [[{'id': 1}, {'id': 2}], [{'id': 3}], []]
+
+        with ClienteBD([n0.eu], max_conexoes=2) as cliente:
+            resposta = cliente.query(n0.eu, "SELECT * FROM users")
+            self.assertEqual(resposta['data'], [{'id': 1}, {'id': 2}, {'id': 3}])
+            self.assertNotIn('resposta_a', resposta)
+            self.assertEqual(cliente.coordenador(), 0)
+
+            # Muitas requisições simultâneas dividem as 2 conexões em pipeline
+            futuros = [cliente.enviar(n0.eu, {'type': 'GET_STATS'}) for _ in range(50)]
+            self.assertTrue(all(f.result(timeout=5)['node'] == 0 for f in futuros))
+            self.assertIn(cliente.estatisticas()['conexoes'][f'127.0.0.1:{porta_base}']['abertas'], (1, 2))
+
+            async def consultar():
+                async with ClienteBDAsync([n0.eu]) as cliente_async:
+                    respostas = await asyncio.gather(*[cliente_async.estatisticas_no(n0.eu) for _ in range(10)])
+                    return respostas, await cliente_async.coordenador()
+            respostas, coordenador = asyncio.run(consultar())
+            self.assertTrue(all(r['status'] == 'success' for r in respostas))
+            self.assertEqual(coordenador, 0)
+
+        # Nó inacessível: a conexão é tentada `tentativas` vezes e o erro volta como resposta
+        cliente = ClienteBD(tentativas=2, intervalo_tentativa=0.01, timeout_conexao=0.5)
+        resposta = cliente.query({'id': 9, 'ip': '127.0.0.1', 'port': porta_base + 9}, "INSERT INTO users (name) VALUES ('x')")
+        self.assertEqual(resposta['status'], 'error')
+        self.assertEqual(cliente.estatisticas()['repetidas'], 1)
+
+        # Um nó que recebe a requisição e cai sem responder: a escrita não é reenviada, a leitura é
+        recebidas = []
+        servidor = socket.create_server(('127.0.0.1', porta_base + 8))
+        def aceitar():
+            while True:
+                try:
+                    conn, _ = servidor.accept()
+                except OSError:
+                    return
+                with conn:
+                    recebidas.append(LeitorFrames(conn).ler()['type'])
+        threading.Thread(target=aceitar, daemon=True).start()
+        destino = {'id': 8, 'ip': '127.0.0.1', 'port': porta_base + 8}
+        with ClienteBD(tentativas=3, intervalo_tentativa=0.01) as cliente:
+            self.assertEqual(cliente.query(destino, "DELETE FROM users")['status'], 'error')
+            self.assertEqual(recebidas, ['CLIENT_QUERY'])
+            self.assertEqual(cliente.estatisticas_no(destino)['status'], 'error')
+            self.assertEqual(recebidas, ['CLIENT_QUERY'] + ['GET_STATS'] * 3)
+        servidor.close()
+        self.assertTrue(idempotente({'type': 'CLIENT_QUERY', 'sql': "SELECT * FROM users"}))
+        self.assertFalse(idempotente({'type': 'CLIENT_QUERY', 'sql': "DELETE FROM users"}))
+
+    def test_roteamento_no_cliente(self):
+        print("\n--- Testando Roteamento no Cliente ---")
+        porta_base = 9500
+        n0, n1 = self.criar_nos_com_config([0, 1], porta_base)
+        time.sleep(3)
+        for cursor in self.mock_cursors:
+            cursor.fetchmany.return_value = []
+
+        with ClienteBD([n0.eu, n1.eu], roteamento={'intervalo_sonda': 0.2}) as cliente:
+            # Escritas vão ao coordenador, qualquer que seja o nó mais rápido
+            self.assertEqual(cliente.executar("INSERT INTO users (name) VALUES ('Rota')")['node'], 1)
+            self.assertTrue(all(cliente.executar("SELECT * FROM users")['status'] == 'success' for _ in range(10)))
+            nos = cliente.estatisticas()['roteamento']['nos']
+            self.assertTrue(all(e['latencia_ms'] is not None for e in nos.values()))
+
+            # O cliente asyncio toma as mesmas decisões de rota
+            async def executar_async():
+                async with ClienteBDAsync([n0.eu, n1.eu]) as cliente_async:
+                    escrita = await cliente_async.executar("INSERT INTO users (name) VALUES ('Rota')")
+                    # Uma de cada vez: leituras simultâneas abririam mais conexões com o nó do que
+                    # os cursores simulados do teste atendem
+                    leituras = [await cliente_async.executar("SELECT * FROM users") for _ in range(5)]
+                    return escrita, leituras, cliente_async.estatisticas()['coordenador']
+            escrita, leituras, coordenador = asyncio.run(executar_async())
+            self.assertEqual(escrita['node'], 1)
+            self.assertTrue(all(r['status'] == 'success' for r in leituras))
+            self.assertEqual((coordenador['id'], coordenador['consultas']), (1, 1))
+
+            # Um nó fora do ar sai da rotação: a leitura que falhou nele vai para o outro nó
+            n0.parar()
+            time.sleep(0.5)
+            for _ in range(50):
+                cliente.roteador.iniciar(n1.eu)  # o Nó 1 parece congestionado e o Nó 0 é tentado primeiro
+            self.assertEqual(cliente.executar("SELECT * FROM users")['node'], 1)
+            self.assertTrue(all(cliente.executar("SELECT * FROM users")['node'] == 1 for _ in range(10)))
+            self.assertFalse(cliente.roteador.em_rotacao(n0.eu))
+            self.assertEqual(cliente.estatisticas()['roteamento']['retirados'], 1)
+
+    def test_coordenador_em_cache(self):
+        print("\n--- Testando Coordenador em Cache no Cliente ---")
+        porta_base = 9600
+        # Detecção lenta, para que o Nó 1 ainda não tenha percebido a queda do Nó 0 no fim do teste
+        n0, n1 = self.criar_nos_com_config([0, 1], porta_base, config_extra={
+            'deteccao_falhas': {'intervalo_heartbeat': 0.5, 'desvio_minimo': 0.1, 'pausa_aceitavel': 1.0}})
+        time.sleep(3)
+        # O Nó 0 subiu antes e se declarou coordenador; o Nó 1 assumiu em seguida com um mandato maior
+        mandato = n1.mandato
+        self.assertEqual(n0.mandato, mandato)
+
+        with ClienteBD([n0.eu, n1.eu], assinar_coordenador=True) as assinante, ClienteBD([n0.eu, n1.eu]) as cliente:
+            # A resposta do SUBSCRIBE já traz o coordenador: nenhuma consulta a mais
+            self.assertEqual([assinante.coordenador() for _ in range(5)], [1] * 5)
+            self.assertEqual(assinante.estatisticas()['coordenador']['consultas'], 0)
+            self.assertEqual([cliente.coordenador() for _ in range(5)], [1] * 5)
+            self.assertEqual(cliente.estatisticas()['coordenador']['consultas'], 1)
+
+            # Troca de coordenador: o assinante é avisado, o outro cliente nota o mandato novo numa resposta
+            n0.assumir_coordenacao()
+            time.sleep(0.5)
+            self.assertEqual((n0.mandato, n1.mandato), (mandato + 1, mandato + 1))
+            self.assertEqual(assinante.id_coordenador, 0)
+            self.assertGreaterEqual(assinante.estatisticas()['coordenador']['avisos'], 1)
+            self.assertEqual(cliente.coordenador(), 1)
+            self.assertEqual(cliente.estatisticas_no(n1.eu)['mandato'], mandato + 1)
+            self.assertIsNone(cliente.id_coordenador)
+            self.assertEqual(cliente.coordenador(), 0)
+            self.assertEqual(cliente.estatisticas()['coordenador']['consultas'], 2)
+
+            # Uma falha de requisição ao coordenador guardado o descarta
+            n0.parar()
+            time.sleep(0.5)
+            self.assertEqual(cliente.estatisticas_no(n0.eu)['status'], 'error')
+            self.assertIsNone(cliente.id_coordenador)
+            self.assertEqual(cliente.coordenador(), 0)  # o Nó 1 ainda não percebeu a queda
+            self.assertEqual(assinante.estatisticas()['coordenador']['consultas'], 0)
+
+    def test_particionamento(self):
+        print("\n--- Testando Particionamento por Hash Consistente ---")
+        particionamento = {"ativo": True, "vnodes": 32, "fator_replicacao": 2, "tabelas": ["users"]}
+        n0, n1, n2 = self.criar_nos_com_config([0, 1, 2], 9700, config_extra={"particionamento": particionamento})
+        time.sleep(3)
+        # Uma linha que o Nó 0 não guarda e outra que ele guarda
+        alheia = next(k for k in range(100) if 0 not in n0.anel.donos('users', str(k)))
+        propria = next(k for k in range(100) if n0.anel.donos('users', str(k))[0] == 0)
+        donos = n0.anel.donos('users', str(alheia))
+
+        sql = f"INSERT INTO users (id, name) VALUES ({alheia}, 'Ana')"
+        resposta = n0.executar_query(sql)
+        self.assertEqual((resposta['status'], resposta['node'], resposta['encaminhada_por']), ('success', donos[0], 0))
+        time.sleep(2)
+        executou = [any(c.args[0] == sql for c in cursor.execute.call_args_list) for cursor in self.mock_cursors]
+        self.assertEqual(executou, [i in donos for i in range(3)])
+        self.assertEqual(n0.estatisticas()['particionamento']['encaminhadas'], 1)
+        self.assertEqual(n0.estatisticas()['particionamento']['ignoradas'], 1)
+
+        # Escrita numa linha própria: executada aqui, com os donos registrados na entrada do log
+        self.assertEqual(n0.executar_query(f"UPDATE users SET name = 'Bia' WHERE id = {propria}")['node'], 0)
+        self.assertEqual(n0.log_replicacao.ler(0, 10)[-1]['donos'], n0.anel.donos('users', str(propria)))
+
+        # Lotes e cargas em massa: cada linha só é gravada pelos seus donos
+        linhas = [[alheia, 'Caio'], [propria, 'Duda']]
+        coordenador = next(n for n in (n0, n1, n2) if n.id_coordenador == n.id_no)
+        resposta = list(coordenador.responder({'type': 'BULK_LOAD', 'tabela': 'users', 'colunas': ['id', 'name'],
+                                               'linhas': linhas}))[0]
+        self.assertEqual(resposta['status'], 'success')
+        comandos = [{'sql': f"DELETE FROM users WHERE id = {k}"} for k in (alheia, propria)]
+        self.assertEqual(n0.executar_lote({'comandos': comandos, 'espera': 'todos'})['status'], 'success')
+        for i, cursor in enumerate(self.mock_cursors):
+            gravadas = [linha for c in cursor.executemany.call_args_list if 'INSERT INTO `users`' in c.args[0] for linha in c.args[1]]
+            self.assertEqual(gravadas, [linha for linha in linhas if i in n0.anel.donos('users', str(linha[0]))])
+            apagadas = [c.args[0] for c in cursor.execute.call_args_list if c.args[0].startswith('DELETE FROM users WHERE id')]
+            self.assertEqual(apagadas, [c['sql'] for c, k in zip(comandos, (alheia, propria)) if i in n0.anel.donos('users', str(k))])
+
+        # Leitura de uma linha: vai ao dono; uma consulta que não dá para distribuir é recusada
+        self.mock_cursors[donos[0]].fetchmany.side_effect = [[{'id': alheia, 'name': 'Ana'}], []]
+        lida = n0.executar_query("SELECT * FROM users WHERE id = %s", params=[alheia])
+        self.assertEqual((lida['node'], lida['data']), (donos[0], [{'id': alheia, 'name': 'Ana'}]))
+        for sql in ("SELECT name, COUNT(*) FROM users GROUP BY name", "SELECT * FROM (SELECT * FROM users) AS u"):
+            resposta = n0.executar_query(sql)
+            self.assertEqual(resposta['status'], 'error')
+            self.assertIn("não pode ser distribuída", resposta['message'])
+        self.mock_cursors[0].fetchmany.side_effect = [[{'1': 1}], []]
+        self.assertEqual(n0.executar_query("SELECT 1")['status'], 'success')
+
+        # O cliente com o mesmo anel manda a query direto aos donos
+        with ClienteBD([n0.eu, n1.eu, n2.eu], particionamento=particionamento) as cliente:
+            self.assertEqual([n['id'] for n in cliente.donos(f"DELETE FROM users WHERE id = {alheia}")], donos)
+            self.assertIsNone(cliente.donos("DELETE FROM users WHERE name = 'Ana'"))
+            self.assertEqual(cliente.executar(f"DELETE FROM users WHERE id = {alheia}")['node'], donos[0])
+        self.assertEqual(n0.estatisticas()['particionamento']['encaminhadas'], 2)
+
+    def test_consulta_distribuida(self):
+        print("\n--- Testando Consulta Distribuída (scatter-gather) ---")
+        particionamento = {"ativo": True, "vnodes": 16, "fator_replicacao": 2}
+        criados = self.criar_nos_com_config([0, 1, 2], 9800, config_extra={"particionamento": particionamento})
+        time.sleep(3)
+
+        def partes(*linhas):
+            pendentes = [list(linhas), []]
+            return lambda n: pendentes.pop(0) if pendentes else []
+
+        # Cada nó devolve a sua parte já ordenada; o resultado intercala as partes e para no LIMIT
+        self.mock_cursors[0].fetchmany.side_effect = partes({'id': 1, 'name': 'ana'}, {'id': 4, 'name': 'Duda'})
+        self.mock_cursors[1].fetchmany.side_effect = partes({'id': 2, 'name': 'Bia'}, {'id': 5, 'name': 'eva'})
+        self.mock_cursors[2].fetchmany.side_effect = partes({'id': 3, 'name': 'caio'})
+        sql = "SELECT * FROM users WHERE id > 0 ORDER BY name LIMIT 3 OFFSET 1"
+        with patch('node.socket.create_connection', wraps=socket.create_connection) as conectar:
+            resposta = criados[0].executar_query(sql)
+        # A parte do próprio nó roda nele mesmo, sem uma conexão consigo
+        self.assertEqual(sorted(c.args[0][1] for c in conectar.call_args_list), [9801, 9802])
+        self.assertEqual(resposta['status'], 'success')
+        self.assertEqual([linha['name'] for linha in resposta['data']], ['Bia', 'caio', 'Duda'])
+        self.assertEqual(resposta['nos'], [0, 1, 2])
+        for cursor in self.mock_cursors:
+            locais = [c.args[0] for c in cursor.execute.call_args_list if 'INTERVAL(' in c.args[0]]
+            self.assertEqual(len(locais), 1)
+            self.assertIn("AND (id > 0) ORDER BY name LIMIT 4", locais[0])
+
+        # Agregados: cada nó calcula os parciais e o nó que recebeu a consulta os combina
+        parciais = [{'_p0': 2, '_p1': '30', '_q1': 2, '_p2': 'bia'}, {'_p0': 1, '_p1': '12', '_q1': 1, '_p2': 'Ana'},
+                    {'_p0': 0, '_p1': None, '_q1': 0, '_p2': None}]
+        for cursor, parcial in zip(self.mock_cursors, parciais):
+            cursor.fetchmany.side_effect = partes(parcial)
+        resposta = criados[1].executar_query("SELECT COUNT(*) AS n, AVG(idade), MIN(name) FROM users")
+        self.assertEqual(resposta['data'], [{'n': 3, 'AVG(idade)': Decimal(14), 'MIN(name)': 'Ana'}])
+        self.assertEqual(criados[1].estatisticas()['particionamento']['distribuidas'], 1)
+
+        # Colunas DECIMAL chegam como texto e são intercaladas e comparadas pelo valor numérico
+        for cursor in self.mock_cursors:
+            cursor.description = [('preco', FieldType.NEWDECIMAL, None, None, None, None, 1, 0, 63)]
+        self.mock_cursors[0].fetchmany.side_effect = partes({'id': 1, 'preco': Decimal('9.50')}, {'id': 4, 'preco': Decimal('100.00')})
+        self.mock_cursors[1].fetchmany.side_effect = partes({'id': 2, 'preco': Decimal('10.00')})
+        self.mock_cursors[2].fetchmany.side_effect = partes()
+        resposta = criados[0].executar_query("SELECT id, preco FROM users ORDER BY preco")
+        self.assertEqual([linha['id'] for linha in resposta['data']], [1, 2, 4])
+        for cursor in self.mock_cursors:
+            cursor.description = [('_p0', FieldType.NEWDECIMAL, None, None, None, None, 1, 0, 63)]
+        for cursor, parcial in zip(self.mock_cursors, ['9.50', '100.00', '10.00']):
+            cursor.fetchmany.side_effect = partes({'_p0': Decimal(parcial)})
+        resposta = criados[0].executar_query("SELECT MAX(preco) FROM users")
+        self.assertEqual(resposta['data'], [{'MAX(preco)': '100.00'}])
+
+    def test_niveis_de_consistencia(self):
+        print("\n--- Testando Níveis de Consistência ---")
+        n0, n1, n2 = self.criar_nos_com_config([0, 1, 2], 9900)
+        time.sleep(3)
+        for cursor in self.mock_cursors:
+            cursor.rowcount = 1
+        with ClienteBD([n0.eu]) as cliente:
+            # ALL: a escrita espera o ACK de todos os pares; ONE não espera nenhum
+            resposta = cliente.query(n0.eu, "UPDATE users SET name = 'Ana' WHERE id = 1", consistencia='ALL')
+            self.assertEqual(resposta['replicacao']['necessarios'], 2)
+            self.assertEqual(resposta['replicacao']['acks'], 2)
+            resposta = cliente.query(n0.eu, "UPDATE users SET name = 'Bia' WHERE id = 1", consistencia='ONE')
+            self.assertEqual(resposta['replicacao']['necessarios'], 0)
+            time.sleep(0.5)
+
+            # Réplicas na mesma versão: a leitura QUORUM fica no nó que a recebeu
+            self.mock_cursors[0].fetchmany.side_effect = [[{'id': 1, 'name': 'Bia'}], []]
+            resposta = cliente.query(n0.eu, "SELECT * FROM users WHERE id = 1", consistencia='QUORUM')
+            self.assertEqual((resposta['node'], resposta['consistencia']), (0, 'maioria'))
+            self.assertEqual(resposta['data'], [{'id': 1, 'name': 'Bia'}])
+
+            # Uma réplica mais nova: a leitura ALL é repassada a ela
+            n2.versao = lambda: {'0': 5, '2': 1}
+            self.mock_cursors[2].fetchmany.side_effect = [[{'id': 1, 'name': 'Caio'}], []]
+            resposta = cliente.query(n0.eu, "SELECT * FROM users WHERE id = 1", consistencia='todos')
+            self.assertEqual((resposta['node'], resposta['encaminhada_por']), (2, 0))
+            self.assertEqual(resposta['data'], [{'id': 1, 'name': 'Caio'}])
+
+            # Com uma réplica fora do ar, ALL falha e QUORUM ainda responde
+            n1.parar()
+            resposta = cliente.query(n0.eu, "SELECT * FROM users WHERE id = 1", consistencia='todos')
+            self.assertEqual(resposta['status'], 'error')
+            self.mock_cursors[2].fetchmany.side_effect = [[{'id': 1, 'name': 'Caio'}], []]
+            self.assertEqual(cliente.query(n0.eu, "SELECT * FROM users WHERE id = 1", consistencia='QUORUM')['node'], 2)
+
+            resposta = cliente.query(n0.eu, "SELECT * FROM users", consistencia='DOIS')
+            self.assertIn("inválido", resposta['message'])
+
+        latencias = n0.estatisticas()['consistencia']
+        self.assertEqual(latencias['todos:escrita']['requisicoes'], 1)
+        self.assertEqual(latencias['maioria:leitura']['requisicoes'], 2)
+        self.assertIn('p99_ms', latencias['um:escrita'])
+
+    def test_escritas_pelo_lider(self):
+        print("\n--- Testando Escritas pelo Líder ---")
+        n0, n1, n2 = self.criar_nos_com_config([0, 1, 2], 10000, config_replicacao={"escritas": "lider"})
+        time.sleep(3)
+        self.assertEqual(n0.id_coordenador, 2)
+        for cursor in self.mock_cursors:
+            cursor.rowcount = 1
+        with ClienteBD([n0.eu]) as cliente:
+            # A escrita recebida pelo Nó 0 é executada e sequenciada pelo coordenador
+            resposta = cliente.query(n0.eu, "UPDATE users SET name = 'Ana' WHERE id = 1", espera='todos')
+            self.assertEqual((resposta['status'], resposta['node'], resposta['encaminhada_por']), ('success', 2, 0))
+            resposta = cliente.requisitar(n0.eu, {'type': 'CLIENT_BATCH', 'sql': "INSERT INTO users (name) VALUES (%s)",
+                                                  'lista_params': [['Bia'], ['Caio']]})
+            self.assertEqual(resposta['node'], 2)
+            self.assertEqual(n2.log_replicacao.ultimo_seq, 2)
+            self.assertEqual(n0.log_replicacao.ultimo_seq, 0)
+            self.assertEqual(n0.estatisticas()['escritas']['repassadas_ao_lider'], 2)
+
+            # Leituras continuam no nó que as recebeu
+            self.mock_cursors[0].fetchmany.side_effect = [[{'id': 1, 'name': 'Ana'}], []]
+            self.assertEqual(cliente.query(n0.eu, "SELECT * FROM users WHERE id = 1")['node'], 0)
+
+        # Uma escrita repassada a quem não é mais o coordenador é recusada, não repassada de novo
+        resposta = list(n1.responder({'type': 'CLIENT_QUERY', 'sql': "DELETE FROM users WHERE id = 1", 'repassada': True}))
+        self.assertEqual(resposta[0]['status'], 'error')
+        self.assertEqual(n1.estatisticas()['escritas']['repassadas_ao_lider'], 0)
+
+    def test_leitura_das_proprias_escritas(self):
+        print("\n--- Testando Token de Posição (read-your-writes) ---")
+        n0, n1, n2 = self.criar_nos_com_config([0, 1, 2], 10100, config_replicacao={"timeout_posicao": 0.5})
+        time.sleep(3)
+        for cursor in self.mock_cursors:
+            cursor.rowcount = 1
+            cursor.fetchmany.side_effect = lambda n: []
+        with ClienteBD([n0.eu, n1.eu, n2.eu], ler_proprias_escritas=True) as cliente:
+            resposta = cliente.query(n2.eu, "UPDATE users SET name = 'Ana' WHERE id = 1")
+            self.assertEqual(resposta['posicao'], {'2': 1})
+            self.assertEqual(cliente.posicao_sessao(), {'2': 1})
+            # Só as leituras levam a posição da sessão
+            self.assertIsNone(cliente._posicao_da_leitura("DELETE FROM users WHERE id = 1", None))
+
+            # A leitura espera o Nó 0 aplicar uma escrita que ainda vai acontecer
+            threading.Timer(0.2, cliente.query, (n2.eu, "UPDATE users SET name = 'Bia' WHERE id = 1")).start()
+            resposta = cliente.query(n0.eu, "SELECT * FROM users WHERE id = 1", posicao={'2': 2})
+            self.assertEqual((resposta['status'], resposta['node']), ('success', 0))
+            self.assertGreaterEqual(n0.posicoes_aplicadas[2], 2)
+
+            # Sem alcançar a posição a tempo, a leitura vai para a origem da escrita
+            resposta = cliente.query(n0.eu, "SELECT * FROM users WHERE id = 1", posicao={'2': 50})
+            self.assertEqual((resposta['node'], resposta['encaminhada_por']), (2, 0))
+            self.assertEqual(n0.estatisticas()['replicacao']['leituras_com_posicao'], {'aguardadas': 2, 'repassadas': 1})
+
+            # A origem que recebe a leitura repassada também confere as outras origens da posição
+            resposta = cliente.query(n0.eu, "SELECT * FROM users WHERE id = 1", posicao={'2': 50, '1': 50})
+            self.assertEqual(resposta['status'], 'error')
+            self.assertIn("não alcançou a posição", resposta['message'])
+
+            resposta = cliente.query(n0.eu, "SELECT * FROM users", posicao={'7': 1})
+            self.assertIn("Posição inválida", resposta['message'])
+
+        # A parte de uma consulta distribuída não é repassada: sem a posição, responde com erro
+        resposta = list(n1.executar_query_em_partes("SELECT * FROM users", local=True, posicao={'2': 50}))
+        self.assertEqual(resposta[0]['status'], 'error')
+
+    def test_anti_entropia(self):
+        print("\n--- Testando Anti-entropia com Árvores de Merkle ---")
+        porta_base = 10300
+        n0, n1 = self.criar_nos_com_config([0, 1], porta_base, config_extra={'anti_entropia': {'ativo': True, 'intervalo': 3600}})
+        time.sleep(1)
+
+        # O Nó 0 divergiu do coordenador (Nó 1) em duas faixas de chaves
+        local, referencia = ArvoreMerkle(10), ArvoreMerkle(10)
+        for folha in range(0, 1024, 3):
+            local.adicionar(folha, folha * 7919)
+            referencia.adicionar(folha, folha * 7919)
+        local.adicionar(5, 123)
+        referencia.adicionar(700, 456)
+        n0.construir_arvore = lambda tabela, profundidade: (local, n0.versao())
+        n1.construir_arvore = lambda tabela, profundidade: (referencia, n1.versao())
+        self.mock_cursors[1].column_names = ('id', 'name')
+        self.mock_cursors[1].fetchmany.side_effect = [[(42, 'Correta')], []]
+
+        resumo = n0.comparar_com(n0.info_nos[1], 'users')
+        self.assertEqual(resumo['faixas'], 2)
+        self.assertEqual(resumo['linhas'], 1)
+        self.assertTrue(any('DELETE FROM `users`' in c.args[0] and c.args[0].endswith('IN (5, 700)')
+                            for c in self.mock_cursors[0].execute.call_args_list))
+        self.mock_cursors[0].executemany.assert_any_call("INSERT INTO `users` (`id`, `name`) VALUES (%s, %s)", [(42, 'Correta')])
+        # Só os ramos diferentes são consultados: bem menos hashes que as 1024 folhas
+        estatisticas = n0.estatisticas()['anti_entropia']
+        self.assertLess(estatisticas['hashes_recebidos'], 64)
+        self.assertEqual(estatisticas['linhas_corrigidas'], 1)
+
+        # Sob escritas contínuas as versões diferem: só a folha alterada pela escrita a caminho fica de fora
+        versao_antiga = n0.versao()
+        chave = next(k for k in range(10000) if folha_da_chave('users', k, 10) == 700)
+        self.mock_cursors[1].rowcount = 1
+        self.assertEqual(n1.executar_query(f"UPDATE users SET name = 'Nova' WHERE id = {chave}", espera='todos')['status'],
+                         'success')
+        n0.construir_arvore = lambda tabela, profundidade: (local, versao_antiga)
+        self.mock_cursors[1].fetchmany.side_effect = [[(42, 'Correta')], []]
+        self.mock_cursors[0].execute.reset_mock()
+        resumo = n0.comparar_com(n0.info_nos[1], 'users')
+        self.assertEqual((resumo['faixas'], resumo['em_transito']), (1, 1))
+        self.assertTrue(any('DELETE FROM `users`' in c.args[0] and c.args[0].endswith('IN (5)')
+                            for c in self.mock_cursors[0].execute.call_args_list))
+
+        # Uma escrita sem chave conhecida entre as versões adia a rodada
+        versao_antiga = n0.versao()
+        n1.executar_query("UPDATE users SET name = 'Nova' WHERE name = 'Velha'", espera='todos')
+        self.mock_cursors[0].execute.reset_mock()
+        self.assertTrue(n0.comparar_com(n0.info_nos[1], 'users')['adiada'])
+        self.assertFalse(any('DELETE' in c.args[0] for c in self.mock_cursors[0].execute.call_args_list))
+
+        # A árvore de uma comparação abandonada é descartada depois de `validade_arvore`
+        n1.arvores_pedidas[(9, 'users')] = (referencia, {}, time.monotonic() - n1.validade_arvore - 1)
+        n0.comparar_com(n0.info_nos[1], 'users')
+        self.assertEqual(list(n1.arvores_pedidas), [(0, 'users')])
+
+    def test_anti_entropia_invalida(self):
+        with self.assertRaises(ValueError):
+            self.criar_nos_com_config([0], 10400, config_extra={'anti_entropia': {'ativo': True},
+                                                                 'particionamento': {'ativo': True}})
+
+
+    def test_deteccao_rapida_de_falha_do_coordenador(self):
+        print("\n--- Testando Detecção de Falhas (phi accrual) ---")
+        porta_base = 10500
+        n0, n1 = self.criar_nos_com_config([0, 1], porta_base, config_extra={
+            'deteccao_falhas': {'intervalo_heartbeat': 0.1, 'desvio_minimo': 0.05, 'pausa_aceitavel': 0.2}})
+        time.sleep(2)
+        self.assertEqual(n0.id_coordenador, 1)
+        self.assertEqual(n0.estatisticas()['deteccao_falhas']['declarados_offline'], 0)
+
+        n1.parar()
+        inicio = time.monotonic()
+        while n0.id_coordenador != 0 and time.monotonic() - inicio < 10:
+            time.sleep(0.05)
+        # Com o prazo fixo, a queda do coordenador levava de 10 a 15 s para ser percebida
+        self.assertEqual(n0.id_coordenador, 0)
+        self.assertLess(time.monotonic() - inicio, 3.0)
+        self.assertEqual(n0.estatisticas()['deteccao_falhas']['declarados_offline'], 1)
+
+
+    def test_aplicacao_lenta_nao_derruba_o_coordenador(self):
+        print("\n--- Testando Heartbeats durante uma Replicação Lenta ---")
+        porta_base = 10600
+        n0, n1 = self.criar_nos_com_config([0, 1], porta_base, config_extra={
+            'deteccao_falhas': {'intervalo_heartbeat': 0.1, 'desvio_minimo': 0.05, 'pausa_aceitavel': 0.2}})
+        time.sleep(2)
+        self.assertEqual(n0.id_coordenador, 1)
+        mandato = n0.mandato
+
+        # A escrita leva 3 s para ser aplicada no Nó 0, bem mais que o prazo de detecção (~0,6 s)
+        self.mock_cursors[0].execute.side_effect = lambda sql, *args: time.sleep(3) if 'Lenta' in str(sql) else None
+        resposta = n1.executar_query("INSERT INTO users (name) VALUES ('Lenta')", espera='todos')
+        self.assertEqual(resposta['status'], 'success')
+
+        self.assertEqual(n0.id_coordenador, 1)
+        self.assertEqual(n0.mandato, mandato)
+        self.assertEqual(n0.estatisticas()['deteccao_falhas']['declarados_offline'], 0)
+
+
+class TesteAnelHash(unittest.TestCase):
+    def test_donos_distintos_e_distribuicao(self):
+        anel = AnelHash([0, 1, 2], vnodes=64, fator_replicacao=2)
+        donos = [anel.donos('users', k) for k in range(3000)]
+        self.assertTrue(all(len(set(d)) == 2 for d in donos))
+        # Com nós virtuais, cada nó é o principal de cerca de 1/3 das chaves
+        for id_no in range(3):
+            self.assertAlmostEqual(sum(d[0] == id_no for d in donos) / 3000, 1 / 3, delta=0.08)
+        self.assertEqual(AnelHash([0], fator_replicacao=3).donos('users', 1), [0])
+
+    def test_faixas_dividem_as_chaves_entre_os_vivos(self):
+        anel = AnelHash([0, 1, 2], vnodes=16, fator_replicacao=2)
+        for vivos in ([0, 1, 2], [0, 2], [1]):
+            limites, responsaveis = anel.faixas(vivos)
+            for k in range(1000):
+                faixa = bisect.bisect(limites, anel_hash._posicao(f"users:{k}"))
+                self.assertEqual(responsaveis[faixa], next((d for d in anel.donos('users', k) if d in vivos), None))
+        # Com fator 1, as chaves do nó fora do ar ficam sem responsável
+        self.assertIn(None, AnelHash([0, 1], fator_replicacao=1).faixas([0])[1])
+
+    def test_novo_no_move_cerca_de_1_n_das_chaves(self):
+        antes = AnelHash([0, 1, 2, 3], vnodes=64, fator_replicacao=1)
+        depois = AnelHash([0, 1, 2, 3, 4], vnodes=64, fator_replicacao=1)
+        movidas = [k for k in range(5000) if antes.donos('users', k) != depois.donos('users', k)]
+        self.assertAlmostEqual(len(movidas) / 5000, 1 / 5, delta=0.06)
+        # Só vão para o nó novo; nenhuma chave troca entre os nós antigos
+        self.assertTrue(all(depois.donos('users', k) == [4] for k in movidas))
+
+class TesteArvoreMerkle(unittest.TestCase):
+    def montar(self, linhas, profundidade=8):
+        arvore = ArvoreMerkle(profundidade)
+        for folha, hash_linha in linhas:
+            arvore.adicionar(folha, hash_linha)
+        return arvore
+
+    def test_mesmas_linhas_em_qualquer_ordem(self):
+        linhas = [(i % 256, i * 31) for i in range(1000)]
+        self.assertEqual(self.montar(linhas).raiz, self.montar(linhas[::-1]).raiz)
+        self.assertNotEqual(self.montar(linhas).raiz, self.montar(linhas[1:]).raiz)
+        # Duas linhas iguais se anulariam no XOR; a contagem as distingue
+        self.assertNotEqual(self.montar([(3, 9), (3, 9)]).raiz, self.montar([]).raiz)
+
+    def test_desce_so_pelos_ramos_diferentes(self):
+        linhas = [(i % 256, i * 31) for i in range(1000)]
+        local = self.montar(linhas)
+        remota = self.montar(linhas + [(17, 5), (200, 6)])
+        consultados = []
+
+        def consultar(nivel, indices):
+            consultados.extend(indices)
+            return remota.hashes(nivel, indices)
+
+        self.assertEqual(local.folhas_diferentes(consultar), [17, 200])
+        self.assertLessEqual(len(consultados), 1 + 2 * 2 * 8)
+        self.assertEqual(local.folhas_diferentes(lambda nivel, indices: local.hashes(nivel, indices)), [])
+        self.assertEqual(local.folhas_diferentes(lambda nivel, indices: remota.hashes(nivel, indices), max_folhas=1), [17])
+
+
+class TesteDetectorFalhas(unittest.TestCase):
+    def test_suspeita_cresce_com_o_silencio(self):
+        detector = DetectorFalhas(0.1, limiar=8.0, desvio_minimo=0.01, pausa_aceitavel=0.0)
+        self.assertEqual(detector.phi('a', agora=0.0), 0.0)
+        for i in range(50):
+            detector.registrar('a', agora=i * 0.1)
+        ultimo = 4.9
+        self.assertLess(detector.phi('a', agora=ultimo + 0.1), 1.0)
+        self.assertFalse(detector.suspeito('a', agora=ultimo + 0.12))
+        self.assertTrue(detector.suspeito('a', agora=ultimo + 0.3))
+        self.assertLess(detector.phi('a', agora=ultimo + 0.2), detector.phi('a', agora=ultimo + 0.25))
+
+    def test_intervalos_variaveis_adiam_a_suspeita(self):
+        estavel = DetectorFalhas(0.1, desvio_minimo=0.01, pausa_aceitavel=0.0)
+        variavel = DetectorFalhas(0.1, desvio_minimo=0.01, pausa_aceitavel=0.0)
+        t_estavel = t_variavel = 0.0
+        for i in range(100):
+            t_estavel += 0.1
+            t_variavel += 0.05 if i % 2 else 0.15
+            estavel.registrar('a', agora=t_estavel)
+            variavel.registrar('a', agora=t_variavel)
+        self.assertTrue(estavel.suspeito('a', agora=t_estavel + 0.3))
+        self.assertFalse(variavel.suspeito('a', agora=t_variavel + 0.3))
+
+    def test_silencio_longo_recomeca_o_historico(self):
+        detector = DetectorFalhas(0.1, desvio_minimo=0.01, pausa_aceitavel=0.0)
+        for i in range(20):
+            detector.registrar('a', agora=i * 0.1)
+        # O par voltou depois de 60 s fora do ar: o intervalo não entra na média
+        detector.registrar('a', agora=61.9)
+        self.assertEqual(detector.estatisticas(agora=61.9)['pares']['a']['intervalo_medio_ms'], 100.0)
+        self.assertTrue(detector.suspeito('a', agora=62.3))
+
+
+class TesteRoteador(unittest.TestCase):
+    def setUp(self):
+        self.nos = [{'id': i, 'ip': '127.0.0.1', 'port': 1000 + i} for i in range(3)]
+
+    def test_escolhe_o_no_mais_rapido(self):
+        roteador = Roteador()
+        for no, latencia in zip(self.nos, (0.001, 0.050, 0.100)):
+            roteador.iniciar(no)
+            roteador.registrar(no, latencia, True)
+        # Com dois nós sorteados de três, o mais lento nunca vence
+        escolhidos = [roteador.escolher(self.nos)['id'] for _ in range(200)]
+        self.assertNotIn(2, escolhidos)
+        self.assertGreater(escolhidos.count(0), escolhidos.count(1))
+        self.assertEqual(roteador.escolher(self.nos, excluir=self.nos[:2])['id'], 2)
+        self.assertIsNone(roteador.escolher(self.nos, excluir=self.nos))
+
+        # Requisições em andamento também contam: o nó rápido congestionado perde a vez
+        for _ in range(100):
+            roteador.iniciar(self.nos[0])
+        self.assertEqual(roteador.escolher(self.nos[:2])['id'], 1)
+
+    def test_retira_e_sonda_nos_fora_do_ar(self):
+        sondados = []
+        vivo = threading.Event()
+        roteador = Roteador(sondar=lambda no: sondados.append(no['id']) or vivo.is_set(), max_falhas=2,
+                            intervalo_sonda=0.05)
+        roteador.iniciar(self.nos[0])
+        roteador.registrar(self.nos[0], 0.1, False, recusado=True)
+        self.assertFalse(roteador.em_rotacao(self.nos[0]))
+        self.assertTrue(all(roteador.escolher(self.nos)['id'] != 0 for _ in range(50)))
+
+        # Tempo esgotado só retira o nó depois de `max_falhas` seguidas
+        for _ in range(2):
+            self.assertTrue(roteador.em_rotacao(self.nos[1]))
+            roteador.iniciar(self.nos[1])
+            roteador.registrar(self.nos[1], 5.0, False)
+        self.assertFalse(roteador.em_rotacao(self.nos[1]))
+        self.assertEqual(roteador.escolher(self.nos)['id'], 2)
+
+        time.sleep(0.2)
+        self.assertIn(0, sondados)
+        vivo.set()
+        time.sleep(0.2)
+        self.assertTrue(roteador.em_rotacao(self.nos[0]) and roteador.em_rotacao(self.nos[1]))
+        self.assertEqual(roteador.estatisticas()['devolvidos'], 2)
+
+class TesteProtocolo(unittest.TestCase):
+    def test_frames_divididos_e_agrupados(self):
+        a, b = socket.socketpair()
+        with a, b:
+            leitor = LeitorFrames(b, tamanho_bloco=7)
+            grande = {'sql': 'x' * 50000}
+            enviar_frame(a, {'n': 1})
+            enviar_frame(a, grande)
+            enviar_frame(a, {'n': 2})
+            self.assertEqual(leitor.ler(), {'n': 1})
+            self.assertEqual(leitor.ler(), grande)
+            self.assertEqual(leitor.ler(), {'n': 2})
+            a.shutdown(socket.SHUT_WR)
+            self.assertIsNone(leitor.ler())
+
+class TesteAplicadorParalelo(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.ordem = []
+        self.em_andamento = 0
+        self.max_simultaneos = 0
+
+    def aplicar_lote(self, itens):
+        with self.lock:
+            self.em_andamento += 1
+            self.max_simultaneos = max(self.max_simultaneos, self.em_andamento)
+            self.ordem.append(('inicio', [i['entrada']['seq'] for i in itens]))
+        time.sleep(0.02)
+        with self.lock:
+            self.em_andamento -= 1
+            self.ordem.append(('fim', [i['entrada']['seq'] for i in itens]))
+        return [True] * len(itens)
+
+    def test_ordem_por_chave_e_paralelismo(self):
+        aplicador = AplicadorParalelo(0, self.aplicar_lote, workers=4, max_lote=1)
+        chaves = {}
+        futuros = []
+        for seq in range(1, 41):
+            chave = ('users', str(seq % 8))
+            chaves[seq] = chave
+            futuros.append(aplicador.despachar(1, {'seq': seq}, chave))
+        self.assertTrue(all(f.result(timeout=10) for f in futuros))
+
+        aplicadas = [seqs[0] for evento, seqs in self.ordem if evento == 'fim']
+        for chave in set(chaves.values()):
+            seqs_chave = [seq for seq in aplicadas if chaves[seq] == chave]
+            self.assertEqual(seqs_chave, sorted(seqs_chave))
+        self.assertGreater(self.max_simultaneos, 1)
+        self.assertEqual(aplicador.posicoes[1], 40)
+        aplicador.fechar()
+
+    def test_escrita_na_tabela_inteira_e_barreira(self):
+        aplicador = AplicadorParalelo(0, self.aplicar_lote, workers=4, max_lote=1)
+        futuros = [aplicador.despachar(1, {'seq': seq}, ('users', str(seq))) for seq in range(1, 5)]
+        futuros.append(aplicador.despachar(1, {'seq': 5}, ('users', None)))
+        futuros += [aplicador.despachar(1, {'seq': seq}, ('users', str(seq))) for seq in range(6, 9)]
+        self.assertTrue(all(f.result(timeout=10) for f in futuros))
+
+        inicio_tabela = self.ordem.index(('inicio', [5]))
+        fim_tabela = self.ordem.index(('fim', [5]))
+        self.assertTrue(all(self.ordem.index(('fim', [seq])) < inicio_tabela for seq in range(1, 5)))
+        self.assertTrue(all(self.ordem.index(('inicio', [seq])) > fim_tabela for seq in range(6, 9)))
+        self.assertEqual(aplicador.recebida(1), 8)
+        # Reentregas de seqs já despachadas não são aplicadas de novo
+        self.assertTrue(aplicador.despachar(1, {'seq': 3}, ('users', '3')).result(timeout=1))
+        self.assertEqual(len([e for e in self.ordem if e[0] == 'fim']), 8)
+        aplicador.fechar()
+
+
+class TesteCacheLeituras(unittest.TestCase):
+    def test_lru_e_ttl(self):
+        cache = CacheLeituras(max_entradas=2, ttl=0.2)
+        for sql in ("SELECT * FROM a", "SELECT * FROM b"):
+            _, ticket = cache.obter(sql)
+            cache.guardar(ticket, [{'x': sql}])
+        cache.obter("SELECT * FROM a")  # 'a' passa a ser a mais recente
+        _, ticket = cache.obter("SELECT * FROM c")
+        cache.guardar(ticket, [])
+        self.assertIsNotNone(cache.obter("SELECT * FROM a")[0])
+        self.assertIsNone(cache.obter("SELECT * FROM b")[0])
+        time.sleep(0.3)
+        self.assertIsNone(cache.obter("SELECT * FROM a")[0])
+        self.assertEqual(cache.estatisticas()['expiradas'], 1)
+
+    def test_invalidacao_por_tabela(self):
+        cache = CacheLeituras()
+        for sql in ("SELECT * FROM users", "SELECT * FROM users u JOIN pedidos p ON p.u = u.id", "SELECT * FROM pedidos"):
+            _, ticket = cache.obter(sql)
+            cache.guardar(ticket, [])
+        cache.invalidar({'users'})
+        self.assertIsNone(cache.obter("SELECT * FROM users")[0])
+        self.assertIsNone(cache.obter("SELECT * FROM users u JOIN pedidos p ON p.u = u.id")[0])
+        self.assertEqual(cache.obter("SELECT * FROM pedidos")[0], [])
+
+    def test_escrita_durante_leitura_nao_guarda_resultado_antigo(self):
+        cache = CacheLeituras()
+        _, ticket = cache.obter("SELECT * FROM users")
+        cache.invalidar({'users'})
+        cache.guardar(ticket, [{'id': 1}])
+        self.assertIsNone(cache.obter("SELECT * FROM users")[0])
+
+    def test_consultas_que_nao_vao_para_o_cache(self):
+        cache = CacheLeituras()
+        for sql in ("SELECT NOW()", "SELECT * FROM users FOR UPDATE", "SELECT RAND() FROM users"):
+            self.assertEqual(cache.obter(sql), (None, None))
+
+
+class TesteInstrucoesPreparadas(unittest.TestCase):
+    def test_reuso_por_conexao_e_lru(self):
+        preparadas = InstrucoesPreparadas(max_por_conexao=2)
+        conn = MagicMock()
+        conn.cursor.side_effect = lambda **kwargs: MagicMock()
+        for i in range(3):
+            cursor = preparadas.executar(conn, "SELECT * FROM users WHERE id = %s", [i])
+        # Mesmo cursor e o mesmo objeto str: o conector não prepara o comando de novo
+        self.assertEqual(conn.cursor.call_count, 1)
+        self.assertEqual(cursor.execute.call_count, 3)
+        self.assertEqual(preparadas.estatisticas()['reutilizadas'], 2)
+
+        preparadas.executar(conn, "SELECT * FROM a WHERE id = %s", [1])
+        preparadas.executar(conn, "SELECT * FROM b WHERE id = %s", [1])
+        cursor.close.assert_called_once()
+        # Outra conexão tem o seu próprio cache
+        outra = MagicMock()
+        preparadas.executar(outra, "SELECT * FROM users WHERE id = %s", [1])
+        outra.cursor.assert_called_once_with(prepared=True, dictionary=False)
+
+    def test_parametros_com_nome_nao_preparam_de_novo(self):
+        preparadas = InstrucoesPreparadas()
+        conn = MagicMock(spec=MySQLConnection)
+        conn.charset = 'utf8mb4'
+        conn.cursor.side_effect = lambda prepared=False, **kwargs: MySQLCursorPrepared(conn)
+        conn.cmd_stmt_prepare.side_effect = lambda sql, **kwargs: {'statement_id': 1, 'parameters': [None, None], 'columns': []}
+        conn.cmd_stmt_execute.return_value = {'affected_rows': 1, 'insert_id': 0, 'warning_count': 0, 'status_flag': 0}
+        for i in range(3):
+            preparadas.executar(conn, "UPDATE users SET name = %(nome)s WHERE id = %(id)s", {'id': i, 'nome': f'n{i}'})
+        # O conector prepara o comando uma única vez, com os valores na ordem dos marcadores
+        conn.cmd_stmt_prepare.assert_called_once()
+        self.assertEqual(conn.cmd_stmt_prepare.call_args.args[0], b"UPDATE users SET name = ? WHERE id = ?")
+        self.assertEqual(conn.cmd_stmt_execute.call_args.kwargs['data'], ['n2', 2])
+        self.assertEqual(preparadas.estatisticas()['reutilizadas'], 2)
+        with self.assertRaises(errors.ProgrammingError):
+            preparadas.executar(conn, "UPDATE users SET name = %(nome)s WHERE id = %(id)s", {'id': 1})
+
+    def test_comando_nao_preparavel(self):
+        preparadas = InstrucoesPreparadas()
+        conn = MagicMock()
+        preparado, comum = MagicMock(), MagicMock()
+        preparado.execute.side_effect = errors.ProgrammingError(errno=1295)
+        conn.cursor.side_effect = lambda prepared=False, **kwargs: preparado if prepared else comum
+        self.assertIs(preparadas.executar(conn, "LOCK TABLES users READ", []), comum)
+        self.assertIs(preparadas.executar(conn, "LOCK TABLES users READ", []), comum)
+        self.assertEqual(preparado.execute.call_count, 1)
+
+        # Com marcadores com nome, o cursor comum recebe o comando e o dicionário originais
+        sql, params = "SHOW TABLES LIKE %(padrao)s", {'padrao': 'users'}
+        self.assertIs(preparadas.executar(conn, sql, params), comum)
+        preparado.execute.assert_called_with("SHOW TABLES LIKE %s", ['users'])
+        comum.execute.assert_called_with(sql, params)
+
+
+class TesteAnalisadorSql(unittest.TestCase):
+    def test_chave_de_escrita(self):
+        self.assertEqual(chave_de_escrita("INSERT INTO users (id, name) VALUES (5, 'a, b)')"), ('users', '5'))
+        self.assertEqual(chave_de_escrita("UPDATE users SET email = 'x' WHERE id = 3"), ('users', '3'))
+        self.assertEqual(chave_de_escrita("DELETE FROM `users` WHERE id = '7'"), ('users', '7'))
+        # Sem chave identificável: vale para a tabela inteira
+        self.assertEqual(chave_de_escrita("INSERT INTO users (name) VALUES ('x')"), ('users', None))
+        self.assertEqual(chave_de_escrita("INSERT INTO users (id) VALUES (1), (2)"), ('users', None))
+        self.assertEqual(chave_de_escrita("UPDATE users SET id = 4 WHERE id = 3"), ('users', None))
+        self.assertEqual(chave_de_escrita("UPDATE users SET n = 1 WHERE id = 3 OR id = 4"), ('users', None))
+        self.assertEqual(chave_de_escrita("DELETE FROM users WHERE name = 'Carol'"), ('users', None))
+        self.assertEqual(chave_de_escrita("UPDATE contas SET saldo = 0 WHERE numero = 9", {'contas': 'numero'}), ('contas', '9'))
+        self.assertIsNone(chave_de_escrita("CREATE TABLE t (id INT)"))
+        # Comandos parametrizados: a chave vem dos parâmetros
+        self.assertEqual(chave_de_escrita("UPDATE users SET name = %s WHERE id = %s", None, ['x', 8]), ('users', '8'))
+        self.assertEqual(chave_de_escrita("DELETE FROM users WHERE id = %(id)s", None, {'id': 2}), ('users', '2'))
+        self.assertEqual(chave_de_escrita("INSERT INTO users (id, name) VALUES (%s, %s)", None, [3, 'y']), ('users', '3'))
+
+    def test_chave_de_leitura(self):
+        self.assertEqual(chave_de_leitura("SELECT * FROM users WHERE id = 5"), ('users', '5'))
+        self.assertEqual(chave_de_leitura("select name from users u where u.id = %s limit 1", None, [7]), ('users', '7'))
+        self.assertEqual(chave_de_leitura("SELECT * FROM contas WHERE numero = 9", {'contas': 'numero'}), ('contas', '9'))
+        self.assertIsNone(chave_de_leitura("SELECT * FROM users"))
+        self.assertIsNone(chave_de_leitura("SELECT * FROM users WHERE id = 5 OR id = 6"))
+        self.assertIsNone(chave_de_leitura("SELECT * FROM users a, users b WHERE a.id = 1"))
+        self.assertIsNone(chave_de_leitura("SELECT * FROM users WHERE id = (SELECT MAX(id) FROM users)"))
+        self.assertIsNone(chave_de_leitura("SELECT COUNT(*) FROM users WHERE id = 1 GROUP BY name"))
+
+    def test_plano_distribuido(self):
+        plano = plano_distribuido("SELECT id, u.name FROM users u WHERE idade > %s ORDER BY u.name DESC, id LIMIT 2, 5")
+        self.assertEqual((plano.tabela, plano.origem, plano.onde), ('users', 'users u', 'idade > %s'))
+        self.assertEqual((plano.ordem, plano.limite, plano.deslocamento), ([('name', True), ('id', False)], 5, 2))
+        self.assertIsNone(plano.agregados)
+        self.assertEqual(plano_distribuido("SELECT COUNT(*), AVG(idade) AS media FROM users").agregados,
+                         [('COUNT', '*', 'COUNT(*)'), ('AVG', 'idade', 'media')])
+        # O que não dá para juntar a partir das partes de cada nó
+        for sql in ("SELECT name FROM users ORDER BY idade", "SELECT DISTINCT name FROM users",
+                    "SELECT name, COUNT(*) FROM users GROUP BY name", "SELECT COUNT(DISTINCT name) FROM users",
+                    "SELECT id, COUNT(*) FROM users", "SELECT * FROM users a JOIN users b ON a.id = b.id",
+                    "SELECT * FROM users WHERE id IN (SELECT id FROM users)", "SELECT * FROM users LIMIT %s"):
+            self.assertIsNone(plano_distribuido(sql), sql)
+
+    def test_classificacao(self):
+        leitura = classificar("SELECT * FROM users WHERE name = 'UPDATEd' -- DELETE")
+        self.assertEqual((leitura.tipo, leitura.escrita, leitura.tabelas), ('SELECT', False, {'users'}))
+        self.assertEqual(leitura.normalizado, "SELECT * FROM users WHERE name = 'UPDATEd'")
+        self.assertEqual(classificar("select u.id from db.users u join `pedidos` p on p.u = u.id").tabelas,
+                         {'users', 'pedidos'})
+        self.assertEqual(classificar("WITH r AS (SELECT id FROM users) SELECT * FROM r").tabelas, {'r', 'users'})
+        self.assertFalse(classificar("SELECT * FROM users FOR UPDATE").deterministica)
+        self.assertFalse(classificar("SHOW TABLES").escrita)
+        self.assertFalse(classificar("SET @x = 1").escrita)
+
+        self.assertEqual(classificar("/* x */ insert into users (name) values ('SELECT')").tabelas, {'users'})
+        self.assertEqual(classificar("UPDATE users u JOIN pedidos p ON p.u = u.id SET u.n = 1").tabelas,
+                         {'users', 'pedidos'})
+        self.assertEqual(classificar("DROP TABLE IF EXISTS a, b").tabelas, {'a', 'b'})
+        self.assertEqual(classificar("CREATE INDEX idx ON users (email)").tabelas, {'users'})
+        # Escritas sem tabela conhecida invalidam tudo
+        self.assertTrue(classificar("CALL limpar()").escrita)
+        self.assertIsNone(classificar("CALL limpar()").tabelas)
+
+    def test_memo_pela_forma(self):
+        analisador = AnalisadorSql()
+        for i in range(50):
+            c = analisador.classificar(f"SELECT * FROM users WHERE id = {i} AND name = 'u{i}' -- {i}")
+            self.assertEqual((c.tipo, c.tabelas), ('SELECT', {'users'}))
+            self.assertEqual(c.normalizado, f"SELECT * FROM users WHERE id = {i} AND name = 'u{i}'")
+        # Literais diferentes, mesma forma: uma só entrada
+        self.assertEqual(analisador.estatisticas(), {'entradas': 1, 'acertos': 49, 'falhas': 1})
+        # Os tokens remontados são os do tokenizador, com os literais de cada comando
+        for sql in ("UPDATE users SET name = 'a''b' WHERE id = 7", "SELECT `x'y` FROM t WHERE a = \"q\" AND b = 1e3",
+                    "SELECT 5'a' FROM t", "SELECT 1.2.3, t1.c FROM t"):
+            classificacao, tokens = analisador.analisar(sql)
+            self.assertEqual(tokens, tokenizar(sql))
+            self.assertEqual(classificacao, _classificar(sql))
+        self.assertEqual(chave_de_escrita("UPDATE users SET name = 'x' WHERE id = 8"), ('users', '8'))
+        self.assertEqual(chave_de_escrita("UPDATE users SET name = 'y' WHERE id = 9"), ('users', '9'))
+
+    def test_varios_comandos(self):
+        # O conector executa todos os comandos do texto: um DELETE depois do SELECT precisa ser replicado
+        multiplo = classificar("SELECT * FROM t; DELETE FROM t;")
+        self.assertEqual((multiplo.tipo, multiplo.escrita, multiplo.tabelas), ('DELETE', True, None))
+        self.assertIsNone(chave_de_escrita("UPDATE t SET a = 1 WHERE id = 1; DELETE FROM u WHERE id = 2"))
+        # Só leituras continuam leituras, mas não entram no cache nem viram consulta distribuída
+        leituras = classificar("SELECT * FROM t; SELECT * FROM u")
+        self.assertEqual((leituras.escrita, leituras.tabelas, leituras.deterministica), (False, None, False))
+        self.assertIsNone(plano_distribuido("SELECT * FROM t; SELECT * FROM u"))
+        # Um ';' dentro de texto não separa comandos
+        self.assertEqual(classificar("SELECT * FROM t WHERE a = 'x; DELETE FROM t'").tabelas, {'t'})
+
+
+class TesteImportador(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='test_importador_')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_partes_de_csv_e_ndjson(self):
+        caminho_csv = os.path.join(self.dir, 'usuarios.csv')
+        with open(caminho_csv, 'w', encoding='utf-8') as f:
+            f.write('name,email\n' + ''.join(f'u{i},{"" if i == 2 else f"u{i}@x.com"}\n' for i in range(5)))
+        partes = list(ler_partes(caminho_csv, 2))
+        self.assertEqual([len(linhas) for _, linhas in partes], [2, 2, 1])
+        self.assertEqual(partes[0][0], ['name', 'email'])
+        self.assertEqual(partes[1][1][0], ['u2', None])
+
+        caminho_ndjson = os.path.join(self.dir, 'usuarios.ndjson')
+        with open(caminho_ndjson, 'w', encoding='utf-8') as f:
+            f.write('{"name": "a", "email": "a@x.com"}\n\n{"email": "b@x.com", "name": "b"}\n{"name": "c"}\n')
+        partes = list(ler_partes(caminho_ndjson, 10))
+        self.assertEqual(partes, [(['name', 'email'], [['a', 'a@x.com'], ['b', 'b@x.com'], ['c', None]])])
+
+
+class TesteLogReplicacao(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='test_log_')
+        self.caminho = os.path.join(self.dir, 'replog.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_sequencia_persistente(self):
+        log = LogReplicacao(self.caminho, max_memoria=2)
+        for i in range(5):
+            self.assertEqual(log.anexar({'sql': f'q{i}'}), i + 1)
+        log.fechar()
+
+        log = LogReplicacao(self.caminho, max_memoria=2)
+        self.assertEqual(log.ultimo_seq, 5)
+        self.assertEqual(log.anexar({'sql': 'q5'}), 6)
+        # seq 2 já saiu da memória e é lida do arquivo
+        self.assertEqual([e['sql'] for e in log.ler(1, 3)], ['q1', 'q2', 'q3'])
+        self.assertEqual([e['seq'] for e in log.ler(4, 10)], [5, 6])
+        log.fechar()
+
+    def test_memoria_limitada_por_tamanho(self):
+        log = LogReplicacao(self.caminho, max_bytes_memoria=1000)
+        for i in range(10):
+            log.anexar({'sql': 'x' * 300})
+        self.assertLessEqual(log._bytes_memoria, 1000)
+        self.assertEqual(log._recentes[0]['seq'], 8)
+        # Entradas fora da memória vêm do arquivo; max_bytes limita a resposta, mas sempre traz uma
+        self.assertEqual([e['seq'] for e in log.ler(0, 10, max_bytes=700)], [1, 2])
+        self.assertEqual([e['seq'] for e in log.ler(8, 10, max_bytes=10)], [9])
+        self.assertEqual(len(log.ler(0, 100)), 10)
+        log.fechar()
+
+    def test_compactacao(self):
+        log = LogReplicacao(self.caminho, retencao=3)
+        for i in range(7):
+            log.anexar({'sql': f'q{i}'})
+        self.assertEqual(log.primeiro_seq, 5)
+        self.assertFalse(log.disponivel_desde(2))
+        self.assertTrue(log.disponivel_desde(4))
+        self.assertEqual([e['seq'] for e in log.ler(4, 10)], [5, 6, 7])
+        log.fechar()
+
+    def test_fsync_em_grupo(self):
+        log = LogReplicacao(self.caminho)
+        for i in range(20):
+            log.anexar({'sql': f'q{i}'})
+        self.assertTrue(log.sincronizar(20, timeout=2))
+        estatisticas = log.estatisticas()
+        self.assertEqual(estatisticas['sincronizado'], 20)
+        self.assertLessEqual(estatisticas['fsyncs'], 20)
+        log.fechar()
+
+    def test_descartar_e_truncar(self):
+        log = LogReplicacao(self.caminho)
+        for i in range(5):
+            log.anexar({'sql': f'q{i}'})
+        # Escrita cujo commit falhou: sai do log, e a seq é reaproveitada
+        log.descartar(5)
+        self.assertEqual(log.ultimo_seq, 4)
+        log.truncar(2)
+        self.assertEqual(log.anexar({'sql': 'nova'}), 3)
+        log.fechar()
+
+        log = LogReplicacao(self.caminho)
+        self.assertEqual([e['sql'] for e in log.ler(0, 10)], ['q0', 'q1', 'nova'])
+        log.fechar()
+
+    def test_recomecar(self):
+        log = LogReplicacao(self.caminho)
+        for i in range(3):
+            log.anexar({'sql': f'q{i}'})
+        # O banco já tem escritas que o log perdeu: os pares precisam de um snapshot
+        log.recomecar(10)
+        self.assertEqual(log.ultimo_seq, 10)
+        self.assertFalse(log.disponivel_desde(2))
+        self.assertEqual(log.anexar({'sql': 'q10'}), 11)
+        log.fechar()
+
+    def test_linha_incompleta_no_fim(self):
+        log = LogReplicacao(self.caminho)
+        log.anexar({'sql': 'q0'})
+        log.fechar()
+        with open(self.caminho, 'a') as f:
+            f.write('{"seq": 2, "sq')
+
+        log = LogReplicacao(self.caminho)
+        self.assertEqual(log.ultimo_seq, 1)
+        self.assertEqual(log.anexar({'sql': 'q1'}), 2)
+        log.fechar()
+        log = LogReplicacao(self.caminho)
+        self.assertEqual([e['sql'] for e in log.ler(0, 10)], ['q0', 'q1'])
+        log.fechar()
+
+
+class TesteRemetenteReplicacao(unittest.TestCase):
+    def test_reenvio_com_nova_tentativa(self):
+        log = [{'seq': s, 'sql': f'q{s}'} for s in range(1, 8)]
+        recebidas = []
+        falhas = [1]
+
+        def enviar(par, entradas):
+            futuro = Future()
+            if falhas[0]:
+                falhas[0] -= 1
+                futuro.set_exception(ConnectionError('par fora do ar'))
+            else:
+                recebidas.extend(e['seq'] for e in entradas)
+                futuro.set_result({'ok': True})
+            return futuro
+
+        remetente = RemetenteReplicacao(lambda desde, limite: [e for e in log if e['seq'] > desde][:limite],
+                                        enviar, lote=3)
+        remetente.pendente(2, 1, 4)
+        remetente.pendente(2, 3, 7)
+        limite = time.time() + 5
+        while remetente.estatisticas()['pendentes'] and time.time() < limite:
+            time.sleep(0.05)
+        remetente.fechar()
+
+        self.assertEqual(recebidas, [2, 3, 4, 5, 6, 7])
+        estatisticas = remetente.estatisticas()
+        self.assertEqual(estatisticas['reenviadas'], 6)
+        self.assertEqual(estatisticas['tentativas_falhas'], 1)
+        self.assertEqual(estatisticas['pendentes'], {})
+
+class TestePoolConexoes(unittest.TestCase):
+    def criar_pool(self, **kwargs):
+        self.abertas = []
+        def fabrica():
+            conn = MagicMock()
+            conn.is_connected.return_value = True
+            self.abertas.append(conn)
+            return conn
+        return PoolConexoes('teste', fabrica, **kwargs)
+
+    def test_reutiliza_conexoes(self):
+        pool = self.criar_pool(tamanho_min=1, tamanho_max=2)
+        pool.preencher()
+        for _ in range(10):
+            with pool.conexao() as conn:
+                conn.cursor().execute("SELECT 1")
+        stats = pool.estatisticas()
+        self.assertEqual(len(self.abertas), 1)
+        self.assertEqual(stats['retiradas'], 10)
+        self.assertEqual(stats['conexoes_abertas'], 1)
+
+    def test_limite_maximo_e_timeout(self):
+        pool = self.criar_pool(tamanho_min=0, tamanho_max=2, timeout_retirada=0.2)
+        c1, c2 = pool.retirar(), pool.retirar()
+        with self.assertRaises(ErroPool):
+            pool.retirar()
+        self.assertEqual(pool.estatisticas()['timeouts'], 1)
+
+        # Uma devolução libera quem está esperando
+        threading.Timer(0.1, pool.devolver, args=(c1,)).start()
+        self.assertIs(pool.retirar(timeout=2.0), c1)
+        self.assertGreater(pool.estatisticas()['espera_max_ms'], 50)
+
+    def test_despejo_de_ociosas_e_verificacao(self):
+        pool = self.criar_pool(tamanho_min=1, tamanho_max=3, ocioso_max=0.05, verificar_apos=0.0)
+        conns = [pool.retirar() for _ in range(3)]
+        for c in conns:
+            pool.devolver(c)
+        time.sleep(0.1)
+        conn = pool.retirar()
+        self.assertEqual(pool.estatisticas()['total'], 1)
+
+        # Conexão que falha na verificação é descartada e substituída
+        conn.is_connected.return_value = False
+        pool.devolver(conn)
+        nova = pool.retirar()
+        self.assertIsNot(nova, conn)
+        conn.close.assert_called()
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,9 +1,8 @@
-import socket
 import json
 import sys
-import random
 import os
 import time
+from cliente_bd import ClienteBD
 
 # Tenta importar bibliotecas específicas para cada SO
 try:
@@ -14,6 +13,9 @@ except ImportError:
     import tty
     SISTEMA = "unix"
 
+# Os nós avisam as trocas de coordenador: o modo de uso não consulta o coordenador a cada query
+cliente = ClienteBD(timeout=3.0, assinar_coordenador=True)
+
 # Cores ANSI
 class Cores:
     HEADER = '\033[95m'
@@ -92,23 +94,8 @@ def menu_interativo(opcoes, titulo):
         elif key == "q":
             return -1
 
-def _enviar_requisicao(ip, porta, mensagem, timeout=3.0):
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(timeout)
-            s.connect((ip, porta))
-            s.sendall(json.dumps(mensagem).encode())
-            dados = s.recv(16384)
-            if dados: return json.loads(dados.decode())
-    except Exception: pass
-    return None
-
 def encontrar_coordenador(nos):
-    for no in nos:
-        resposta = _enviar_requisicao(no['ip'], no['port'], {'type': 'GET_COORDINATOR'}, timeout=0.5)
-        if resposta and resposta.get('status') == 'success':
-            return resposta.get('coordinator_id')
-    return None
+    return cliente.coordenador(nos, timeout=0.5)
 
 def formatar_resultado(resultado):
     if resultado.get('status') == 'success':
@@ -134,6 +121,7 @@ def perfil_uso(nos):
     print(f"{Cores.OKGREEN}--- MODO DIONNE: OPERAÇÃO DIRETA ---{Cores.ENDC}\n")
     
     while True:
+        # ID guardado pelo cliente e atualizado pelos avisos dos nós: não custa uma ida à rede
         id_coord = encontrar_coordenador(nos)
         alvo = next((n for n in nos if n['id'] == id_coord), nos[0]) if id_coord is not None else nos[0]
         label = f"Coord {alvo['id']}" if id_coord is not None else f"Nó {alvo['id']}"
@@ -143,16 +131,14 @@ def perfil_uso(nos):
             if sql.lower() in ['q', 'exit', 'sair']: break
             if not sql: continue
 
-            res = _enviar_requisicao(alvo['ip'], alvo['port'], {'type': 'CLIENT_QUERY', 'sql': sql})
-            if res: formatar_resultado(res)
-            else: print(f"{Cores.FAIL}Falha na conexão.{Cores.ENDC}")
+            formatar_resultado(cliente.query(alvo, sql))
         except KeyboardInterrupt:
             break
 
 def perfil_teste(nos):
     while True:
         opcoes = [f"Nó {n['id']} ({n['ip']}:{n['port']})" for n in nos]
-        opcoes.extend(["Balanceamento Aleatório", "Automático (Coordenador)", "Voltar"])
+        opcoes.extend(["Balanceamento por Latência", "Automático (Coordenador)", "Voltar"])
         
         escolha = menu_interativo(opcoes, "--- MODO DIONNE: TESTES E DEPURAÇÃO ---")
         
@@ -162,7 +148,14 @@ def perfil_teste(nos):
         if escolha < len(nos):
             no_alvo = nos[escolha]
         elif escolha == len(nos):
-            no_alvo = random.choice(nos)
+            # Leituras no nó com melhor latência, escritas no coordenador
+            print(f"\n{Cores.OKCYAN}Roteamento automático{Cores.ENDC}")
+            try:
+                sql = input(f"SQL > ")
+                if sql: formatar_resultado(cliente.executar(sql, nos=nos))
+                input("\n[Pressione Enter]")
+            except KeyboardInterrupt:
+                break
         elif escolha == len(nos) + 1:
             id_coord = encontrar_coordenador(nos)
             no_alvo = next((n for n in nos if n['id'] == id_coord), nos[0])
@@ -172,9 +165,7 @@ def perfil_teste(nos):
             try:
                 sql = input(f"SQL > ")
                 if sql:
-                    res = _enviar_requisicao(no_alvo['ip'], no_alvo['port'], {'type': 'CLIENT_QUERY', 'sql': sql})
-                    if res: formatar_resultado(res)
-                    else: print(f"{Cores.FAIL}Erro.{Cores.ENDC}")
+                    formatar_resultado(cliente.query(no_alvo, sql))
                 input("\n[Pressione Enter]")
             except KeyboardInterrupt:
                 break